@@ -0,0 +1,196 @@
+""" Compile the sprites of sprites.py (and the beep) into one packed asset bundle.
+
+The bundle holds, for every sprite facing every direction with every flip, its bitmap
+(one bit per "fake pixel") and its pre-rendered tile mask (one bit per screen pixel, with
+the gaps between cells), laid out on two sheets, plus the PCM samples of the beep.
+The sprite sizes are checked when it is built. It is saved next to the game as
+assets-<hash>.bundle, where the hash covers the sprites and everything the tiles depend
+on, so a stale bundle is never loaded: changing a sprite or the cell size builds a new one.
+
+    python assets.py      # build the bundle ahead of time (before packaging the web version)
+"""
+import glob
+import hashlib
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+import core
+import sprites
+
+MAGIC   = b"SNKA"
+VERSION = 1
+# magic, version, key, cell width, cell height, border width, sprites, slot size (cells),
+# packed bitmaps sheet bytes, packed tiles sheet bytes, beep samples. Then the (width,
+# height) of every sprite (uint8), the packed sheets and the beep (float32).
+HEADER  = struct.Struct("<4sB32sBBBHBIII")
+FLIPS   = (None, "h", "v", "hv")
+VARIANTS = len(core.DIRECTIONS) * len(FLIPS)     # Tiles per sprite
+SPRITE_LISTS = (sprites.main_sprites, sprites.bonus_sprites, sprites.number_sprites)
+
+BEEP_FREQUENCY = 1760   # Hz
+BEEP_RATE      = 44100  # Samples per second
+BEEP_LENGTH    = 441    # Samples (the beep is played for 10 ms)
+
+
+def all_sprites():
+    """ Return the list of all the sprites, in bundle order. """
+    return [sprite for sprites_list in SPRITE_LISTS for sprite in sprites_list]
+
+
+def check_sizes(sizes):
+    """ Raise ValueError if a sprite of sprites.py doesn't have the size of its list:
+    sizes are the (width, height) of the main, bonus and number sprites, in cells. """
+    for sprites_list, (width, height) in zip(SPRITE_LISTS, sizes):
+        for sprite in sprites_list:
+            shape = np.array(sprite).shape
+            if shape != (height, width):
+                raise ValueError(f"Sprite of shape {shape} instead of {(height, width)}: "
+                                 f"{sprite}")
+
+
+def bundle_key(settings):
+    """ Return the hash (32 bytes) of everything a bundle is built from (see build). """
+    source = repr((VERSION, all_sprites(), settings, BEEP_FREQUENCY, BEEP_RATE, BEEP_LENGTH))
+    return hashlib.sha256(source.encode()).digest()
+
+
+def bundle_path(key, directory = "."):
+    return os.path.join(directory, f"assets-{key.hex()[:16]}.bundle")
+
+
+def save(data, key, directory = "."):
+    """ Save the bundle data (built with key) and delete the bundles built before it. """
+    path = bundle_path(key, directory)
+    core.save_atomically(path, data)
+    for old_path in glob.glob(os.path.join(directory, "assets-*.bundle")):
+        if old_path != path:
+            os.unlink(old_path)
+    return path
+
+
+def transform(sprite, direction, flip):
+    """ Return the lit cells of a sprite facing direction (a code) and flipped
+    (None, "h", "v" or "hv"), as a boolean array indexed [x, y] (like pygame.surfarray). """
+    # Number of counterclockwise turns from RIGHT to face UP, DOWN, LEFT, RIGHT:
+    bitmap = np.rot90(np.array(sprite, dtype=bool), (1, 3, 2, 0)[direction])
+    if flip is not None and "h" in flip:
+        bitmap = np.fliplr(bitmap)
+    if flip is not None and "v" in flip:
+        bitmap = np.flipud(bitmap)
+    return np.ascontiguousarray(bitmap.T)
+
+
+def build(settings):
+    """ Return the bytes of the bundle of the current sprites. settings are the cell width
+    and height (in pixels), the width of the gaps between cells and the sprite sizes
+    (see check_sizes). """
+    cell_width, cell_height, border_width, sizes = settings
+    check_sizes(sizes)
+    sprites_list = all_sprites()
+    shapes = np.array([np.array(sprite).shape[::-1] for sprite in sprites_list], dtype=np.uint8)
+    slot = int(shapes.max())
+    # Every sprite is a row of slot x slot squares, one per direction and flip
+    bitmaps = np.zeros((VARIANTS * slot, len(sprites_list) * slot), dtype=bool)
+    for row, sprite in enumerate(sprites_list):
+        for direction in range(len(core.DIRECTIONS)):
+            for i, flip in enumerate(FLIPS):
+                bitmap = transform(sprite, direction, flip)
+                x, y = (direction * len(FLIPS) + i) * slot, row * slot
+                bitmaps[x : x + bitmap.shape[0], y : y + bitmap.shape[1]] = bitmap
+    # A lit cell colors all of its pixels but the gaps between cells (on its top and left)
+    tiles = np.repeat(np.repeat(bitmaps, cell_width, axis=0), cell_height, axis=1)
+    tiles &= (np.arange(tiles.shape[0])[:, None] % cell_width >= border_width) \
+           & (np.arange(tiles.shape[1]) % cell_height >= border_width)
+    packed_bitmaps = zlib.compress(np.packbits(bitmaps).tobytes(), 9)
+    packed_tiles   = zlib.compress(np.packbits(tiles.T).tobytes(), 9)    # Rows of pixels
+    beep = np.sin(2 * np.pi * np.arange(BEEP_LENGTH) * BEEP_FREQUENCY / BEEP_RATE)
+    header = HEADER.pack(MAGIC, VERSION, bundle_key(settings),
+                         cell_width, cell_height, border_width, len(sprites_list), slot,
+                         len(packed_bitmaps), len(packed_tiles), BEEP_LENGTH)
+    return header + shapes.tobytes() + packed_bitmaps + packed_tiles \
+         + beep.astype("<f4").tobytes()
+
+
+class Bundle:
+    """ The assets of a bundle (see build): sprite bitmaps, tile masks and the beep. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, data, key = None):
+        (magic, version, self.key, self.cell_width, self.cell_height, self.border_width,
+         n_sprites, self.slot, bitmaps_size, tiles_size, beep_length) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a Snake asset bundle (or an unsupported version)")
+        if key is not None and self.key != key:
+            raise ValueError("The asset bundle was built from other sprites or settings")
+        offset = HEADER.size
+        self.shapes = np.frombuffer(data, np.uint8, 2 * n_sprites, offset).reshape(-1, 2).tolist()
+        offset += 2 * n_sprites
+        shape = (VARIANTS * self.slot, n_sprites * self.slot)
+        self.bitmaps = self._unpack(data[offset : offset + bitmaps_size], shape)
+        offset += bitmaps_size
+        shape = (shape[1] * self.cell_height, shape[0] * self.cell_width)
+        self.tiles = self._unpack(data[offset : offset + tiles_size], shape).T
+        offset += tiles_size
+        self.beep = np.frombuffer(data, dtype="<f4", count=beep_length, offset=offset) \
+                      .astype(np.float32)
+        self.index = {sprite: i for i, sprite in enumerate(all_sprites())}
+
+    def bitmap(self, sprite, direction, flip):
+        """ Return the bitmap of a sprite (see transform), or None if it isn't bundled. """
+        rect = self.rect(sprite, direction, flip)
+        if rect is None:
+            return None
+        x, y, width, height = rect
+        return self.bitmaps[x : x + width, y : y + height]
+
+    def rect(self, sprite, direction, flip):
+        """ Return the (x, y, width, height) of a sprite on the bitmaps sheet, in cells,
+        or None if it isn't bundled (multiply by the cell size for the tiles sheet). """
+        row = self.index.get(sprite)
+        if row is None:
+            return None
+        width, height = self.shapes[row]
+        if direction in (0, 1):     # Facing UP or DOWN: turned a quarter
+            width, height = height, width
+        return ((direction * len(FLIPS) + FLIPS.index(flip)) * self.slot, row * self.slot,
+                width, height)
+
+    @staticmethod
+    def _unpack(packed, shape):
+        bits = np.unpackbits(np.frombuffer(zlib.decompress(packed), dtype=np.uint8),
+                             count=shape[0] * shape[1])
+        return bits.reshape(shape).view(bool)
+
+
+def load(settings, directory = "."):
+    """ Return the Bundle of the current sprites and settings (see build), from its file
+    if it has been built already, otherwise build it and save it (if possible). """
+    key = bundle_key(settings)
+    try:
+        with open(bundle_path(key, directory), "rb") as file:
+            return Bundle(file.read(), key)
+    except (OSError, ValueError, struct.error, zlib.error):
+        pass                # Not built yet, or damaged: build it again
+    data = build(settings)
+    try:
+        save(data, key, directory)
+    except OSError:
+        pass                # Read-only directory (web version...): keep it in memory
+    return Bundle(data, key)
+
+
+def main():
+    import main as game     # pylint:disable=import-outside-toplevel
+    start = time.perf_counter()
+    data = build(game.ASSET_SETTINGS)
+    path = save(data, bundle_key(game.ASSET_SETTINGS))
+    print(f"{path}: {len(data)} bytes, built in "
+          f"{1000 * (time.perf_counter() - start):.1f} ms", file=sys.stderr)
+
+
+if __name__=="__main__":
+    main()
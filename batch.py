@@ -0,0 +1,200 @@
+""" Vectorized Snake engine: step thousands of independent games at once with NumPy arrays """
+import time
+
+import numpy as np
+
+import core
+import sprites
+
+from core import DIRECTIONS, direction_code
+
+NO_INPUT = -1
+
+
+class BatchGame:
+    """ N independent games following the rules of core.Game, stored as arrays.
+    Cells are stored as flat indices (y * width + x). Each snake body is a ring buffer
+    whose head is at body[game, head_index[game]] and which is length[game] cells long.
+    Games restart on their own after a game over (there is no pause). """
+# pylint:disable=too-many-instance-attributes
+    def __init__(self, n_games, width = core.GRID_WIDTH, height = core.GRID_HEIGHT,
+                 wrap_around = core.WRAP_AROUND, seed = None):
+        self.n_games  = n_games
+        self.width    = width
+        self.height   = height
+        self.wrap_around = wrap_around
+        self.capacity = width * height
+        self.rng = np.random.default_rng(seed)
+        self.games = np.arange(n_games)
+
+        self.body       = np.zeros((n_games, self.capacity), dtype=np.int32)
+        self.is_full    = np.zeros((n_games, self.capacity), dtype=bool)
+        self.occupied   = np.zeros((n_games, self.capacity), dtype=bool)
+        self.head_index = np.zeros(n_games, dtype=np.int64)
+        self.length     = np.zeros(n_games, dtype=np.int64)
+        self.direction  = np.zeros(n_games, dtype=np.int8)
+
+        self.food        = np.zeros(n_games, dtype=np.int32)
+        self.bonus       = np.full(n_games, -1, dtype=np.int32)   # left cell, -1: no bonus
+        self.bonus_kind  = np.zeros(n_games, dtype=np.int8)       # index in sprites.bonus_sprites
+        self.bonus_timer = np.zeros(n_games, dtype=np.int32)
+        self.next_bonus_timer = np.zeros(n_games, dtype=np.int32)
+        self.score       = np.zeros(n_games, dtype=np.int64)
+        self.final_score = np.zeros(n_games, dtype=np.int64)     # score at the last game over
+        self.games_played = np.zeros(n_games, dtype=np.int64)
+        self.ticks = 0
+
+        start = core.start_position(width, height) \
+              - core.START_DIRECTION * np.arange(core.START_LENGTH)[:, None]
+        start = start % (width, height)
+        # Ring buffer order goes from tail (slot 0) to head (slot START_LENGTH - 1)
+        self._start_cells = (start[:, 1] * width + start[:, 0])[::-1].astype(np.int32)
+        self.game_over(self.games)
+
+    def heads(self):
+        """ Return the flat cell index of every snake head. """
+        return self.body[self.games, self.head_index]
+
+    def tails(self):
+        """ Return the flat cell index of every snake tail. """
+        return self.body[self.games, (self.head_index - self.length + 1) % self.capacity]
+
+    def game_over(self, games):
+        """ Reset the selected games to their initial state. """
+        if len(games) == 0:
+            return
+        self.final_score[games] = self.score[games]
+        self.games_played[games] += 1
+        self.score[games] = 0
+        self.bonus[games] = -1
+        self._reset_next_bonus_timer(games)
+
+        length = len(self._start_cells)
+        self.occupied[games] = False
+        self.is_full[games] = False
+        self.body[games, :length] = self._start_cells
+        self.occupied[games[:, None], self._start_cells] = True
+        self.head_index[games] = length - 1
+        self.length[games] = length
+        self.direction[games] = direction_code(core.START_DIRECTION)
+        self.food[games] = -1
+        self.food[games] = self._sample_free(games)
+
+    def step(self, inputs = None):
+        """ Advance every game one tick. inputs is an array with a direction code
+        (or NO_INPUT) for every game. Return a boolean array of the games that ended. """
+        heads = self.heads()
+        head_x, head_y = heads % self.width, heads // self.width
+
+        if inputs is not None:
+            self._change_direction(inputs, head_x, head_y)
+
+        # Move: pop the tail unless it's full, in which case the snake grows.
+        tail_slots = (self.head_index - self.length + 1) % self.capacity
+        tail_full = self.is_full[self.games, tail_slots]
+        self.is_full[self.games, tail_slots] = False
+        popped = ~tail_full
+        self.occupied[self.games[popped], self.body[self.games[popped], tail_slots[popped]]] = False
+        self.length += tail_full
+
+        step_x, step_y = DIRECTIONS[self.direction].T
+        new_x, new_y = head_x + step_x, head_y + step_y
+        if self.wrap_around:
+            new_x %= self.width
+            new_y %= self.height
+            dead = np.zeros(self.n_games, dtype=bool)
+        else:
+            dead = (new_x < 0) | (new_x >= self.width) | (new_y < 0) | (new_y >= self.height)
+            new_x = new_x.clip(0, self.width  - 1)
+            new_y = new_y.clip(0, self.height - 1)
+        new_heads = (new_y * self.width + new_x).astype(np.int32)
+        dead |= self.occupied[self.games, new_heads]
+
+        self.head_index = (self.head_index + 1) % self.capacity
+        self.body[self.games, self.head_index] = new_heads
+        self.occupied[self.games, new_heads] = True
+
+        alive = ~dead
+        ate_food = alive & (new_heads == self.food)
+        ate_bonus = alive & (self.bonus >= 0) \
+                  & ((new_heads == self.bonus) | (new_heads == self.bonus + 1))
+        self.is_full[self.games, self.head_index] = ate_food | ate_bonus
+
+        self.score += ate_food * core.POINTS
+        self.next_bonus_timer -= ate_food
+        food_games = self.games[ate_food]
+        self.food[food_games] = self._sample_free(food_games)
+
+        self.score += ate_bonus * (core.POINTS * self.bonus_timer)
+        self.bonus[ate_bonus] = -1
+        self._reset_next_bonus_timer(self.games[ate_bonus])
+
+        self.game_over(self.games[dead])
+        self._handle_bonus_timers()
+        self.ticks += 1
+        return dead
+
+    def _change_direction(self, inputs, head_x, head_y):
+        """ Apply the inputs, unless they would turn the head back onto the neck. """
+        inputs = np.asarray(inputs)
+        wanted = inputs >= 0
+        codes = np.where(wanted, inputs, 0)
+        step_x, step_y = DIRECTIONS[codes].T
+        target = ((head_y + step_y) % self.height) * self.width + (head_x + step_x) % self.width
+        necks = self.body[self.games, (self.head_index - 1) % self.capacity]
+        wanted &= target != necks
+        self.direction[wanted] = codes[wanted]
+
+    def _handle_bonus_timers(self):
+        """ Handle bonus timers and create / remove bonuses. """
+        has_bonus = self.bonus >= 0
+        expired = has_bonus & (self.bonus_timer == 0)
+        self.bonus_timer -= has_bonus & ~expired
+        self.bonus[expired] = -1
+        self._reset_next_bonus_timer(self.games[expired])
+
+        spawn = self.games[~has_bonus & (self.next_bonus_timer == 0) & (self.score > 0)]
+        if len(spawn) > 0:
+            self.bonus_timer[spawn] = core.BONUS_TIMER
+            self.bonus_kind[spawn] = self.rng.integers(0, len(sprites.bonus_sprites), len(spawn))
+            self.bonus[spawn] = self._sample_free(spawn, pair = True)
+
+    def _reset_next_bonus_timer(self, games):
+        self.next_bonus_timer[games] = self.rng.normal(5.5, 0.5, len(games)).astype(np.int32)
+
+    def _sample_free(self, games, pair = False):
+        """ Return a random free cell for each of the selected games (-1 if the board is full).
+        pair = True: return the left cell of two free horizontally adjacent cells. """
+        if len(games) == 0:
+            return np.zeros(0, dtype=np.int32)
+        free = ~self.occupied[games]
+        rows = np.arange(len(games))
+        food = self.food[games]
+        free[rows[food >= 0], food[food >= 0]] = False
+        bonus = self.bonus[games]
+        free[rows[bonus >= 0], bonus[bonus >= 0]] = False
+        free[rows[bonus >= 0], bonus[bonus >= 0] + 1] = False
+        free = free.reshape(len(games), self.height, self.width)
+        if pair:
+            free = free[:, :, :-1] & free[:, :, 1:]
+        free = free.reshape(len(games), -1)
+        keys = self.rng.random(free.shape)
+        keys[~free] = -1
+        choice = keys.argmax(axis=1)
+        if pair:
+            choice = choice // (self.width - 1) * self.width + choice % (self.width - 1)
+        return np.where(free.any(axis=1), choice, -1).astype(np.int32)
+
+
+def measure_throughput(n_games = 4096, n_ticks = 1000, **kwargs):
+    """ Run n_ticks random inputs on n_games and return the game ticks per second. """
+    batch = BatchGame(n_games, **kwargs)
+    inputs = batch.rng.integers(NO_INPUT, len(DIRECTIONS), (n_ticks, n_games), dtype=np.int8)
+    start = time.perf_counter()
+    for tick_inputs in inputs:
+        batch.step(tick_inputs)
+    return n_games * n_ticks / (time.perf_counter() - start)
+
+
+if __name__=="__main__":
+    print(f"{measure_throughput() / 1e6:.2f} million ticks per second")
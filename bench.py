@@ -0,0 +1,248 @@
+""" Benchmarks of the game hot paths (tick, placement, sprites, snapshots, rewind, rendering,
+observations, mazes...).
+
+Runs without a display (SDL dummy drivers). Every board size runs in its own process,
+so that they don't share caches or allocations. The window is the default camera view
+(main.VIEW_WIDTH x main.VIEW_HEIGHT), whatever the board size. Results are printed
+(or saved with --output) as JSON lines, one per measurement:
+    {"benchmark": "update", "grid": "20x9", "length": 90, "us_per_call": 12.3, "calls": 2000}
+It fails if the autopilot decisions take MAX_DECISION_US or more (99th percentile of their
+time, and the slowest one in CPU time).
+
+    python bench.py                        # all the default board sizes
+    python bench.py --sizes 20x9,64x36 --output results.jsonl
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np   # pylint:disable=wrong-import-position
+
+from bot import Autopilot, hamiltonian_cycle   # pylint:disable=wrong-import-position
+from history import History                     # pylint:disable=wrong-import-position
+from observation import Observation             # pylint:disable=wrong-import-position
+
+SIZES   = ("20x9", "40x18", "80x36")
+FILLS   = (0.25, 0.5, 0.9, 1.0)      # Snake lengths, as a fraction of the board
+MIN_TIME = 0.2                       # Seconds spent on every measurement (at least)
+MAX_DECISION_US = 500                # Slowest autopilot decision allowed (see bot.SEARCH_CELLS)
+
+
+class CycleDriver:
+    """ Put a snake of some length on a Hamiltonian cycle and keep it on the cycle,
+    so that it can move forever without dying (food is removed, so it doesn't grow). """
+    def __init__(self, game, length):
+        import core     # pylint:disable=import-outside-toplevel
+        self.core  = core
+        self.game  = game
+        self.cycle = hamiltonian_cycle(game.board.width, game.board.height)
+        self.codes = [core.direction_code(np.subtract(self.cycle[(i + 1) % len(self.cycle)],
+                                                      self.cycle[i]))
+                      for i in range(len(self.cycle))]
+        self.step  = length - 1        # Index in the cycle of the head
+        snake = game.snake
+        game.board.clear()
+        snake.head_index = length - 1
+        snake.length = length
+        for i in range(length):
+            snake.x[i], snake.y[i] = self.cycle[i]
+            snake.directions[i] = self.codes[i - 1]
+            snake.are_full[i] = False
+            snake.slot_at[self.cycle[i]] = i
+            game.board.add_section(self.cycle[i])
+        snake.classify()
+        game.bonus = None
+        game.food.place(None)
+        game.pause = False
+
+    def next_direction(self):
+        """ Queue the direction that keeps the snake on the cycle. """
+        self.game.inputs.load((self.codes[self.step],))
+        self.step = (self.step + 1) % len(self.cycle)
+
+
+def measure(function, setup = None):
+    """ Call function repeatedly for at least MIN_TIME seconds.
+    Return (median microseconds per call, number of calls). """
+    times = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < MIN_TIME or len(times) < 5:
+        if setup is not None:
+            setup()
+        call_start = time.perf_counter()
+        function()
+        times += [time.perf_counter() - call_start,]
+    return float(np.median(times) * 1e6), len(times)
+
+
+def lengths(n_cells):
+    """ Snake lengths to benchmark on a board of n_cells cells """
+    return sorted({7, *(max(7, int(fill * n_cells)) for fill in FILLS)})
+
+
+def run_size(size):
+    """ Run all the benchmarks on one board size. Yield the result dicts. """
+    # pylint:disable=import-outside-toplevel,too-many-locals
+    width, height = (int(n) for n in size.split("x"))
+    import core
+    import mazes
+    import pygame
+    import main
+    pygame.init()
+    main.init_display()
+    main.BEEP = pygame.mixer.Sound(buffer=bytes(4))     # Silent: the mixer isn't needed
+    n_cells = width * height
+
+    def result(benchmark, length, timing):
+        return {"benchmark": benchmark, "grid": size, "length": length,
+                "us_per_call": round(timing[0], 3), "calls": timing[1]}
+
+    for length in lengths(n_cells):
+        game = main.Game(seed=0, width=width, height=height)
+        driver = CycleDriver(game, length)
+        yield result("update", length, measure(game.update, driver.next_direction))
+        yield result("check_collisions", length, measure(game.check_collisions))
+        yield result("get_sprites", length, measure(game.snake.get_sprites))
+        for pixels in (False, True):
+            observation = Observation(game, pixels = pixels)
+
+            def step():
+                driver.next_direction()
+                game.update()
+            yield result("observation_pixels" if pixels else "observation", length,
+                         measure(observation.update, step))
+        snapshot = game.snapshot()
+        yield {**result("snapshot", length, measure(game.snapshot)), "bytes": len(snapshot)}
+        yield result("restore", length, measure(lambda: game.restore(snapshot)))
+
+        if length < n_cells:
+            yield result("place_food", length, measure(game.place_food))
+            game.board.take(game.food.position, core.FOOD)
+            game.food.place(None)
+
+        yield result("draw_background", length, measure(main._draw_background))
+        yield result("draw_borders", length, measure(game.hud.draw_borders))
+        yield result("game_draw", length, measure(game.draw))
+        renderer = main.Renderer(game.hud)
+
+        def tick():
+            driver.next_direction()
+            game.update()
+        yield result("renderer_draw", length, measure(lambda: renderer.draw(game), tick))
+        cell_renderer = main.CellRenderer(game.hud)
+        yield result("cell_renderer_draw", length, measure(lambda: cell_renderer.draw(game), tick))
+        renderer.invalidate()
+
+        def frame():
+            tick()
+            dirty_rects = renderer.draw(game)
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
+        us_per_frame, frames = measure(frame)
+        yield {**result("frame", length, (us_per_frame, frames)), "fps": round(1e6 / us_per_frame)}
+
+        game.history = History(game, 1000)
+
+        def rewind():
+            game.rewind(1)
+            driver.step = (driver.step - 1) % len(driver.cycle)
+        yield result("rewind", length, measure(rewind, tick))
+    pygame.quit()
+
+    # The autopilot plays from the start: its snake grows, and its search work is bounded
+    game = core.Game(seed=0, width=width, height=height)
+    game.autopilot = Autopilot(game)
+    game.pause = False
+    us_per_tick, ticks = measure(game.update)
+    stats = game.autopilot.stats()
+    yield {**result("autopilot_update", len(game.snake), (us_per_tick, ticks)),
+           "decision_us_max": stats["decision_us_max"], "recomputes": stats["recomputes"]}
+
+    # Its decisions, garbage collections included (the objects of the setup are frozen, as
+    # they would be long collected in a game). The slowest one is checked in CPU time: the
+    # other processes can stop this one at any time, not just during the decisions
+    game = core.Game(seed=0, width=width, height=height)
+    autopilot = Autopilot(game)
+    game.pause = False
+    decision_times, cpu_times = [], []
+
+    def decide():
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        game.handle_movement(autopilot.next_direction())
+        cpu_times.append(time.thread_time() - cpu_start)
+        decision_times.append(time.perf_counter() - start)
+    gc.collect()
+    gc.freeze()
+    us_per_tick, ticks = measure(game.update, decide)
+    gc.unfreeze()
+    us_p99 = 1e6 * float(np.percentile(decision_times, 99))
+    us_max = 1e6 * max(cpu_times)
+    yield {**result("autopilot_decision", len(game.snake),
+                    (1e6 * float(np.median(decision_times)), ticks)),
+           "us_p99": round(us_p99, 3), "us_max": round(1e6 * max(decision_times), 3),
+           "cpu_us_max": round(us_max, 3)}
+    assert us_p99 < MAX_DECISION_US, f"{size}: 1% of the autopilot decisions took {us_p99:.0f} us"
+    assert us_max < MAX_DECISION_US, f"{size}: an autopilot decision took {us_max:.0f} us of CPU"
+
+    # The autopilot on every maze, its decisions left out: a tick keeps the regions up to
+    # date, and the food is only placed where the snake can get to
+    for maze in mazes.levels:
+        core.MAZE = maze
+        game = core.Game(seed=0, width=width, height=height)
+        autopilot = Autopilot(game)
+        game.pause = False
+        us_per_tick, ticks = measure(game.update,
+                                     lambda: game.handle_movement(autopilot.next_direction()))
+        yield {**result("maze_update", len(game.snake), (us_per_tick, ticks)), "maze": maze}
+        yield {**result("maze_place_food", len(game.snake), measure(game.place_food)),
+               "maze": maze}
+    core.MAZE = None
+
+
+def metadata():
+    import pygame   # pylint:disable=import-outside-toplevel
+    return {"benchmark": "meta", "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "pygame": pygame.version.ver, "machine": platform.machine()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Snake game hot paths.")
+    parser.add_argument("--sizes", default=",".join(SIZES),
+                        help="board sizes to run, in sprites (default: %(default)s)")
+    parser.add_argument("--output", help="file to write the results to (default: stdout)")
+    parser.add_argument("--size", help=argparse.SUPPRESS)    # Run one size in this process
+    args = parser.parse_args()
+
+    if args.size:
+        for record in run_size(args.size):
+            print(json.dumps(record), flush=True)
+        return
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    lines = [json.dumps(metadata()),]
+    for size in args.sizes.split(","):
+        process = subprocess.run([sys.executable, __file__, "--size", size], cwd=here,
+                                 capture_output=True, text=True, check=False)
+        if process.returncode:
+            sys.exit(f"{size}: failed\n{process.stderr}")
+        lines += [line for line in process.stdout.splitlines() if line.startswith("{")]
+        print(f"{size}: done", file=sys.stderr)
+    output = "\n".join(lines) + "\n"
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    else:
+        print(output, end="")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,497 @@
+""" Autopilot for the Snake game: plays on its own, for attract screens and soak testing.
+
+Set it as game.autopilot = Autopilot(game): every tick, core.Game.update asks it for
+a direction and passes it to Game.handle_movement, like a player would.
+
+    python bot.py                      # play headless on the default board and print stats
+    python bot.py --size 80x36 --ticks 20000
+    python bot.py --maze apartment
+"""
+import argparse
+import heapq
+import time
+from collections import deque
+
+import numpy as np
+
+import core
+import mazes
+from core import DIRECTIONS, DIRECTIONS_X, DIRECTIONS_Y, FOOD, BONUS, SNAKE, OPPOSITE
+
+# BEGIN Customize the autopilot:
+CYCLE_FILL    = 0.5   # Snake length (fraction of the board) from which it only follows the cycle
+SHORTCUT_ROOM = 4     # Free cells kept between the head and the tail when cutting the cycle short
+RETRY_TICKS   = 4     # Ticks to wait before searching again when there was no safe path
+SEARCH_CELLS  = 250   # Most cells the path searches of one tick visit (bounds decision time)
+REBUILD_COST  = 8     # Body sections indexed again (new game, rewind) per search cell charged
+# END Customize
+
+SEARCH_SHIFT  = 24    # Bits of a cell number and of a search depth in the search heap
+
+
+def hamiltonian_cycle(width, height):
+    """ Return a list of (x, y) visiting every cell of the board once, where the last cell
+    is next to the first one. Needs an even width or height. """
+    if width % 2 and height % 2:
+        raise ValueError("There is no Hamiltonian cycle on an odd x odd board")
+    if width % 2:
+        return [(x, y) for y, x in hamiltonian_cycle(height, width)]
+    # Go down and up the columns (leaving row 0 free), then back along row 0
+    cycle = []
+    for x in range(width):
+        rows = range(1, height) if x % 2 == 0 else range(height - 1, 0, -1)
+        cycle += [(x, y) for y in rows]
+    return cycle + [(x, 0) for x in range(width - 1, -1, -1)]
+
+
+class Autopilot:
+    """ Choose the direction of the snake every tick:
+    - A* path to the bonus (if it can get there in time) or to the food, through the cells
+      that the tail will have left when the head gets there,
+    - taken only if the snake could still reach its own tail after eating,
+    - kept between ticks while the target doesn't move and the path stays free,
+    - otherwise (or when the snake fills CYCLE_FILL of the board) follow a Hamiltonian
+      cycle, cutting it short towards the target when there is room behind the tail.
+    The walls of a maze are left out of the neighbors of the cells, like the board edges
+    (and there is no cycle then).
+    The body is indexed by the number of the move that put the head on every cell: from
+    tick to tick only the head and tail cells change, and the steps when the cells are
+    left are these numbers plus an offset. The searches count steps the same way.
+    Cells are numbered x * height + y, like in core.Board. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, game):
+        self.game = game
+        board = game.board
+        self.width, self.height = board.width, board.height
+        self.n_cells = board.width * board.height
+        self.cells = board.cells.reshape(-1)          # A view, kept up to date by the board
+        self.neighbors = self._get_neighbors()
+        self.exits = [[(code, cell) for code, cell in enumerate(cells) if cell >= 0]
+                      for cells in self.neighbors]      # (code, neighbor) of every cell
+        try:
+            if board.walls.any():
+                raise ValueError("The walls of the maze cut the Hamiltonian cycle")
+            cycle = hamiltonian_cycle(board.width, board.height)
+            self.cycle_index = [0] * self.n_cells
+            for i, (x, y) in enumerate(cycle):
+                self.cycle_index[x * board.height + y] = i
+        except ValueError:
+            self.cycle_index = None
+        self.path = deque()         # Direction codes still to follow
+        self.path_targets = None    # Goals of all the targets when the path was found
+        self.next_head = None       # Where the head should be when the path is followed
+        self.fields = {}            # {goals: distances from every column, row to goals}
+        self.moves = 0              # Number of the move that put the head where it is
+        self.created = {}           # {body cell: number of the move that put the head on it}
+        self.leaves  = {}           # {body cell: move after which the tail has left it}
+        self.n_full  = 0            # Full sections of the body (growth to come)
+        self.tracked = None         # (head slot, tail slot, length) of the indexed body
+        self.retry_tick = 0
+        self.snake = None
+        self.ordered_moves = 0      # Cycle moves in a row (see _cycle_step)
+        self.escape = deque()       # Next cells of a path that keeps following the tail
+        self.searched_escape = {}   # {first cell: escape path cells} found this tick
+        self.budget = SEARCH_CELLS  # Cells the searches can still visit this tick
+        self.ticks = 0
+        self.decisions = 0
+        self.decision_time = 0.0
+        self.max_decision_time = 0.0
+        self.recomputes = 0
+        self.recompute_time = 0.0
+        self.reused = 0
+        self.cycle_steps = 0
+
+    def next_direction(self):
+        """ Return the direction (like core.RIGHT) the snake should move to this tick. """
+        start = time.perf_counter()
+        code = self._decide()
+        elapsed = time.perf_counter() - start
+        self.ticks += 1
+        self.decisions += 1
+        self.decision_time += elapsed
+        self.max_decision_time = max(self.max_decision_time, elapsed)
+        return DIRECTIONS[code]
+
+    def reset(self):
+        """ Forget the paths found so far (the game state has changed, see core.Game.rewind). """
+        self.snake = None
+        self.retry_tick = self.ticks
+
+    def stats(self):
+        decisions = max(1, self.decisions)
+        return {
+            "decisions": self.decisions,
+            "decisions_per_s": round(self.decisions / max(self.decision_time, 1e-9)),
+            "decision_us_mean": round(1e6 * self.decision_time / decisions, 3),
+            "decision_us_max": round(1e6 * self.max_decision_time, 3),
+            "recomputes": self.recomputes,
+            "recompute_us_mean": round(1e6 * self.recompute_time / max(1, self.recomputes), 3),
+            "path_steps_reused": self.reused,
+            "cycle_steps": self.cycle_steps,
+        }
+
+    def report(self):
+        """ Return a one line summary of the stats. """
+        stats = self.stats()
+        return (f"Autopilot: {stats['decisions']} decisions ({stats['decisions_per_s']}/s, "
+                f"max {stats['decision_us_max']:.0f} us), {stats['recomputes']} path searches "
+                f"({stats['recompute_us_mean']:.0f} us on average), "
+                f"{stats['path_steps_reused']} path steps reused, "
+                f"{stats['cycle_steps']} cycle steps")
+
+    def _decide(self):
+        """ Return the direction code for this tick. """
+        snake = self.game.snake
+        head = self._cell(snake.slot(0))
+        if snake is not self.snake:     # New game
+            self.snake = snake
+            self.tracked = None
+            self.path.clear()
+            self.escape.clear()
+            self.ordered_moves = 0
+        if snake.are_full[snake.slot(0)]:
+            self.escape.clear()         # Growing delays the tail
+        self.searched_escape = {}
+        self.budget = SEARCH_CELLS
+        self._track_body(snake)
+        code = self._choose(head, snake)
+        cell = self.neighbors[head][code]
+        if self.escape and self.escape[0] == cell:
+            self.escape.popleft()
+        else:
+            self.escape = deque(self.searched_escape.get(cell, ()))
+        return code
+
+    def _choose(self, head, snake):
+        """ Return the direction code for this tick, from the head cell. """
+        targets = self._targets()
+        if self.cycle_index is None or len(snake) < CYCLE_FILL * self.n_cells:
+            code = self._path_step(head, targets)
+            if code is not None:
+                self.ordered_moves = 0
+                return code
+        self.path.clear()
+        code = self._cycle_step(head, targets)
+        if code is None:
+            self.ordered_moves = 0
+            code = self._tail_step(head)
+        return snake.direction_code if code is None else code
+
+    def _targets(self):
+        """ Return a list of (goal cells, max path length): the bonus, then the food """
+        targets = []
+        if self.game.bonus is not None:
+            x, y = (int(n) for n in self.game.bonus.position)
+            cell = x * self.height + y
+            targets += [((cell, cell + self.height), self.game.bonus.timer),]
+        if self.game.food.position is not None:
+            x, y = (int(n) for n in self.game.food.position)
+            targets += [((x * self.height + y,), None),]
+        return targets
+
+    def _path_step(self, head, targets):
+        """ Return the next code of a safe path to the first reachable target, or None """
+        all_goals = tuple(goals for goals, _ in targets)
+        if self.path and head == self.next_head and all_goals == self.path_targets:
+            code = self.path[0]
+            if self._is_free(self.neighbors[head][code]):
+                self.path.popleft()
+                self.next_head = self.neighbors[head][code]
+                self.reused += 1
+                return code
+        if self.ticks < self.retry_tick:
+            return None
+        start = time.perf_counter()
+        self.recomputes += 1
+        self.path.clear()
+        for goals, max_length in targets:
+            # The food can be far on big boards: get closer to it within the budget
+            path = self._find_path(head, dict.fromkeys(goals, self.moves), self.leaves,
+                                   self._get_field(goals), self.moves,
+                                   partial = max_length is None)
+            if path is None or (max_length is not None and len(path) > max_length):
+                continue
+            if self._tail_reachable(head, path):
+                self.path.extend(path[1:])
+                self.path_targets = all_goals
+                self.next_head = self.neighbors[head][path[0]]
+                self.recompute_time += time.perf_counter() - start
+                return path[0]
+        self.retry_tick = self.ticks + RETRY_TICKS
+        self.recompute_time += time.perf_counter() - start
+        return None
+
+    def _cycle_step(self, head, targets):
+        """ Return the code of the next cell on the Hamiltonian cycle, or of a shortcut
+        towards the target that doesn't get past the tail. None if there is no cycle.
+        Once the body lies in cycle order (after len(snake) such moves in a row),
+        these moves can't trap the snake. Until then, they are checked like the others. """
+        if self.cycle_index is None:
+            return None
+        index = self.cycle_index
+        snake = self.game.snake
+        room = (index[self._cell(snake.slot(-1))] - index[head]) % self.n_cells
+        room -= SHORTCUT_ROOM + self.n_full
+        shortcuts = len(snake) < CYCLE_FILL * self.n_cells
+        field = self._get_field(targets[-1][0]) if targets and shortcuts else None
+        candidates = []
+        for code, cell in enumerate(self.neighbors[head]):
+            if cell < 0 or not self._is_free(cell):
+                continue
+            step = (index[cell] - index[head]) % self.n_cells
+            if step != 1 and (field is None or step >= room):
+                continue
+            candidates += [(-step if field is None else self._distance(field, cell), code, cell),]
+        ordered = self.ordered_moves >= len(snake)
+        for _, code, cell in sorted(candidates):
+            if ordered or self._tail_reachable_from(cell):
+                self.ordered_moves += 1
+                self.cycle_steps += 1
+                return code
+        return None
+
+    def _tail_step(self, head):
+        """ Return the code of a free neighbor from which the tail is still reachable
+        (the farthest from the tail), of any free neighbor, or None """
+        to_tail = self._get_field((self._cell(self.game.snake.slot(-1)),))
+        best, best_distance = None, None
+        for code, cell in enumerate(self.neighbors[head]):
+            if cell < 0 or not self._is_free(cell):
+                continue
+            distance = (self._tail_reachable_from(cell), self._distance(to_tail, cell))
+            if best is None or distance > best_distance:
+                best, best_distance = code, distance
+        return best
+
+    def _tail_reachable_from(self, cell):
+        """ Return True if the head could follow its tail after moving to cell.
+        The path found is kept: while the snake follows it (and doesn't grow),
+        the next moves along it are known to be safe without searching again. """
+        if self.escape and self.escape[0] == cell:
+            return True
+        # From a body cell, the head can follow the tail once all the growth has happened
+        # (else it would catch up with it): len(snake) + self.n_full steps after the move
+        # that put the head on it. Counted from the next move, like the searches
+        snake = self.game.snake
+        first_step = self.moves + 1 - len(snake) - self.n_full
+        path = self._find_path(cell, self.created, self.created,
+                               self._get_field((self._cell(snake.slot(-1)),)), first_step)
+        if path is None:
+            return False
+        self.searched_escape[cell] = cells = []
+        for code in path:
+            cell = self.neighbors[cell][code]
+            cells += [cell,]
+        return True
+
+    def _find_path(self, start, goals, free_at, field, first_step = 0,
+                   oldest_goal = -np.inf, partial = False):
+        """ A* search from start (on first_step) to any of goals ({cell: first step it counts
+        as reached}, if it is at least oldest_goal). A cell can be entered on step t if
+        free_at.get(cell, t) <= t. field: the distances to the goals (see _get_field).
+        Return the list of direction codes, or None (also when the budget runs out).
+        partial: search with half of the budget (leaving the rest to check the path), and
+        when it runs out, return the path to the visited cell closest to the goals instead
+        (None if none is closer than start).
+        The heap holds ints: estimated length, then depth (deepest first on ties), then cell,
+        packed with SEARCH_SHIFT bits each, which compare faster than tuples. """
+        # pylint:disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        if oldest_goal <= goals.get(start, first_step + 1) <= first_step:
+            return []
+        exits, get_free_at, get_goal = self.exits, free_at.get, goals.get
+        push, pop = heapq.heappush, heapq.heappop
+        columns, rows = field
+        height, shift = self.height, SEARCH_SHIFT
+        mask = (1 << shift) - 1
+        came_from = {start: -1}     # {cell: direction code from the previous cell}
+        closest, closest_distance = None, columns[start // height] + rows[start % height]
+        heap = [closest_distance << 2 * shift | mask << shift | start]
+        budget = self.budget // 2 if partial else self.budget
+        while heap and len(came_from) < budget:
+            key = pop(heap)
+            depth = mask - (key >> shift & mask) + 1
+            cell = key & mask
+            steps = first_step + depth
+            for code, next_cell in exits[cell]:
+                if next_cell in came_from or get_free_at(next_cell, steps) > steps:
+                    continue
+                came_from[next_cell] = code
+                if oldest_goal <= get_goal(next_cell, steps + 1) <= steps:
+                    self.budget -= len(came_from)
+                    return self._trace(next_cell, came_from)
+                distance = columns[next_cell // height] + rows[next_cell % height]
+                if distance < closest_distance:
+                    closest, closest_distance = next_cell, distance
+                push(heap, (depth + distance) << 2 * shift | (mask - depth) << shift | next_cell)
+        self.budget -= len(came_from)
+        if partial and heap and closest is not None:    # Out of budget, not out of cells
+            return self._trace(closest, came_from)
+        return None
+
+    def _trace(self, cell, came_from):
+        """ Return the direction codes of the path to cell found by _find_path """
+        path = []
+        code = came_from[cell]
+        while code >= 0:
+            path += [code,]
+            cell = self.neighbors[cell][OPPOSITE[code]]
+            code = came_from[cell]
+        return path[::-1]
+
+    def _tail_reachable(self, head, path):
+        """ Return True if, after following path and eating, the head can still follow
+        its tail: get to a cell of its body once the tail has left it (and late enough
+        for the growth to come), without going through any other one. From there, it can
+        keep following the cells the body leaves, one per tick. """
+        # pylint:disable=too-many-locals
+        cells = []
+        cell = head
+        for code in path:
+            cell = self.neighbors[cell][code]
+            cells += [cell,]
+        # Longest the snake can be when it gets there (+1 for everything it eats on the way).
+        # The pending growth is made of extra tail sections: they are always left after
+        # the cells the real snake leaves, so only the last meal can stop the tail.
+        eaten = sum(1 for cell in cells if self.cells[cell] & (FOOD | BONUS))
+        snake = self.game.snake
+        length = len(snake) + self.n_full + eaten
+        if length < 2:
+            return True
+        # The snake at the end of the path: its cells get the numbers of the next moves
+        # (a cell the path goes through again keeps the later one), the body stays behind
+        # them and the growth stays on its tail. Its tail leaves a cell length + 1 moves
+        # after the head got on it (+1 for the last meal), and the cells left before it
+        # are free, but not goals
+        moves = self.moves + len(cells)
+        tail = length - 1 - len(cells)      # Body section where the virtual tail is
+        if tail < 0:
+            tail_cell = cells[-1 - (length - 1)]
+        else:
+            tail_cell = self._cell(snake.slot(min(tail, len(snake) - 1)))
+        created = self.created
+        kept = {cell: created.get(cell) for cell in cells}
+        created.update(zip(cells, range(self.moves + 1, moves + 1)))
+        first_step = moves - length - 1
+        path = self._find_path(cells[-1] if cells else head, created, created,
+                               self._get_field((tail_cell,)), first_step, first_step + 2)
+        for cell, number in kept.items():
+            if number is None:
+                del created[cell]
+            else:
+                created[cell] = number
+        return path is not None
+
+    def _track_body(self, snake):
+        """ Update self.created, self.leaves and self.n_full: only the head and tail cells
+        change after one move. Index the body again (charged to the budget) after anything
+        else (new game, rewind, a tick without the autopilot). """
+        head, tail, length = snake.head_index, snake.slot(-1), len(snake)
+        if self.tracked is not None and self.tracked[0] == (head - 1) % snake.capacity:
+            old_tail, old_length = self.tracked[1:]
+            if tail != old_tail:        # Else the tail has stayed to grow
+                cell = self._cell(old_tail)
+                self.created.pop(cell, None)     # None: it was on the body twice
+                self.leaves.pop(cell, None)
+            # A full tail has grown, and the head may have eaten
+            self.n_full += int(snake.are_full[head]) - (length - old_length)
+            self.moves += 1
+            cell = self._cell(head)
+            self.created[cell] = self.moves
+            # Every full section keeps the tail (and the sections before it) one more step
+            self.leaves[cell] = self.moves + length + self.n_full
+        else:
+            slots = snake.slots()
+            body = (snake.x[slots].astype(int) * self.height + snake.y[slots]).tolist()
+            full = snake.are_full[slots]
+            self.moves = length
+            created = self.moves - np.arange(length)
+            leaves = created + length + np.cumsum(full[::-1])[::-1]
+            # From the tail, so that the head gets a cell it shares with the body
+            self.created = dict(zip(body[::-1], created[::-1].tolist()))
+            self.leaves  = dict(zip(body[::-1], leaves[::-1].tolist()))
+            self.n_full  = int(full.sum())
+            self.budget -= length // REBUILD_COST
+        self.tracked = (head, tail, length)
+
+    def _get_field(self, goals):
+        """ Return the distances from every column and from every row to the closest goal
+        (the goals are on one row, like the bonus cells), cached. A cell is as far as the
+        sum of the distances of its column and row (see _distance). """
+        field = self.fields.get(goals)
+        if field is None:
+            if len(self.fields) > 2:
+                self.fields.clear()
+            goal_x, goal_y = np.divmod(np.array(goals), self.height)
+            distance_x = np.abs(np.arange(self.width)[:, None]  - goal_x)
+            distance_y = np.abs(np.arange(self.height)          - goal_y[0])
+            if core.WRAP_AROUND:
+                distance_x = np.minimum(distance_x, self.width  - distance_x)
+                distance_y = np.minimum(distance_y, self.height - distance_y)
+            field = self.fields[goals] = (distance_x.min(axis=1).tolist(), distance_y.tolist())
+        return field
+
+    def _distance(self, field, cell):
+        """ Return the distance from cell to the goals of field (see _get_field) """
+        columns, rows = field
+        return columns[cell // self.height] + rows[cell % self.height]
+
+    def _is_free(self, cell):
+        """ Return True if the head can move to cell now (empty, or the tail leaving it) """
+        sections = self.cells[cell] // SNAKE
+        if sections == 0:
+            return True
+        snake = self.game.snake
+        tail = snake.slot(-1)
+        return sections == 1 and cell == self._cell(tail) and not snake.are_full[tail]
+
+    def _cell(self, slot):
+        snake = self.game.snake
+        return int(snake.x[slot]) * self.height + int(snake.y[slot])
+
+    def _get_neighbors(self):
+        """ Return the list of the 4 neighbors of every cell, by direction code
+        (-1 outside the board or on a wall). """
+        x, y = np.divmod(np.arange(self.n_cells), self.height)
+        neighbors = []
+        for step_x, step_y in zip(DIRECTIONS_X, DIRECTIONS_Y):
+            next_x, next_y = x + step_x, y + step_y
+            if core.WRAP_AROUND:
+                next_x, next_y = next_x % self.width, next_y % self.height
+            inside = (0 <= next_x) & (next_x < self.width) & (0 <= next_y) & (next_y < self.height)
+            neighbors += [np.where(inside, next_x * self.height + next_y, -1),]
+        neighbors = np.stack(neighbors, axis=1)
+        is_open = ~self.game.board.walls.reshape(-1)
+        return np.where((neighbors >= 0) & is_open[neighbors], neighbors, -1).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Let the autopilot play without a display.")
+    parser.add_argument("--size", default=f"{core.GRID_WIDTH}x{core.GRID_HEIGHT}",
+                        help="board size, in sprites (default: %(default)s)")
+    parser.add_argument("--ticks", type=int, default=10000, help="(default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="(default: %(default)s)")
+    parser.add_argument("--maze", choices=mazes.levels, help="walls of the level (see mazes.py)")
+    args = parser.parse_args()
+    core.MAZE = args.maze
+
+    width, height = (int(n) for n in args.size.split("x"))
+    game = core.Game(args.seed, width, height)
+    game.autopilot = Autopilot(game)
+    game.pause = False
+    scores, best_length = [], 0
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        score = game.score
+        game.update()
+        best_length = max(best_length, len(game.snake))
+        if game.score < score:
+            scores += [score,]
+    seconds = time.perf_counter() - start
+    print(f"{args.ticks} ticks in {seconds:.2f} s, {len(scores)} games lost "
+          f"(scores {scores[:10]}), current score {game.score}, "
+          f"longest snake {best_length} / {width * height} cells")
+    print(game.autopilot.report())
+
+
+if __name__=="__main__":
+    main()
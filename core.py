@@ -0,0 +1,1036 @@
+""" Game rules for the Snake game, using only NumPy arrays (no Pygame needed) """
+import os
+import struct
+import tempfile
+from collections import deque
+
+import numpy as np
+
+import mazes
+import sprites
+
+UP    = np.array(( 0, -1))
+DOWN  = np.array(( 0,  1))
+LEFT  = np.array((-1,  0))
+RIGHT = np.array(( 1,  0))
+
+# Directions stored as small integer codes (index into DIRECTIONS)
+DIRECTIONS   = np.array((UP, DOWN, LEFT, RIGHT))
+DIRECTIONS_X = DIRECTIONS[:, 0].tolist()
+DIRECTIONS_Y = DIRECTIONS[:, 1].tolist()
+ROTATE_LEFT  = [int(np.flatnonzero((DIRECTIONS == d.dot(((0, -1), (1, 0)))).all(axis=1))[0])
+                for d in DIRECTIONS]
+OPPOSITE     = [ROTATE_LEFT[ROTATE_LEFT[code]] for code in range(len(DIRECTIONS))]
+FLIPS        = (None, "h", "v", None)   # Flips that imitate the Nokia Snake II orientation
+# Sprite codes of the body sections (see Snake.sprite_codes): kind + direction code
+BODY, FULL, TURN = 0, 4, 8
+BODY_SPRITES = [(sprite, DIRECTIONS[code], None if sprite is sprites.snake_turn else FLIPS[code])
+                for sprite in (sprites.snake_body, sprites.snake_full, sprites.snake_turn)
+                for code in range(len(DIRECTIONS))]
+
+# BEGIN Customize some game parameters:
+## Board
+GRID_WIDTH    = 20    # Default width  of the board, in sprites
+GRID_HEIGHT   =  9    # Default height of the board, in sprites
+MAZE          = None  # Walls of the level: the name of a maze of mazes.py (None: no walls)
+
+## Starting position
+START_X         = None              # Starting X position (None: center of the board)
+START_Y         = None              # Starting Y position (None: center of the board)
+START_LENGTH    = 7                 # Starting size
+START_DIRECTION = RIGHT             # Starting direction
+
+## Difficulty
+GAME_SPEED  = 200    # Milliseconds between game cycles
+WRAP_AROUND = True   # Behavior when touching the edge of the screen. True: wrap around. False: die.
+BONUS_TIMER = 20     # Turns until the bonus disappears
+
+## Controls
+INPUT_BUFFER = 2     # Turns queued ahead of the snake (1 to 8). More push the oldest out.
+# END Customize
+
+POINTS = max(1, GAME_SPEED // 100)  # TODO: study the actual scoring system
+
+
+def set_speed(game_speed):
+    """ Set GAME_SPEED (milliseconds between ticks) and the POINTS that go with it. """
+    # pylint:disable=global-statement
+    global GAME_SPEED, POINTS
+    GAME_SPEED = game_speed
+    POINTS = max(1, game_speed // 100)
+
+
+def start_position(width, height):
+    """ Return the starting position of the snake head on a board of width x height sprites """
+    return np.array((width  // 2 if START_X is None else START_X,
+                     height // 2 if START_Y is None else START_Y))
+
+
+def maze_walls(width, height):
+    """ Return the walls of the MAZE on a board of width x height sprites (see Board),
+    or None if there is no maze. The line of the starting snake is kept open, and as many
+    cells in front of it. """
+    if MAZE is None:
+        return None
+    walls = mazes.compile_walls(MAZE, width, height)
+    line = start_position(width, height) \
+         + np.outer(np.arange(1 - START_LENGTH, START_LENGTH + 1), START_DIRECTION)
+    if WRAP_AROUND:
+        line %= (width, height)
+    line = line[((line >= 0) & (line < (width, height))).all(axis=1)]
+    walls[line[:, 0], line[:, 1]] = False
+    return walls
+
+
+def direction_code(direction):
+    """ Return the code of a direction given as an np.array (like RIGHT). """
+    return DIRECTIONS_X.index(direction[0]) if direction[1] == 0 \
+      else DIRECTIONS_Y.index(direction[1])
+
+
+FOOD  = 1    # Bit flag of a Board cell holding the food
+BONUS = 2    # Bit flag of a Board cell holding (half of) the bonus
+SNAKE = 4    # Added to a Board cell once for every snake section on it
+WALL  = 64   # Bit flag of a Board cell holding a wall of the maze (never free)
+PLACEMENT_DRAWS = 8     # Random draws before placing among the reachable cells (see Regions)
+
+# Snapshots (see Game.snapshot): a header, then the direction buffer (one code per byte),
+# the snake sections from head to tail (direction code | full << 2, one byte each),
+# and the order of the free cells and free pairs sets (uint16, or uint32 on huge boards)
+SNAPSHOT_MAGIC   = b"SNKS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER  = struct.Struct(
+    "<4sBQHHIHHB??qihhhhibBII16s16sBI")
+# magic, version, seed, width, height, length, head x, head y, direction, mouth open, pause,
+# score, next bonus timer, food x, food y, bonus x, bonus y, bonus timer, bonus sprite,
+# direction buffer length, free cells, free pairs, RNG state, RNG inc, has_uint32, uinteger
+
+
+class CellSet:
+    """ Set of cell numbers (0 <= cell < capacity) with O(1) add, remove and random choice.
+    The members are the first self.size items; self.index tells where each cell is.
+    If self.journal is a list, add and remove append the two cells they swap to it
+    (the second one as ~cell for remove), so that they can be undone (see history.py). """
+    __slots__ = ("capacity", "items", "index", "size", "journal")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = list(range(capacity))
+        self.index = list(range(capacity))
+        self.size  = 0
+        self.journal = None
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        return self.index[cell] < self.size
+
+    def reset(self, members):
+        """ Make members (a range or list of cells) the only cells in the set. """
+        is_member = [False,] * self.capacity
+        for cell in members:
+            is_member[cell] = True
+        self.items = [cell for cell in range(self.capacity) if is_member[cell]]
+        self.size  = len(self.items)
+        self.items += [cell for cell in range(self.capacity) if not is_member[cell]]
+        for i, cell in enumerate(self.items):
+            self.index[cell] = i
+
+    def add(self, cell):
+        if self.index[cell] >= self.size:
+            other = self.items[self.size]
+            self._swap(cell, other)
+            self.size += 1
+            if self.journal is not None:
+                self.journal += (cell, other)
+
+    def remove(self, cell):
+        if self.index[cell] < self.size:
+            other = self.items[self.size - 1]
+            self._swap(cell, other)
+            self.size -= 1
+            if self.journal is not None:
+                self.journal += (cell, ~other)
+
+    def undo(self, journal):
+        """ Undo the adds and removes journal holds (see self.journal), latest first. """
+        for i in range(len(journal) - 2, -1, -2):
+            other = journal[i + 1]
+            if other < 0:
+                other = ~other
+                self.size += 1
+            else:
+                self.size -= 1
+            self._swap(journal[i], other)
+
+    def choice(self, rng):
+        """ Return a random member (drawn with the np.random.Generator rng),
+        or None if the set is empty. """
+        if self.size == 0:
+            return None
+        return self.items[rng.integers(self.size)]
+
+    def load(self, items, size):
+        """ Make the first size cells of items (an order of all the cells, as saved from
+        self.items) the members. The order matters: it decides what choice returns. """
+        self.items = items.tolist()
+        index = np.empty(self.capacity, dtype=np.int64)
+        index[items] = np.arange(self.capacity)
+        self.index = index.tolist()
+        self.size  = size
+
+    def _swap(self, cell_a, cell_b):
+        i, j = self.index[cell_a], self.index[cell_b]
+        self.items[i], self.items[j] = cell_b, cell_a
+        self.index[cell_a], self.index[cell_b] = j, i
+
+
+class InputQueue:
+    """ The turns input since the last ticks, oldest first, with the time they were input at
+    (time.perf_counter() seconds, or None). One is applied on every tick. Inputs that can't
+    turn the snake (its direction, or the opposite one, after the last queued turn) are not
+    queued, and at most size turns are: a new one pushes the oldest out. """
+    __slots__ = ("entries", "dropped")
+
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)    # (direction code, time)
+        self.dropped = 0                     # Turns pushed out so far
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, code, last_code, stamp = None):
+        """ Queue a direction code input at stamp, unless it can't turn the snake after
+        last_code (its direction, if nothing is queued). Return True if it is queued. """
+        if self.entries:
+            last_code = self.entries[-1][0]
+        if code in (last_code, OPPOSITE[last_code]):
+            return False
+        if len(self.entries) == self.entries.maxlen:
+            self.dropped += 1
+        self.entries.append((code, stamp))
+        return True
+
+    def pop(self):
+        """ Return the oldest (direction code, time) and remove it, or None. """
+        return self.entries.popleft() if self.entries else None
+
+    def codes(self):
+        return [code for code, _ in self.entries]
+
+    def load(self, codes):
+        """ Replace the queued turns with codes (without times, and without checks). """
+        self.entries.clear()
+        self.entries.extend((int(code), None) for code in codes)
+
+
+class Regions:
+    """ Connected regions of the open cells of a maze board (neither walls nor snake
+    sections): self.labels has the region label of every cell (-1: not open), and
+    self.sizes the number of cells of every label. They are flood filled once, then kept
+    up to date as the snake moves: a section taking a cell can only split its region
+    (and only if the open cells around it aren't joined around it), a section leaving
+    a cell can only merge the regions around it. Both only flood fill the smaller side.
+    Cells are numbered x * height + y, like in Board. """
+    __slots__ = ("neighbors", "rings", "labels", "sizes", "next_label", "start")
+
+    def __init__(self, walls):
+        width, height = walls.shape
+        x, y = np.divmod(np.arange(width * height), height)
+        neighbors = []
+        for step_x, step_y in zip(DIRECTIONS_X, DIRECTIONS_Y):
+            next_x, next_y = x + step_x, y + step_y
+            if WRAP_AROUND:
+                next_x, next_y = next_x % width, next_y % height
+            inside = (0 <= next_x) & (next_x < width) & (0 <= next_y) & (next_y < height)
+            neighbors += [np.where(inside, next_x * height + next_y, -1),]
+        neighbors = np.stack(neighbors, axis=1)
+        # The 8 cells around every cell, in turn from the top one: the odd ones are corners
+        up, down, left, right = (direction_code(d) for d in (UP, DOWN, LEFT, RIGHT))
+        rings = []
+        for first, second in ((up, None), (up, right), (right, None), (right, down),
+                              (down, None), (down, left), (left, None), (left, up)):
+            ring = neighbors[:, first]
+            if second is not None:
+                ring = np.where(ring >= 0, neighbors[ring, second], -1)
+            rings += [ring,]
+        self.neighbors = neighbors.tolist()
+        self.rings = np.stack(rings, axis=1).tolist()
+        self.rebuild(~walls.ravel())
+        self.start = (self.labels.copy(), self.sizes.copy(), self.next_label)
+
+    def reset(self):
+        """ Go back to the regions of the empty level. """
+        labels, sizes, self.next_label = self.start
+        self.labels, self.sizes = labels.copy(), sizes.copy()
+
+    def rebuild(self, is_open):
+        """ Flood fill the regions of the open cells (is_open: a boolean array by cell). """
+        self.labels = np.where(is_open, -2, -1).tolist()     # -2: open, not labelled yet
+        self.sizes = {}
+        self.next_label = 0
+        for cell, label in enumerate(self.labels):
+            if label == -2:
+                self.sizes[self.next_label] = self._relabel(cell, -2, self.next_label)
+                self.next_label += 1
+
+    def occupy(self, cell):
+        """ Close the open cell (a snake section has taken it): split its region if the
+        open cells around it aren't joined without it. """
+        labels = self.labels
+        label = labels[cell]
+        labels[cell] = -1
+        self.sizes[label] -= 1
+        if not self.sizes[label]:
+            del self.sizes[label]
+            return
+        # A seed for every run of open cells around it that holds a neighbor
+        ring = [next_cell >= 0 and labels[next_cell] >= 0 for next_cell in self.rings[cell]]
+        if all(ring):
+            return
+        first = ring.index(False)
+        seeds, seed = [], None
+        for i in range(first + 1, first + 9):
+            if not ring[i % 8]:
+                if seed is not None:
+                    seeds += [seed,]
+                seed = None
+            elif i % 2 == 0 and seed is None:
+                seed = self.rings[cell][i % 8]
+        if len(seeds) > 1:
+            self._split(seeds, label)
+
+    def release(self, cell):
+        """ Open the cell (the last snake section on it has left it): merge the regions
+        around it into the biggest one. """
+        labels = self.labels
+        around = {labels[next_cell] for next_cell in self.neighbors[cell]
+                  if next_cell >= 0 and labels[next_cell] >= 0}
+        if not around:
+            label = self.next_label
+            self.next_label += 1
+            self.sizes[label] = 0
+        else:
+            label = max(around, key=self.sizes.__getitem__)
+            for next_cell in self.neighbors[cell]:
+                if next_cell >= 0 and labels[next_cell] >= 0 and labels[next_cell] != label:
+                    self.sizes[label] += self.sizes.pop(labels[next_cell])
+                    self._relabel(next_cell, labels[next_cell], label)
+        labels[cell] = label
+        self.sizes[label] += 1
+
+    def around(self, cell):
+        """ Return the set of the labels of the regions next to cell (like the head). """
+        return {self.labels[next_cell] for next_cell in self.neighbors[cell]
+                if next_cell >= 0 and self.labels[next_cell] >= 0}
+
+    def choice(self, cell_set, rng, cell):
+        """ Return a random member of cell_set (a CellSet of open cells) in a region next
+        to cell, or None if cell_set is empty. A few random draws are tried first: the
+        cells are only listed when they keep missing. If no member is next to cell, any
+        member is returned. The result only depends on which cells are in which region
+        (not on the labels), so that the game replays the same after a rebuild. """
+        around = self.around(cell)
+        for _ in range(PLACEMENT_DRAWS):
+            member = cell_set.choice(rng)
+            if member is None or self.labels[member] in around:
+                return member
+        reachable = [member for member in cell_set.items[:cell_set.size]
+                     if self.labels[member] in around]
+        if not reachable:
+            return cell_set.choice(rng)
+        return reachable[rng.integers(len(reachable))]
+
+    def _split(self, seeds, label):
+        """ Flood fill region label from the seeds in turns, joining the fills that meet,
+        until they have all joined or a single one is still going: the ones that have
+        stopped are new regions. The cells are labelled -3 - fill while filling. """
+        # pylint:disable=too-many-locals
+        labels, neighbors = self.labels, self.neighbors
+        joined = list(range(len(seeds)))        # Fill that every fill has joined (or itself)
+        filled = [[seed,] for seed in seeds]
+        queues = [deque((seed,)) for seed in seeds]
+        for fill, seed in enumerate(seeds):
+            labels[seed] = -3 - fill
+
+        def find(fill):
+            while joined[fill] != fill:
+                fill = joined[fill]
+            return fill
+
+        changed = True                  # A fill has stopped, or joined another one
+        while True:
+            if changed:
+                fills = {find(fill) for fill in range(len(seeds))}
+                going = {find(fill) for fill, queue in enumerate(queues) if queue}
+                if len(fills) == 1 or len(going) <= 1:
+                    break
+                changed = False
+            for fill, queue in enumerate(queues):
+                if not queue:
+                    continue
+                for next_cell in neighbors[queue.popleft()]:
+                    if next_cell < 0:
+                        continue
+                    next_label = labels[next_cell]
+                    if next_label == label:
+                        labels[next_cell] = -3 - fill
+                        filled[fill] += [next_cell,]
+                        queue.append(next_cell)
+                    elif next_label <= -3 and find(-3 - next_label) != find(fill):
+                        joined[find(-3 - next_label)] = find(fill)
+                        changed = True
+                changed = changed or not queue
+        sizes = dict.fromkeys(fills, 0)
+        for fill in range(len(seeds)):
+            sizes[find(fill)] += len(filled[fill])
+        if not going:                   # Every side stopped: the biggest keeps the label
+            going = {max(fills, key=sizes.__getitem__)}
+        new_labels = {}
+        for fill in fills - going:
+            new_labels[fill] = self.next_label
+            self.sizes[self.next_label] = sizes[fill]
+            self.sizes[label] -= sizes[fill]
+            self.next_label += 1
+        for fill in range(len(seeds)):
+            new_label = new_labels.get(find(fill), label)
+            for cell in filled[fill]:
+                labels[cell] = new_label
+
+    def _relabel(self, cell, old_label, new_label):
+        """ Flood fill the region of cell (labelled old_label) with new_label.
+        Return the number of cells filled. """
+        labels, neighbors = self.labels, self.neighbors
+        labels[cell] = new_label
+        queue = [cell]
+        size = 1
+        while queue:
+            for next_cell in neighbors[queue.pop()]:
+                if next_cell >= 0 and labels[next_cell] == old_label:
+                    labels[next_cell] = new_label
+                    queue += [next_cell,]
+                    size += 1
+        return size
+
+
+class Board:
+    """ Occupancy grid of the level: the items (bit flags), walls and snake sections on
+    every cell. Positions outside the level are never occupied.
+    It also indexes the free cells, and the free horizontal pairs of cells (for the bonus),
+    so that random free positions are found in constant time at any fill level.
+    walls (a boolean array indexed [x, y], see maze_walls) makes a maze level: the cells
+    are then also indexed by regions (see Regions), so that the food can be placed where
+    the snake can get to. """
+    __slots__ = ("width", "height", "cells", "free_cells", "free_pairs", "walls", "regions")
+
+    def __init__(self, width = GRID_WIDTH, height = GRID_HEIGHT, walls = None):
+        self.width  = width
+        self.height = height
+        self.cells = np.zeros((width, height), dtype=np.int8)
+        self.walls = np.zeros((width, height), dtype=bool) if walls is None else walls
+        self.regions = None if walls is None else Regions(walls)
+        # Cells are numbered x * height + y, like self.cells.ravel()
+        self.free_cells = CellSet(width * height)
+        self.free_pairs = CellSet(width * height)    # numbered by their left cell
+        self.clear()
+
+    def clear(self):
+        """ Empty the level, but for the walls. """
+        self.cells.fill(0)
+        if self.regions is None:
+            self.free_cells.reset(range(self.width * self.height))
+            self.free_pairs.reset(range((self.width - 1) * self.height))
+            return
+        self.cells[self.walls] = WALL
+        is_open = ~self.walls
+        self.free_cells.reset(np.flatnonzero(is_open).tolist())
+        self.free_pairs.reset(np.flatnonzero(is_open[:-1] & is_open[1:]).tolist())
+        self.regions.reset()
+
+    def index_regions(self):
+        """ Flood fill the regions again (after self.cells was set directly). """
+        if self.regions is not None:
+            self.regions.rebuild(self.cells.ravel() < SNAKE)
+
+    def contains(self, position):
+        """ Return True if position is inside the level """
+        return 0 <= position[0] < self.width and 0 <= position[1] < self.height
+
+    def contains_all(self, xs, ys):
+        """ Return the boolean array of the positions (arrays of x and y) inside the level """
+        return (0 <= xs) & (xs < self.width) & (0 <= ys) & (ys < self.height)
+
+    def wrap(self, position):
+        """ Return position wrapped around the edges of the level if WRAP_AROUND """
+        return position % (self.width, self.height) if WRAP_AROUND else position
+
+    def has(self, position, items):
+        """ Return True if there is any of the items (FOOD | BONUS) on position """
+        return self.contains(position) and bool(self.cells[position[0], position[1]] & items)
+
+    def put(self, position, item):
+        self.cells[position[0], position[1]] |= item
+        self._update_free(position[0], position[1])
+
+    def take(self, position, item):
+        self.cells[position[0], position[1]] &= ~item
+        self._update_free(position[0], position[1])
+
+    def sections(self, position):
+        """ Return the number of snake sections on position """
+        if not self.contains(position):
+            return 0
+        return (self.cells[position[0], position[1]] & ~WALL) // SNAKE
+
+    def add_section(self, position):
+        if self.contains(position):
+            x, y = position[0], position[1]     # pylint:disable=invalid-name
+            self.cells[x, y] += SNAKE
+            self._update_free(x, y)
+            if self.regions is not None and self.cells[x, y] // SNAKE == 1:
+                self.regions.occupy(int(x) * self.height + int(y))
+
+    def remove_section(self, position):
+        if self.contains(position):
+            x, y = position[0], position[1]     # pylint:disable=invalid-name
+            self.cells[x, y] -= SNAKE
+            self._update_free(x, y)
+            if self.regions is not None and self.cells[x, y] < SNAKE:
+                self.regions.release(int(x) * self.height + int(y))
+
+    def random_free_cell(self, rng, near = None):
+        """ Return a random empty position, or None if the board is full.
+        On a maze, near (a position, like the head) only picks the cells it can get to,
+        if there are any. """
+        cell = self._choice(self.free_cells, rng, near)
+        return None if cell is None else np.array(divmod(cell, self.height))
+
+    def random_free_pair(self, rng, near = None):
+        """ Return the left position of two random empty horizontally adjacent cells,
+        or None if there aren't any. near: like for random_free_cell. """
+        cell = self._choice(self.free_pairs, rng, near)
+        return None if cell is None else np.array(divmod(cell, self.height))
+
+    def _choice(self, cell_set, rng, near):
+        if self.regions is None or near is None or not self.contains(near):
+            return cell_set.choice(rng)
+        return self.regions.choice(cell_set, rng, int(near[0]) * self.height + int(near[1]))
+
+    def _update_free(self, x, y):
+        """ Update the free cells and free pairs indices after a change on cell (x, y) """
+    # pylint:disable=invalid-name  # doesn't like single letter x, y
+        x, y = int(x), int(y)
+        cell = x * self.height + y
+        if self.cells[x, y] == 0:
+            self.free_cells.add(cell)
+        else:
+            self.free_cells.remove(cell)
+        for left in (cell - self.height, cell):
+            if 0 <= left < (self.width - 1) * self.height:
+                if left in self.free_cells and left + self.height in self.free_cells:
+                    self.free_pairs.add(left)
+                else:
+                    self.free_pairs.remove(left)
+
+
+class Food:
+    def __init__(self):
+        self.position = None
+
+    def place(self, position):
+        """ Move the food to position (None: there is no room left for it) """
+        self.position = position
+
+    def overlaps(self, position):
+        """Return True if position coincides with self.position"""
+        return self.position is not None and (position == self.position).all()
+
+
+class Bonus:
+    def __init__(self, rng):
+        self.timer = BONUS_TIMER
+        self.position = None
+        index = rng.integers(0, len(sprites.bonus_sprites))         # index is an int:
+        self.sprite = sprites.bonus_sprites[index]  # pylint:disable=invalid-sequence-index
+
+    def place(self, position):
+        """ Move the bonus left sprite to position (the right sprite goes next to it) """
+        self.position = position
+
+    def overlaps(self, position):
+        """Return True if position coincides with self.position (or right sprite)"""
+        return (position == self.position).all() or (position == self.position + RIGHT).all()
+
+
+class Snake:
+    """ The snake body, stored in a ring buffer of preallocated arrays.
+    Section 0 is the head, section len(snake) - 1 is the tail.
+    sprite_codes keeps the sprite of every body section (see BODY_SPRITES): a body section
+    never changes, so only the section behind the head is classified on every move. """
+    __slots__ = ("mouth_open", "direction_code", "capacity", "x", "y", "directions", "are_full",
+                 "head_index", "length", "board", "slot_at", "sprite_codes")
+
+    def __init__(self, board):
+        self.board = board      # Board where the snake keeps its sections up to date
+        self.mouth_open = False
+        self.direction_code = direction_code(START_DIRECTION)
+        # One extra section: the snake grows before checking if it has filled the board
+        self.capacity   = board.width * board.height + 1
+        self.x          = np.zeros(self.capacity, dtype=np.int16)
+        self.y          = np.zeros(self.capacity, dtype=np.int16)
+        self.directions = np.zeros(self.capacity, dtype=np.int8)
+        self.are_full   = np.zeros(self.capacity, dtype=np.int8)
+        self.slot_at    = np.full((board.width, board.height), -1, dtype=np.int32)
+        self.sprite_codes = np.zeros(self.capacity, dtype=np.int8)
+        self.head_index = START_LENGTH - 1
+        self.length     = START_LENGTH
+        # The tail goes in slot 0 and the head in slot START_LENGTH - 1
+        start = start_position(board.width, board.height)
+        for i in np.arange(START_LENGTH):
+            self.x[START_LENGTH - 1 - i], self.y[START_LENGTH - 1 - i] = \
+                board.wrap(start - START_DIRECTION * i)
+        self.directions[:START_LENGTH] = self.direction_code
+        for slot in np.arange(START_LENGTH):
+            board.add_section((self.x[slot], self.y[slot]))
+            if board.contains((self.x[slot], self.y[slot])):
+                self.slot_at[self.x[slot], self.y[slot]] = slot
+        self.classify()
+
+    @property
+    def direction(self):
+        return DIRECTIONS[self.direction_code]
+
+    @direction.setter
+    def direction(self, direction):
+        self.direction_code = direction_code(direction)
+
+    def __len__(self):
+        return self.length
+
+    def slot(self, section):
+        """ Return the ring buffer slot of a section (0: head, -1: tail). """
+        if section < 0:
+            section += self.length
+        return (self.head_index - section) % self.capacity
+
+    def slots(self):
+        """ Return the ring buffer slots of all the sections, from head to tail. """
+        return (self.head_index - np.arange(self.length)) % self.capacity
+
+    def section_at(self, position):
+        """ Return the section on position (0: head), or None if there is none. """
+        if self.board.sections(position) == 0:
+            return None
+        return (self.head_index - int(self.slot_at[position[0], position[1]])) % self.capacity
+
+    def position(self, section = 0):
+        """ Return the position of a section as np.array(x, y) (0: head, -1: tail). """
+        slot = self.slot(section)
+        return np.array((self.x[slot], self.y[slot]), dtype=int)
+
+    def move(self):
+        """ Move the snake body one step. Grow its tail if last section is full. """
+        tail = self.slot(-1)
+        if self.are_full[tail]:
+            self.are_full[tail] = False
+            self.length += 1
+        else:
+            self.board.remove_section((self.x[tail], self.y[tail]))
+
+        head = self.head_index
+        new_x = int(self.x[head]) + DIRECTIONS_X[self.direction_code]
+        new_y = int(self.y[head]) + DIRECTIONS_Y[self.direction_code]
+        if WRAP_AROUND:
+            new_x = new_x % self.board.width
+            new_y = new_y % self.board.height
+        self.directions[head] = self.direction_code
+        self.classify_slot(head)
+        head = self.head_index = (head + 1) % self.capacity
+        self.x[head] = new_x
+        self.y[head] = new_y
+        self.directions[head] = self.direction_code
+        self.are_full[head] = False
+        self.board.add_section((new_x, new_y))
+        if self.board.contains((new_x, new_y)):
+            self.slot_at[new_x, new_y] = head
+
+    def load(self, head, codes, are_full, mouth_open):
+        """ Replace the body with len(codes) sections from head (x, y): codes and are_full
+        are the direction codes and full flags of the sections, from head to tail.
+        The board is not updated (sections off it, like the starting ones on a small board
+        without WRAP_AROUND, are not on any cell). """
+        length = len(codes)
+        # Every section is one step behind the section before it, against its direction
+        steps = np.zeros((length, 2), dtype=int)
+        steps[1:] = DIRECTIONS[codes[1:]]
+        positions = np.asarray(head) - np.cumsum(steps, axis=0)
+        if WRAP_AROUND:
+            positions %= (self.board.width, self.board.height)
+        self.head_index = length - 1        # The tail goes in slot 0
+        self.length     = length
+        self.x[:length] = positions[::-1, 0]
+        self.y[:length] = positions[::-1, 1]
+        self.directions[:length] = codes[::-1]
+        self.are_full[:length]   = are_full[::-1]
+        self.direction_code = int(codes[0])
+        self.mouth_open     = mouth_open
+        self.slot_at.fill(-1)
+        inside = self.board.contains_all(self.x[:length], self.y[:length])
+        self.slot_at[self.x[:length][inside], self.y[:length][inside]] = \
+            np.flatnonzero(inside)
+        self.classify()
+
+    def classify(self):
+        """ Compute the sprite codes of all the sections (after the arrays were set). """
+        slots = self.slots()
+        directions = self.directions[slots].astype(np.int8)
+        previous   = self.directions[(slots - 1) % self.capacity].astype(np.int8)
+        # A turn faces its own direction, or the one left of it when it turns left
+        turns_left = np.array(ROTATE_LEFT, dtype=np.int8)[previous] == directions
+        turn_dirs  = np.where(turns_left, np.array(ROTATE_LEFT, dtype=np.int8)[directions],
+                              directions)
+        self.sprite_codes[slots] = np.where(self.are_full[slots] != 0, FULL + directions,
+                                   np.where(directions == previous, BODY + directions,
+                                            TURN + turn_dirs))
+
+    def classify_slot(self, slot):
+        """ Compute the sprite code of the body section in slot. """
+        direction = int(self.directions[slot])
+        previous  = int(self.directions[slot - 1])     # Slot -1 is the last one of the ring
+        if self.are_full[slot]:
+            self.sprite_codes[slot] = FULL + direction
+        elif direction == previous:
+            self.sprite_codes[slot] = BODY + direction
+        else:
+            # A turn faces its own direction, or the one left of it when it turns left
+            if ROTATE_LEFT[previous] == direction:
+                direction = ROTATE_LEFT[direction]
+            self.sprite_codes[slot] = TURN + direction
+
+    def overlaps(self, position, check_itself = False):
+        """Return True if position coincides with any section of the snake"""
+        sections = self.board.sections(position)
+        if check_itself and position[0] == self.x[self.head_index] \
+                        and position[1] == self.y[self.head_index]:
+            sections -= 1
+        return sections > 0
+
+    def eat(self):
+        self.open_mouth()
+        self.are_full[self.head_index] = True
+
+    def open_mouth(self):
+        self.mouth_open = True
+
+    def close_mouth(self):
+        self.mouth_open = False
+
+    def get_sprites(self):
+        """ Return a list of (sprite, position, direction, flip) tuples for the whole snake.
+        flip is "h", "v" or None, and has to be applied after facing direction. """
+        slots = self.slots()
+        positions = np.stack((self.x[slots], self.y[slots]), axis=1).astype(int)
+        codes = self.sprite_codes[slots[1:-1]].tolist()
+        body = [(sprite, position, direction, flip) for (sprite, direction, flip), position
+                in zip(map(BODY_SPRITES.__getitem__, codes), positions[1:-1])]
+        return [self.get_sprite(0),] + body + [self.get_sprite(self.length - 1),]
+
+    def get_sprite(self, section):
+        """ Return the (sprite, position, direction, flip) tuple of one section (0: head). """
+        slot = self.slot(section)
+        position = np.array((self.x[slot], self.y[slot]), dtype=int)
+        if section == 0:
+            sprite = sprites.snake_mouth if self.mouth_open else sprites.snake_head
+        elif section == self.length - 1:
+            sprite = sprites.snake_full if self.are_full[slot] else sprites.snake_tail
+        else:
+            sprite, direction, flip = BODY_SPRITES[self.sprite_codes[slot]]
+            return (sprite, position, direction, flip)
+        # Flipped to imitate the Nokia Snake II game orientation
+        direction = int(self.directions[slot])
+        return (sprite, position, DIRECTIONS[direction], FLIPS[direction])
+
+
+class Game:
+# pylint:disable=too-many-instance-attributes
+    def __init__(self, seed = None, width = GRID_WIDTH, height = GRID_HEIGHT):
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1, np.uint64)[0])
+        self.seed  = seed                           # The same seed and inputs replay the game
+        self.rng   = np.random.default_rng(seed)
+        self.recorder = None                        # Gets every tick direction (see replay.py)
+        self.autopilot = None                       # Plays instead of the player (see bot.py)
+        self.history = None                         # Keeps the ticks to rewind (see history.py)
+        self.observation = None                     # Planes updated every tick (see observation.py)
+        self.pause = True
+        self.score = 0
+        self.board = Board(width, height, maze_walls(width, height))
+        self.snake = Snake(self.board)
+        self.food  = Food()
+        self.bonus = None
+        self.inputs = InputQueue(INPUT_BUFFER)
+        self.applied_inputs = []        # Times of the timed inputs applied since it was read
+        self.next_bonus_timer  = 0
+        self.game_over()
+
+    def handle_movement(self, direction, stamp = None):
+        """ Queue a direction input at time stamp (see InputQueue). Unpause the game.
+        Return True if the snake turns on the next tick. """
+        self.pause = False
+        queued = self.inputs.push(direction_code(direction), self.snake.direction_code, stamp)
+        return queued and len(self.inputs) == 1
+
+    def on_eat(self):
+        """ Called when the snake eats food or bonus. Front-ends override it (to beep...). """
+
+    def place_food(self):
+        """ Place food on a random empty cell (that the snake can get to, on a maze).
+        Return False if the board is full. """
+        if self.food.position is not None:
+            self.board.take(self.food.position, FOOD)
+        self.food.place(self.board.random_free_cell(self.rng, self.snake.position(0)))
+        if self.food.position is None:
+            return False
+        self.board.put(self.food.position, FOOD)
+        return True
+
+    def place_bonus(self):
+        """ Place bonus on two random empty cells (that the snake can get to, on a maze).
+        Return False (and remove the bonus) if there is no room for it. """
+        self.bonus.place(self.board.random_free_pair(self.rng, self.snake.position(0)))
+        if self.bonus.position is None:
+            self.bonus = None
+            return False
+        self.board.put(self.bonus.position, BONUS)
+        self.board.put(self.bonus.position + RIGHT, BONUS)
+        return True
+
+    def remove_bonus(self):
+        """ Remove the bonus from the screen. """
+        self.board.take(self.bonus.position, BONUS)
+        self.board.take(self.bonus.position + RIGHT, BONUS)
+        self.bonus = None
+
+    def reset_next_bonus_timer(self):
+        # TODO: study actual frequency
+        self.next_bonus_timer = int(self.rng.normal(5.5, 0.5))
+
+    def handle_bonus_timers(self):
+        """ Handle bonus timers and create / remove instances. """
+        if self.bonus is None:
+            if self.next_bonus_timer == 0 and self.score > 0:
+                self.bonus = Bonus(self.rng)
+                self.place_bonus()
+        else:
+            if self.bonus.timer == 0:
+                self.remove_bonus()
+                self.reset_next_bonus_timer()
+            else:
+                self.bonus.timer -= 1
+
+    def change_direction(self):
+        """ Change snake direction using the oldest input of the queue. """
+        entry = self.inputs.pop()
+        if entry is None:
+            return
+        code, stamp = entry
+        new_position = self.board.wrap(self.snake.position(0) + DIRECTIONS[code])
+        if (new_position == self.snake.position(1)).all():
+            return
+        self.snake.direction_code = code
+        if stamp is not None:
+            self.applied_inputs += [stamp,]
+
+    def check_collisions(self):
+        """ Check collisions with wall / body / food / bonus. """
+        head_position = self.snake.position(0)
+        # Collision with wall:
+        if not self.board.contains(head_position) or self.board.has(head_position, WALL):
+            self.game_over()
+            return
+        # Collision with body:
+        if self.board.sections(head_position) > 1:
+            self.game_over()
+            return
+        # Collision with food:
+        if self.board.has(head_position, FOOD):
+            self.snake.eat()
+            self.on_eat()
+            self.score += POINTS
+            self.place_food()
+            self.next_bonus_timer -= 1
+        # Collision with bonus:
+        if self.board.has(head_position, BONUS):
+            self.snake.eat()
+            self.on_eat()
+            self.score += POINTS * self.bonus.timer
+            self.remove_bonus()
+            self.reset_next_bonus_timer()
+        # Food or bonus in front:
+        front_position = self.board.wrap(head_position + self.snake.direction)
+        if self.board.has(front_position, FOOD | BONUS):
+            self.snake.open_mouth()
+
+    def update(self):
+        if self.pause:
+            return
+        if self.history is not None:
+            self.history.begin_tick()
+        self.snake.close_mouth()
+        if self.autopilot is not None:
+            self.handle_movement(self.autopilot.next_direction())
+        self.change_direction()
+        if self.recorder is not None:
+            self.recorder.record(self.snake.direction_code)
+        self.snake.move()
+        self.check_collisions()
+        self.handle_bonus_timers()
+        if self.history is not None:
+            self.history.end_tick()
+        if self.observation is not None:
+            self.observation.update()
+
+    def rewind(self, ticks = 1):
+        """ Go back ticks ticks (through game overs too), as far as self.history goes.
+        Return the number of ticks actually rewound. """
+        if self.history is None:
+            return 0
+        ticks = self.history.rewind(ticks)
+        self.board.index_regions()
+        if self.recorder is not None:
+            self.recorder.rewind(ticks)
+        if self.autopilot is not None:
+            self.autopilot.reset()
+        if self.observation is not None:
+            self.observation.reset()
+        return ticks
+
+    def game_over(self):
+        """ Reset game to initial state. The autopilot starts the next game right away. """
+        if self.history is not None:
+            self.history.on_game_over()
+        self.pause = self.autopilot is None
+        self.score = 0
+        self.bonus = None
+        self.reset_next_bonus_timer()
+        self.board.clear()
+        self.snake = Snake(self.board)
+        self.place_food()
+
+    def snapshot(self):
+        """ Return the whole game state as bytes (a few bytes per snake section and per
+        cell), to restore it later with restore. The recorder and autopilot are not saved. """
+        snake, board = self.snake, self.board
+        slots = snake.slots()
+        n_cells = board.width * board.height
+        food  = (-1, -1) if self.food.position is None else self.food.position
+        bonus = (-1, -1, 0, -1) if self.bonus is None else \
+            (*self.bonus.position, self.bonus.timer, sprites.bonus_sprites.index(self.bonus.sprite))
+        rng = self.rng.bit_generator.state
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.seed, board.width, board.height,
+            snake.length, int(snake.x[slots[0]]), int(snake.y[slots[0]]), snake.direction_code,
+            snake.mouth_open, self.pause, self.score, self.next_bonus_timer, *food, *bonus,
+            len(self.inputs), board.free_cells.size, board.free_pairs.size,
+            rng["state"]["state"].to_bytes(16, "little"), rng["state"]["inc"].to_bytes(16, "little"),
+            rng["has_uint32"], rng["uinteger"])
+        buffer  = bytes(self.inputs.codes())
+        body    = snake.directions[slots] | snake.are_full[slots] << 2
+        dtype   = _cell_dtype(n_cells)
+        return b"".join((header, buffer, body.astype(np.uint8).tobytes(),
+                         np.array(board.free_cells.items, dtype=dtype).tobytes(),
+                         np.array(board.free_pairs.items, dtype=dtype).tobytes()))
+
+    def restore(self, data):
+        """ Go back to the state saved in data by snapshot (on a board of the same size).
+        The history is cleared, the autopilot reset and the recorder starts anew from data. """
+        self.load(data)
+        if self.history is not None:
+            self.history.clear()
+        if self.autopilot is not None:
+            self.autopilot.reset()
+        if self.recorder is not None:
+            self.recorder = type(self.recorder)(self, data)
+        if self.observation is not None:
+            self.observation.reset()
+
+    def load(self, data):
+        """ Set the game state saved in data by snapshot, leaving the history, autopilot,
+        recorder and observation as they are (see restore). """
+        # pylint:disable=too-many-locals
+        (magic, version, seed, width, height, length, head_x, head_y, code, mouth_open, pause,
+         score, next_bonus_timer, food_x, food_y, bonus_x, bonus_y, bonus_timer, bonus_sprite,
+         n_buffer, n_free_cells, n_free_pairs, rng_state, rng_inc, has_uint32, uinteger) = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not a Snake snapshot (or an unsupported version)")
+        board = self.board
+        if (width, height) != (board.width, board.height):
+            raise ValueError(f"Snapshot of a {width}x{height} board")
+        n_cells = width * height
+        dtype = _cell_dtype(n_cells)
+        arrays = np.frombuffer(data, dtype=np.uint8, offset=SNAPSHOT_HEADER.size)
+        buffer, body = arrays[:n_buffer], arrays[n_buffer:n_buffer + length]
+        cell_orders = arrays[n_buffer + length:].view(dtype)
+        # The walls are not saved: every cell but the walls, snake and items must be free
+        if board.walls.ravel()[cell_orders[:n_free_cells]].any() or \
+           n_free_cells + length + (food_x >= 0) + 2 * (bonus_x >= 0) \
+           + int(board.walls.sum()) < n_cells:
+            raise ValueError("Snapshot of another maze")
+
+        self.seed  = seed
+        self.pause = pause
+        self.score = score
+        self.next_bonus_timer = next_bonus_timer
+        self.inputs.load(buffer.tolist())
+        self.snake.load((head_x, head_y), (body & 3).astype(np.int8), body >> 2, mouth_open)
+        self.snake.direction_code = code
+
+        snake = self.snake
+        inside = board.contains_all(snake.x[:length], snake.y[:length])
+        cells = snake.x[:length][inside].astype(np.int64) * height + snake.y[:length][inside]
+        sections = np.bincount(cells, minlength=n_cells)
+        board.cells.reshape(-1)[:] = sections * SNAKE + board.walls.ravel() * WALL
+        board.free_cells.load(cell_orders[:n_cells], n_free_cells)
+        board.free_pairs.load(cell_orders[n_cells:], n_free_pairs)
+        self.food.place(None if food_x < 0 else np.array((food_x, food_y)))
+        if self.food.position is not None:
+            board.cells[food_x, food_y] |= FOOD
+        self.bonus = None
+        if bonus_x >= 0:
+            self.bonus = Bonus(self.rng)        # Draws a sprite: the RNG state is set below
+            self.bonus.sprite = sprites.bonus_sprites[bonus_sprite]
+            self.bonus.timer  = bonus_timer
+            self.bonus.place(np.array((bonus_x, bonus_y)))
+            board.cells[bonus_x:bonus_x + 2, bonus_y] |= BONUS
+        board.index_regions()
+        self.rng.bit_generator.state = {
+            "bit_generator": "PCG64",
+            "state": {"state": int.from_bytes(rng_state, "little"),
+                      "inc": int.from_bytes(rng_inc, "little")},
+            "has_uint32": has_uint32, "uinteger": uinteger}
+
+
+def _cell_dtype(n_cells):
+    """ Return the smallest dtype of the cell numbers of a snapshot """
+    return np.dtype("<u2") if n_cells <= 1 << 16 else np.dtype("<u4")
+
+
+def save_atomically(path, data):
+    """ Write data (bytes) to path, so that path always holds either its old content or
+    all of data, even if the program is killed while writing. """
+    directory = os.path.dirname(os.path.abspath(path))
+    umask = os.umask(0)     # Read the umask (mkstemp makes files for their owner only)
+    os.umask(umask)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".snake-")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temporary_path, 0o666 & ~umask)    # As open(path, "wb") would
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
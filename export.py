@@ -0,0 +1,309 @@
+""" Export a game as PNG frames or an animated GIF, headless (SDL dummy drivers).
+
+It replays a recording (see replay.py), or lets the autopilot play, draws every tick with
+the game renderer and keeps every Nth frame. The screen is copied into one of a few
+preallocated buffers and a thread pool encodes it (zlib releases the GIL), so the game
+loop only waits if all the buffers are still being encoded, never on the disk.
+GIF frames only hold the pixels that changed since the last one (looked up in the
+renderer dirty rects), as runs of colors: they encode fast and stay small.
+
+    python export.py last_session.snake --output frames        # frames/frame-00000.png...
+    python export.py --bot --ticks 300 --every 2 --output screenshots/autopilot.gif
+"""
+import argparse
+import os
+import queue
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# pylint:disable=wrong-import-position
+import numpy as np
+import pygame
+
+import core
+import mazes
+import replay
+from bot import Autopilot
+# pylint:enable=wrong-import-position
+
+BUFFERS = 8         # Frames being encoded at once (at most)
+GIF_CHUNK = 254     # LZW codes between clear codes: the codes stay 9 bits long
+TRANSPARENT = 255   # GIF palette index of the pixels that didn't change
+
+
+class FramePool:
+    """ Preallocated frame buffers (height x width x 3 bytes, RGB rows), reused once encoded. """
+    def __init__(self, size, n_buffers = BUFFERS):
+        self.free = queue.Queue()
+        for _ in range(n_buffers):
+            self.free.put(np.empty((size[1], size[0], 3), dtype=np.uint8))
+        self.wait_time = 0          # Seconds the game loop waited for a free buffer
+
+    def capture(self, surface):
+        """ Return a free buffer holding a copy of the pixels of surface. """
+        start = time.perf_counter()
+        buffer = self.free.get()
+        self.wait_time += time.perf_counter() - start
+        pixels = pygame.surfarray.pixels3d(surface)     # A view: no copy
+        np.copyto(buffer, pixels.transpose(1, 0, 2))
+        del pixels                                      # Unlock the surface
+        return buffer
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+
+def png_bytes(frame):
+    """ Return frame (an RGB buffer, see FramePool) as a PNG file. """
+    height, width, _ = frame.shape
+    # "Sub" filter: every byte minus the one of the pixel on its left (flat colors: zeros)
+    rows = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 0] = 1
+    rows[:, 1:4] = frame[:, 0]
+    np.subtract(frame[:, 1:], frame[:, :-1], out=rows[:, 4:].reshape(height, width - 1, 3))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data \
+             + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)     # 8-bit RGB
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) \
+         + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) + chunk(b"IEND", b"")
+
+
+class Palette:
+    """ Up to 255 colors, from the colors of a frame (or a 6 x 6 x 6 color cube if it has
+    too many), with the index of the nearest color of any pixel. Index 255 is transparent. """
+    def __init__(self, frame):
+        colors = np.unique(self._keys(frame))
+        if len(colors) > TRANSPARENT:
+            levels = np.arange(0, 256, 51)
+            colors = np.sort(self._keys(np.stack(np.meshgrid(levels, levels, levels), axis=-1)
+                                        .reshape(-1, 3)))
+        self.keys = colors
+        self.colors = np.stack((colors >> 16, colors >> 8 & 255, colors & 255), axis=1) \
+                        .astype(np.uint8)
+
+    def index(self, frame):
+        """ Return the palette index of every pixel of frame (uint8, same height x width). """
+        keys = self._keys(frame)
+        indices = np.searchsorted(self.keys, keys).clip(0, len(self.keys) - 1)
+        missing = self.keys[indices] != keys
+        if missing.any():
+            unknown, inverse = np.unique(keys[missing], return_inverse=True)
+            rgb = np.stack((unknown >> 16, unknown >> 8 & 255, unknown & 255), axis=1)
+            distances = ((rgb[:, None, :] - self.colors[None, :, :].astype(np.int64)) ** 2) \
+                        .sum(axis=2)
+            indices[missing] = distances.argmin(axis=1)[inverse.ravel()]
+        return indices.astype(np.uint8)
+
+    def table(self):
+        """ Return the GIF color table (256 entries). """
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(self.colors)] = self.colors
+        return table.tobytes()
+
+    @staticmethod
+    def _keys(frame):
+        frame = frame.astype(np.int64)
+        return frame[..., 0] << 16 | frame[..., 1] << 8 | frame[..., 2]
+
+
+def gif_image(indices):
+    """ Return the LZW image data of palette indices (8-bit). A run of n pixels of a color
+    is its code followed by the codes of the strings being defined (2, 3, 4... pixels of
+    that color), so no dictionary is kept, and a clear code every GIF_CHUNK codes keeps
+    them all 9 bits long: the bit packing is a few NumPy operations. """
+    flat = indices.ravel().astype(np.int16)
+    starts = np.flatnonzero(np.diff(flat, prepend=-1))
+    lengths = np.diff(np.append(starts, len(flat)))
+    codes = [256,]                  # 256: clear code
+    since_clear = 0
+    for color, length in zip(flat[starts].tolist(), lengths.tolist()):
+        while length:
+            if since_clear == GIF_CHUNK:
+                codes += [256,]
+                since_clear = 0
+            codes += [color,]
+            since_clear += 1
+            length -= 1
+            step = 2
+            while step <= length and since_clear < GIF_CHUNK:
+                codes += [257 + since_clear,]   # The next free code: step more pixels
+                since_clear += 1
+                length -= step
+                step += 1
+    codes += [257,]                 # 257: end code
+    codes = np.array(codes, dtype=np.uint16)
+    bits = (codes[:, None] >> np.arange(9, dtype=np.uint16)) & 1
+    data = np.packbits(bits.astype(np.uint8).ravel(), bitorder="little").tobytes()
+    blocks = b"".join(bytes((len(data[i:i + 255]),)) + data[i:i + 255]
+                      for i in range(0, len(data), 255))
+    return b"\x08" + blocks + b"\x00"
+
+
+class GifWriter:
+    """ Write an animated GIF frame by frame. Every frame only holds the pixels that changed
+    since the one before (the others are transparent). Frames are encoded by a thread pool
+    and written in order by a thread of their own, which releases the frame buffers. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, path, frame, delay, pool, release):
+        self.file  = open(path, "wb")     # pylint:disable=consider-using-with
+        self.pool  = pool
+        self.release = release
+        self.delay = max(2, round(delay * 100))     # Hundredths of a second
+        self.palette = Palette(frame)
+        self.writer  = ThreadPoolExecutor(1)
+        self.previous = None
+        height, width, _ = frame.shape
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0x87, 0, 0)
+                        + self.palette.table()
+                        + b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")   # Loop forever
+
+    def add(self, frame, rect):
+        """ Queue a frame buffer (see FramePool) that only changed in rect (x, y, width,
+        height) since the last one. """
+        previous, self.previous = self.previous, frame
+        encoded = self.pool.submit(self._encode, previous, frame, rect)
+        self.writer.submit(self._write, encoded, previous)
+
+    def _write(self, encoded, previous):
+        self.file.write(encoded.result())
+        if previous is not None:        # The frames before and after it are encoded
+            self.release(previous)
+
+    def _encode(self, previous, frame, rect):
+        x, y, width, height = rect
+        if previous is None:
+            indices = self.palette.index(frame)
+        else:
+            changed = (frame[y:y + height, x:x + width]
+                       != previous[y:y + height, x:x + width]).any(axis=2)
+            rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+            if len(rows) == 0:      # Nothing changed: a transparent pixel (for the delay)
+                x, y, width, height = 0, 0, 1, 1
+                indices = np.full((1, 1), TRANSPARENT, dtype=np.uint8)
+            else:
+                x, y = x + columns[0], y + rows[0]
+                height, width = rows[-1] - rows[0] + 1, columns[-1] - columns[0] + 1
+                changed = changed[rows[0]:rows[0] + height, columns[0]:columns[0] + width]
+                indices = self.palette.index(frame[y:y + height, x:x + width])
+                indices[~changed] = TRANSPARENT
+        # Graphic control: don't dispose (the next frame is drawn over it), transparent index
+        return b"\x21\xf9\x04\x05" + struct.pack("<HB", self.delay, TRANSPARENT) + b"\x00" \
+             + b"\x2c" + struct.pack("<HHHHB", x, y, width, height, 0) + gif_image(indices)
+
+    def close(self):
+        self.writer.shutdown()
+        if self.previous is not None:
+            self.release(self.previous)
+        self.file.write(b"\x3b")
+        self.file.close()
+
+
+def export(game, codes, output, every = 1, workers = None):
+    """ Play the game (the direction codes of a recording, or the autopilot if codes is an
+    int: its number of ticks), draw it and save every Nth frame to output (a .gif file, or
+    a directory of PNG files). Return (frames, seconds, seconds waiting for buffers). """
+    # pylint:disable=import-outside-toplevel,too-many-locals
+    import main
+    renderer = main.Renderer(game.hud)
+    screen = main.SCREEN
+    frames = FramePool(screen.get_size())
+    pool = ThreadPoolExecutor(workers or os.cpu_count())
+    is_gif = output.lower().endswith(".gif")
+    if not is_gif:
+        os.makedirs(output, exist_ok=True)
+    gif = None
+    changed = pygame.Rect(0, 0, 0, 0)       # Since the last frame kept
+    n_ticks = codes if isinstance(codes, int) else len(codes)
+    n_frames = 0
+    start = time.perf_counter()
+    for tick in range(n_ticks + 1):
+        if tick > 0:
+            if not isinstance(codes, int):
+                game.inputs.load((codes[tick - 1],))
+            game.pause = False
+            game.update()
+        for rect in renderer.draw(game):
+            changed = rect if changed.size == (0, 0) else changed.union(rect)
+        if tick % every:
+            continue
+        frame = frames.capture(screen)
+        if not is_gif:
+            path = os.path.join(output, f"frame-{n_frames:05d}.png")
+            pool.submit(_write_png, path, frame, frames.release)
+        else:
+            if gif is None:
+                gif = GifWriter(output, frame, every * core.GAME_SPEED / 1000, pool,
+                                frames.release)
+            gif.add(frame, tuple(changed))
+        changed = pygame.Rect(0, 0, 0, 0)
+        n_frames += 1
+    pool.shutdown()
+    if gif is not None:
+        gif.close()
+    return n_frames, time.perf_counter() - start, frames.wait_time
+
+
+def _write_png(path, frame, on_done):
+    try:
+        data = png_bytes(frame)
+    finally:
+        on_done(frame)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def main():
+    # pylint:disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(description="Export a Snake game as PNG frames or a GIF.")
+    parser.add_argument("recording", nargs="?", help="recording to replay (see replay.py)")
+    parser.add_argument("--bot", action="store_true", help="let the autopilot play instead")
+    parser.add_argument("--ticks", type=int, default=500,
+                        help="ticks the autopilot plays (default: %(default)s)")
+    parser.add_argument("--size", default=f"{core.GRID_WIDTH}x{core.GRID_HEIGHT}",
+                        help="board size of the autopilot game (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the autopilot game")
+    parser.add_argument("--maze", choices=mazes.levels,
+                        help="walls of the autopilot level (see mazes.py; a recording has its own)")
+    parser.add_argument("--every", type=int, default=1, help="keep every Nth frame")
+    parser.add_argument("--workers", type=int, help="encoding threads (default: CPU count)")
+    parser.add_argument("--output", required=True,
+                        help="a .gif file, or a directory for the PNG frames")
+    args = parser.parse_args()
+    core.MAZE = args.maze
+    if (args.recording is None) == (not args.bot):
+        parser.error("give a recording or --bot")
+
+    import main as game_main
+    if args.bot:
+        seed, board_size, codes = args.seed, [int(n) for n in args.size.split("x")], args.ticks
+        start = None
+    else:
+        with open(args.recording, "rb") as file:
+            seed, board_size, core.MAZE, codes, start = replay.load(file.read())
+    pygame.init()
+    game_main.init_display(*board_size)
+    game_main.BEEP = False          # No sound
+    game = game_main.Game(seed, *board_size)
+    if start is not None:
+        game.restore(start)
+    if args.bot:
+        game.autopilot = Autopilot(game)
+    n_frames, seconds, wait_time = export(game, codes, args.output, args.every, args.workers)
+    n_ticks = codes if args.bot else len(codes)
+    print(f"{n_frames} frames of {n_ticks} ticks exported in {seconds:.2f} s "
+          f"({n_ticks * core.GAME_SPEED / 1000 / seconds:.0f}x real time, "
+          f"{1000 * wait_time:.0f} ms waiting for the encoders) to {args.output}",
+          file=sys.stderr)
+    pygame.quit()
+
+
+if __name__=="__main__":
+    main()
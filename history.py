@@ -0,0 +1,230 @@
+""" Rewind a core.Game tick by tick, from a fixed-size ring buffer of per-tick deltas.
+
+A tick only moves the head and the tail of the snake (and sometimes the food, the bonus
+and the score), so every tick keeps what it changed: the head direction, whether the tail
+grew, the old food / bonus / score / timers / random generator state and the swaps of
+the board free cell sets. That is a few tens of bytes per tick, whatever the board size.
+The ticks ending with a game over keep a full snapshot (see core.Game.snapshot) instead.
+
+    game.history = History(game, 3000)
+    game.update()...
+    game.rewind(100)
+"""
+import numpy as np
+
+import core
+from core import FOOD, BONUS, SNAKE
+
+OPS_PER_TICK = 8    # Average free cell set swaps (2 cells each) kept per tick
+MASK_64      = (1 << 64) - 1
+
+RECORD = np.dtype([     # Everything a tick changes, as it was before the tick
+    ("grew", "?"), ("head_dir", "i1"), ("direction", "i1"), ("mouth_open", "?"),
+    ("tail_x", "<i2"), ("tail_y", "<i2"), ("tail_dir", "i1"), ("inputs_len", "i1"),
+    ("inputs", "<u2"), ("score", "<i8"), ("next_bonus_timer", "<i4"), ("food", "<i4"),
+    ("bonus", "<i4"), ("bonus_timer", "<i4"), ("bonus_sprite", "i1"),
+    ("rng_high", "<u8"), ("rng_low", "<u8"), ("rng_uint32", "<u4"), ("rng_has_uint32", "?"),
+    ("ops_start", "<i8"), ("cell_ops", "<u2"), ("pair_ops", "<u2"), ("reset", "?")])
+GREW, HEAD_DIR, DIRECTION, MOUTH_OPEN, TAIL_X, TAIL_Y, TAIL_DIR, INPUTS_LEN, INPUTS, SCORE, \
+    NEXT_BONUS_TIMER, FOOD_CELL, BONUS_CELL, BONUS_TIMER, BONUS_SPRITE, \
+    RNG_HIGH, RNG_LOW, RNG_UINT32, RNG_HAS_UINT32, OPS_START, CELL_OPS, PAIR_OPS, \
+    RESET = range(len(RECORD.names))
+
+
+class History:
+    """ The last ticks of a game (set it as game.history), to undo them with game.rewind.
+    size: the most ticks kept. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, game, size = 3000):
+        self.game  = game
+        self.size  = size
+        self.records = np.zeros(size, dtype=RECORD)
+        self.ops     = np.zeros(size * OPS_PER_TICK * 2, dtype=np.int64)   # Ring of cells
+        self.ops_end = 0        # Cells written to self.ops so far (the ring wraps)
+        self.ticks = 0          # Ticks recorded (minus the ones rewound)
+        self.depth = 0          # Ticks that can be rewound
+        self.resets = {}        # {tick: snapshot before it} for the ticks with a game over
+        self.record  = None     # Record of the current tick (None between ticks)
+        self.cell_journal = []
+        self.pair_journal = []
+        game.board.free_cells.journal = self.cell_journal
+        game.board.free_pairs.journal = self.pair_journal
+
+    def __len__(self):
+        return self.depth
+
+    def begin_tick(self):
+        """ Keep what the tick is going to change (called by core.Game.update). """
+        game, snake = self.game, self.game.snake
+        tail = snake.slot(-1)
+        rng = game.rng.bit_generator.state
+        state = rng["state"]["state"]
+        bonus = game.bonus
+        inputs = game.inputs.codes()       # 2 bits each (core.INPUT_BUFFER is at most 8)
+        self.record = (
+            bool(snake.are_full[tail]), snake.directions[snake.head_index],
+            snake.direction_code, snake.mouth_open,
+            snake.x[tail], snake.y[tail], snake.directions[tail],
+            len(inputs), sum(code << 2 * i for i, code in enumerate(inputs)),
+            game.score, game.next_bonus_timer,
+            self._cell(game.food.position),
+            -1 if bonus is None else self._cell(bonus.position),
+            0 if bonus is None else bonus.timer,
+            -1 if bonus is None else core.sprites.bonus_sprites.index(bonus.sprite),
+            state >> 64, state & MASK_64, rng["uinteger"], rng["has_uint32"],
+            self.ops_end, 0, 0, False)
+        self.cell_journal.clear()
+        self.pair_journal.clear()
+
+    def end_tick(self):
+        """ Store the record of the tick that has just been played. """
+        i = self.ticks % self.size
+        self.records[i] = self.record
+        self.record = None
+        if self.ticks in self.resets:
+            self.records[i]["reset"] = True
+        else:
+            ops = self.cell_journal + self.pair_journal
+            self.records[i]["cell_ops"] = len(self.cell_journal)
+            self.records[i]["pair_ops"] = len(self.pair_journal)
+            start = self.ops_end % len(self.ops)
+            first = min(len(ops), len(self.ops) - start)
+            self.ops[start:start + first] = ops[:first]
+            self.ops[:len(ops) - first] = ops[first:]
+            self.ops_end += len(ops)
+        self.ticks += 1
+        self.depth = min(self.depth + 1, self.size)
+        # The oldest ticks whose swaps have been written over can't be rewound anymore
+        while self.depth and self._oldest()["ops_start"] < self.ops_end - len(self.ops):
+            self.depth -= 1
+        for tick in [tick for tick in self.resets if tick < self.ticks - self.depth]:
+            del self.resets[tick]
+
+    def on_game_over(self):
+        """ Keep a snapshot of the game before the tick ending with a game over
+        (called by core.Game.game_over, before it resets the game). """
+        if self.record is None:
+            return
+        # The tick has only moved the snake so far (into a wall or its body): undo that for
+        # the snapshot. The next game starts with the inputs and random generator of after it
+        game = self.game
+        inputs, rng = list(game.inputs.entries), game.rng.bit_generator.state
+        self._undo(self.record, self.cell_journal, self.pair_journal)
+        self._set_state(self.record)
+        self.resets[self.ticks] = game.snapshot()
+        game.inputs.entries.clear()
+        game.inputs.entries.extend(inputs)
+        game.rng.bit_generator.state = rng
+        self.cell_journal.clear()
+        self.pair_journal.clear()
+
+    def clear(self):
+        """ Forget every tick (after core.Game.restore). """
+        self.ops_end = 0
+        self.ticks = 0
+        self.depth = 0
+        self.resets.clear()
+        self.record = None
+
+    def rewind(self, ticks):
+        """ Undo the last ticks (as many as there are). Return the number of ticks undone. """
+        ticks = min(ticks, self.depth)
+        record = None
+        for _ in range(ticks):
+            self.ticks -= 1
+            self.depth -= 1
+            record = self.records[self.ticks % self.size].item()
+            if record[RESET]:
+                self.game.load(self.resets.pop(self.ticks))
+                continue
+            n_ops = record[CELL_OPS] + record[PAIR_OPS]
+            self.ops_end -= n_ops
+            start = self.ops_end % len(self.ops)
+            ops = self.ops[start:start + n_ops].tolist()
+            if start + n_ops > len(self.ops):
+                ops += self.ops[:start + n_ops - len(self.ops)].tolist()
+            self._undo(record, ops[:record[CELL_OPS]], ops[record[CELL_OPS]:])
+        # The score, timers, random generator... of the ticks in between don't matter
+        if record is not None and not record[RESET]:
+            self._set_state(record)
+        return ticks
+
+    def _undo(self, record, cell_ops, pair_ops):
+        """ Put the snake, the board, the food and the bonus back where they were before
+        the tick of record, from where they are after it (or right after the snake moved,
+        for a game over). """
+        # pylint:disable=too-many-locals
+        game, snake = self.game, self.game.snake
+        board, cells = game.board, game.board.cells
+        height = board.height
+        board.free_cells.undo(cell_ops)
+        board.free_pairs.undo(pair_ops)
+
+        head = snake.head_index
+        head_x, head_y = int(snake.x[head]), int(snake.y[head])
+        snake.head_index = (head - 1) % snake.capacity
+        snake.directions[snake.head_index] = record[HEAD_DIR]
+        grew = record[GREW]
+        if grew:
+            snake.length -= 1
+        # The head may have taken the slot the tail left since: put the tail back in it
+        tail = snake.slot(-1)
+        tail_x, tail_y = record[TAIL_X], record[TAIL_Y]   # Not a cell: it can be off the board
+        snake.x[tail], snake.y[tail] = tail_x, tail_y
+        snake.directions[tail] = record[TAIL_DIR]
+        snake.are_full[tail] = grew
+        snake.classify_slot((tail + 1) % snake.capacity)   # Its sprite depends on the tail
+        if board.contains((head_x, head_y)):
+            cells[head_x, head_y] -= SNAKE
+            snake.slot_at[head_x, head_y] = -1
+            if board.sections((head_x, head_y)):    # It had run into its body
+                slots = snake.slots()
+                on_head = (snake.x[slots] == head_x) & (snake.y[slots] == head_y)
+                snake.slot_at[head_x, head_y] = slots[np.flatnonzero(on_head)[0]]
+        if board.contains((tail_x, tail_y)):     # The starting snake can stick out of it
+            if not grew:
+                cells[tail_x, tail_y] += SNAKE
+            snake.slot_at[tail_x, tail_y] = tail
+
+        food = record[FOOD_CELL]
+        if food != self._cell(game.food.position):
+            if game.food.position is not None:
+                cells[game.food.position[0], game.food.position[1]] &= ~FOOD
+            game.food.place(None if food < 0 else np.array(divmod(food, height)))
+            if food >= 0:
+                cells[food // height, food % height] |= FOOD
+        bonus = record[BONUS_CELL]
+        if game.bonus is not None and bonus != self._cell(game.bonus.position):
+            x, y = game.bonus.position
+            cells[x:x + 2, y] &= ~BONUS
+            game.bonus = None
+        if bonus >= 0:
+            if game.bonus is None:
+                game.bonus = core.Bonus(game.rng)   # Draws a sprite: _set_state sets the RNG
+                game.bonus.sprite = core.sprites.bonus_sprites[record[BONUS_SPRITE]]
+                game.bonus.place(np.array(divmod(bonus, height)))
+                cells[bonus // height:bonus // height + 2, bonus % height] |= BONUS
+            game.bonus.timer = record[BONUS_TIMER]
+
+    def _set_state(self, record):
+        """ Set the score, timers, inputs and random generator as they were before the tick
+        of record. """
+        game = self.game
+        game.snake.direction_code = record[DIRECTION]
+        game.snake.mouth_open = record[MOUTH_OPEN]
+        game.score = record[SCORE]
+        game.next_bonus_timer = record[NEXT_BONUS_TIMER]
+        game.inputs.load([record[INPUTS] >> 2 * i & 3 for i in range(record[INPUTS_LEN])])
+        game.pause = False
+        rng = game.rng.bit_generator.state
+        rng["state"]["state"] = record[RNG_HIGH] << 64 | record[RNG_LOW]
+        rng["uinteger"] = record[RNG_UINT32]
+        rng["has_uint32"] = record[RNG_HAS_UINT32]
+        game.rng.bit_generator.state = rng
+
+    def _oldest(self):
+        return self.records[(self.ticks - self.depth) % self.size]
+
+    def _cell(self, position):
+        return -1 if position is None else int(position[0]) * self.game.board.height \
+                                           + int(position[1])
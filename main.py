@@ -1,51 +1,91 @@
 """ An implementation of the Snake game using Pygame and NumPy arrays """
 import asyncio
+import os
+import struct
+import sys
+import time
 
+START_TIME = time.perf_counter()    # The time to first frame is measured from here
+
+# pylint:disable=wrong-import-position,wrong-import-order
 import pygame
 import numpy as np
 
+import assets
+import core
 import sprites
-
-UP    = np.array(( 0, -1))
-DOWN  = np.array(( 0,  1))
-LEFT  = np.array((-1,  0))
-RIGHT = np.array(( 1,  0))
-
-# BEGIN Customize some game parameters:
+from pacing import FramePacer, TickScheduler, WEB
+from profiler import FrameProfiler
+from replay import Recorder
+from bot import Autopilot
+from history import History
+from core import UP, DOWN, LEFT, RIGHT, GRID_WIDTH, GRID_HEIGHT
+from core import WRAP_AROUND, FOOD, SNAKE, WALL, direction_code
+# pylint:enable=wrong-import-position,wrong-import-order
+
+# BEGIN Customize some game parameters (see core.py for the board and difficulty):
 ## Graphics
 CELL_WIDTH    =  6    # Width  of one "fake pixel", in actual pixels
 CELL_HEIGHT   =  8    # Height of one "fake pixel", in actual pixels
 BORDER_WIDTH  =  1    # Size of the empty space between cells, in actual pixels
-GRID_WIDTH    = 20    # Width  of the screen, in sprites (see below)
-GRID_HEIGHT   =  9    # Height of the screen, in sprites (see below)
 SCREEN_BORDER =  3    # Size of borders at the edge of the screen, in cells
+RENDERER      = "tiles"    # "tiles": blit sprite tiles where the screen changed.
+                           # "cells": rasterize the whole frame as a NumPy matrix of cells.
 CELL_COLOR    = pygame.Color(( 35,  43, 1))    # Color of the "fake pixels" (RGB)
 BG_MAIN_COLOR = pygame.Color((175, 215, 5))    # Main color of the background (RGB)
 BG_EDGE_COLOR = pygame.Color((155, 175, 2))    # Dark color for the background gradient (RGB)
 
-## Starting position
-START_X         = GRID_WIDTH//2     # Starting X position
-START_Y         = GRID_HEIGHT//2    # Starting Y position
-START_LENGTH    = 7                 # Starting size
-START_DIRECTION = RIGHT             # Starting direction
-
-## Difficulty
-GAME_SPEED  = 200    # Milliseconds between game cycles
-WRAP_AROUND = True   # Behavior when touching the edge of the screen. True: wrap around. False: die.
-BONUS_TIMER = 20     # Turns until the bonus disappears
+## Camera (the board can be bigger than the window, see core.py)
+VIEW_WIDTH    = 20    # Width  of the visible part of the board, in sprites
+VIEW_HEIGHT   =  9    # Height of the visible part of the board, in sprites
+CAMERA_MARGIN =  3    # The view scrolls when the head gets closer to its edge, in sprites
+
+## Frame pacing
+FRAME_PACING = True   # True: sleep until the game changes. False: redraw as fast as possible.
+MAX_FPS      = 60     # Maximum frames per second (0: no limit)
+MAX_CATCH_UP = 5      # Most ticks played at once after a long frame (the next are skipped)
+
+## Speed levels, selected with the number keys (see core.py for the starting GAME_SPEED)
+SPEED_LEVELS = (400, 300, 250, 200, 160, 130, 100, 75, 50)   # Milliseconds between ticks
+
+## Controls (see core.py for the number of turns queued)
+ADVANCE_ON_TURN = False   # True: a turn moves the snake right away, not on the next tick
+                          # (if the last tick is at least half a GAME_SPEED ago)
+TAP_EDGE     = 1 / 3      # Width of the screen edges that turn the snake when clicked
+
+## Autopilot
+AUTOPILOT    = False  # True: the game plays itself from the start (toggle with the A key)
+
+## Rewind
+REWIND_TICKS = 3000   # Last ticks kept to rewind with the backspace key (0: none)
+REWIND_STEP  = 10     # Ticks rewound by one backspace press
+
+## Debugging
+RECORD_FILE  = "last_session.snake"   # Inputs of the session, saved on exit (see replay.py)
+SNAPSHOT_FILE = "last_session.snapshot"   # Game saved on exit and resumed on start (None: don't)
+SNAPSHOT_TICKS = 50      # Ticks between two saves of SNAPSHOT_FILE (also on pause, game over)
+SHOW_PROFILER = False    # Show frame stats on the top bar (toggle with F3)
+PROFILE_FILE  = None     # File to save the frame stats to on exit (None: don't save them)
 # END Customize
 
-POINTS = GAME_SPEED // 100  # TODO: study the actual scoring system
-
 # BETTER DON'T TOUCH THIS!! (it *should* work with different sized sprites in sprites.py)
 SPRITE_SIZE  =  4    # Hight and width of the game sprites, in cells (see above)
 HUD_SPRITE_W =  4    # Width  of the HUD numbers sprites, in cells (see above)
 HUD_SPRITE_H =  5    # Height of the HUD numbers sprites, in cells (see above)
 HUD_BAR      =  3 + HUD_SPRITE_H    # Height of the HUD top bar, in cells (see above)
+# Everything the asset bundle is built from, besides sprites.py (see assets.py)
+ASSET_SETTINGS = (CELL_WIDTH, CELL_HEIGHT, BORDER_WIDTH,
+                  ((SPRITE_SIZE, SPRITE_SIZE), (2*SPRITE_SIZE, SPRITE_SIZE),
+                   (HUD_SPRITE_W, HUD_SPRITE_H)))
+
+
+LEVEL_WIDTH  = VIEW_WIDTH  * SPRITE_SIZE    # Set again by init_display for small boards
+LEVEL_HEIGHT = VIEW_HEIGHT * SPRITE_SIZE
 
+RIGHT_CODE = direction_code(RIGHT)
 
-LEVEL_WIDTH  = GRID_WIDTH  * SPRITE_SIZE
-LEVEL_HEIGHT = GRID_HEIGHT * SPRITE_SIZE
+PROFILER = FrameProfiler()
+BEEP     = None     # Sound played when the snake eats, loaded by play_beep
 
 
 class Cell:
@@ -56,366 +96,327 @@ class Cell:
         rect_x = rect_x * CELL_WIDTH  + BORDER_WIDTH
         rect_y = rect_y * CELL_HEIGHT + BORDER_WIDTH
         self.rect = pygame.Rect(rect_x, rect_y, rect_width, rect_height)
+        PROFILER.count("cells")
 
     def draw(self):
         pygame.draw.rect(SCREEN, CELL_COLOR, self.rect)
+        PROFILER.count("draws")
+
+
+class Atlas:
+    """ Pre-rendered Surface tiles of the sprites, for every direction and flip, cut from
+    the tiles sheet of the asset bundle (see assets.py) when they are first drawn.
+    Drawing a sprite is then a single blit. """
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.tiles = {}
+        self.bitmaps = {}
+        # An 8 bit Surface straight from the mask bytes: 1 is a lit pixel, 0 is transparent
+        mask = np.ascontiguousarray(bundle.tiles.T).view(np.uint8)
+        self.sheet = pygame.image.frombytes(mask.tobytes(), bundle.tiles.shape, "P")
+        self.sheet.set_palette(((0, 0, 0), CELL_COLOR))
+        self.sheet.set_colorkey(0)
+        if pygame.display.get_surface():
+            self.sheet = self.sheet.convert()
+
+    def tile(self, sprite, direction = RIGHT_CODE, flip = None):
+        """ Return the tile of a sprite facing direction (a code) and flipped
+        (None, "h", "v" or "hv"). Sprites that aren't bundled are rendered and cached. """
+        key = (sprite, direction, flip)
+        tile = self.tiles.get(key)
+        if tile is None:
+            rect = self.bundle.rect(sprite, direction, flip)
+            if rect is None:
+                tile = self._render(sprite, direction, flip)
+            else:
+                x, y, width, height = rect
+                tile = self.sheet.subsurface(x * CELL_WIDTH, y * CELL_HEIGHT,
+                                             width * CELL_WIDTH, height * CELL_HEIGHT)
+            self.tiles[key] = tile
+        return tile
+
+    def bitmap(self, sprite, direction = RIGHT_CODE, flip = None):
+        """ Return the lit cells of a sprite facing direction (a code) and flipped,
+        as a boolean array indexed [x, y] (like pygame.surfarray). """
+        key = (sprite, direction, flip)
+        bitmap = self.bitmaps.get(key)
+        if bitmap is None:
+            bitmap = self.bundle.bitmap(sprite, direction, flip)
+            if bitmap is None:
+                bitmap = assets.transform(sprite, direction, flip)
+            self.bitmaps[key] = bitmap
+        return bitmap
+
+    def _render(self, sprite, direction, flip):
+        """ Draw the Cells of the rotated and flipped sprite on a transparent Surface """
+        bitmap = self.bitmap(sprite, direction, flip)
+        width, height = bitmap.shape
+        surface = pygame.Surface((width * CELL_WIDTH, height * CELL_HEIGHT), pygame.SRCALPHA)
+        for i, j in zip(*np.nonzero(bitmap)):
+            surface.fill(CELL_COLOR, Cell(i, j).rect)
+        return surface.convert_alpha() if pygame.display.get_surface() else surface
 
 
 class Sprite:
     def __init__(self, sprite, position, direction = RIGHT):
         self.position = position     # type : np.array(x:int, y:int)
         self.original_sprite = sprite
-        self.sprite = None
+        self.direction = RIGHT_CODE
+        self.flipped_h = False
+        self.flipped_v = False
         self.face(direction)
 
     def face(self, direction):
         """ Rotate the sprite to face some direction. """
-        if (direction == RIGHT).all():
-            self.sprite = np.array(self.original_sprite)
-        elif (direction == UP).all():
-            self.sprite = np.rot90(self.original_sprite)
-        elif (direction == LEFT).all():
-            self.sprite = np.rot90(self.original_sprite,2)
-        elif (direction == DOWN).all():
-            self.sprite = np.rot90(self.original_sprite,3)
+        self.direction = direction_code(direction)
+        self.flipped_h = False
+        self.flipped_v = False
 
     def flip_h(self):
         """ Flip the sprite horizontally (left to right). """
-        self.sprite = np.fliplr(self.sprite)
+        self.flipped_h = not self.flipped_h
 
     def flip_v(self):
         """ Flip the sprite vertically (up to down). """
-        self.sprite = np.flipud(self.sprite)
+        self.flipped_v = not self.flipped_v
+
+    def get_tile(self):
+        """ Return the pre-rendered Surface of the sprite. """
+        flip = ("h" if self.flipped_h else "") + ("v" if self.flipped_v else "")
+        return ATLAS.tile(self.original_sprite, self.direction, flip or None)
 
     def draw(self, hud = False, offset = (0, 0)):
-        """ Convert the sprite to Cells and draw them on the screen.
+        """ Blit the sprite tile on the screen.
         hud = True: draw the sprites on the top bar
         hud = False: draw the sprites on the main level
         offset (x, y): offset the drawing position by x and y. """
-        cell_positions = [
-            np.array((i, j)) for j, col in enumerate(self.sprite) for i, xy in enumerate(col) if xy
-        ]
-        sprite_x = self.position[0] * (HUD_SPRITE_W if hud else SPRITE_SIZE)
-        sprite_y = self.position[1] * (HUD_SPRITE_H if hud else SPRITE_SIZE)
-        for cell_x, cell_y in cell_positions:
-            cell_x += sprite_x + SCREEN_BORDER + offset[0] + (-2 if hud else 0)
-            cell_y += sprite_y + SCREEN_BORDER + offset[1] + (-2 if hud else HUD_BAR)
-            Cell(cell_x, cell_y).draw()
-
-
-class Food:
-    def __init__(self):
-        self.position = None
-        self.place()
-
-    def place(self):
-    # pylint:disable=invalid-name  # doesn't like single letter x, y
-        x = np.random.randint(0, GRID_WIDTH  - 1)
-        y = np.random.randint(0, GRID_HEIGHT - 1)
-        self.position = np.array((x, y))
-
-    def overlaps(self, position):
-        """Return True if position coincides with self.position"""
-        return (position == self.position).all()
-
-    def draw(self):
-        Sprite(sprites.food, self.position).draw()
-
-
-class Bonus:
-    def __init__(self):
-        self.timer = BONUS_TIMER
-        self.position = None
-        self.place()
-        index = np.random.randint(0, len(sprites.bonus_sprites))         # index is an int:
-        self.sprite = sprites.bonus_sprites[index]  # pylint:disable=invalid-sequence-index
-
-    def place(self):
-    # pylint:disable=invalid-name  # doesn't like single letter x, y
-        x = np.random.randint(0, GRID_WIDTH - 2)
-        y = np.random.randint(0, GRID_HEIGHT - 1)
-        self.position = np.array((x, y))
-
-    def overlaps(self, position):
-        """Return True if position coincides with self.position (or right sprite)"""
-        return (position == self.position).all() or (position == self.position + RIGHT).all()
-
-    def draw(self):
-        Sprite(self.sprite, self.position).draw()
-
-
-class Snake:
-    def __init__(self):
-        self.mouth_open = False
-        self.direction = START_DIRECTION
-        start_position = np.array((START_X, START_Y))
-        positions  = [start_position - START_DIRECTION * i for i in np.arange(START_LENGTH)]
-        directions = [START_DIRECTION,] * START_LENGTH
-        are_full   = [False,] * START_LENGTH
-        self.sections = [
-            {"position": p, "direction": d, "is_full": f}
-            for p, d, f in zip(positions, directions, are_full)
-            ]
-
-    def move(self):
-        """ Move the snake body one step. Grow its tail if last section is full. """
-        if self.sections[-1]["is_full"]:
-            self.sections[-1]["is_full"] = False
-        else:
-            self.sections.pop(-1)
-
-        new_position = self.sections[0]["position"] + self.direction
+        SCREEN.blit(self.get_tile(), sprite_to_pixels(self.position, hud, offset))
+        PROFILER.count("draws")
+
+
+def sprite_to_cells(position, hud = False, offset = (0, 0)):
+    """ Return the screen position (in cells) of the top left corner of a sprite. """
+    cell_x = position[0] * (HUD_SPRITE_W if hud else SPRITE_SIZE)
+    cell_y = position[1] * (HUD_SPRITE_H if hud else SPRITE_SIZE)
+    cell_x += SCREEN_BORDER + offset[0] + (-2 if hud else 0)
+    cell_y += SCREEN_BORDER + offset[1] + (-2 if hud else HUD_BAR)
+    return (cell_x, cell_y)
+
+
+def sprite_to_pixels(position, hud = False, offset = (0, 0)):
+    """ Return the screen position (in pixels) of the top left corner of a sprite. """
+    cell_x, cell_y = sprite_to_cells(position, hud, offset)
+    return (cell_x * CELL_WIDTH, cell_y * CELL_HEIGHT)
+
+
+class Camera:
+    """ The part of the board shown on the screen, which follows the snake head.
+    It wraps around the board edges with WRAP_AROUND, otherwise it stops at them.
+    Only the sprites inside the view are looked up and drawn, so the cost of a frame
+    depends on the view size, not on the board size. The wall sprites of a maze are
+    only looked up again when the view scrolls. """
+    def __init__(self, board):
+        self.board  = board
+        self.size   = np.array((LEVEL_WIDTH // SPRITE_SIZE, LEVEL_HEIGHT // SPRITE_SIZE))
+        self.origin = np.zeros(2, dtype=int)     # Board position of the top left sprite
+        self.walls  = (None, [])    # (origin, wall sprites in the view from there)
+
+    def follow(self, position):
+        """ Scroll the view to keep position (the head) CAMERA_MARGIN sprites from its edges.
+        Center it on position if it was out of the view (new game...) """
+        board_size = np.array((self.board.width, self.board.height))
+        offset = (np.asarray(position) - self.origin) % board_size
+        margin = np.minimum(CAMERA_MARGIN, (self.size - 1) // 2)
+        origin = np.where(offset >= self.size, position - self.size // 2,
+                 np.where(offset < margin, position - margin,
+                 np.where(offset > self.size - 1 - margin, position - self.size + 1 + margin,
+                          self.origin)))
         if WRAP_AROUND:
-            new_position[0] = new_position[0] % GRID_WIDTH
-            new_position[1] = new_position[1] % GRID_HEIGHT
-        new_section = {"position": new_position,
-                       "direction": self.direction,
-                       "is_full": False}
-        self.sections.insert(0, new_section)
-        self.sections[1]["direction"] = self.direction
-
-    def overlaps(self, position, check_itself = False):
-        """Return True if position coincides with any section of the snake"""
-        sections = self.sections[1:] if check_itself else self.sections
-        for section in sections:
-            if (position == section["position"]).all():
-                return True
-        return False
-
-    def eat(self):
-        self.open_mouth()
-        self.sections[0]["is_full"] = True
-
-    def open_mouth(self):
-        self.mouth_open = True
-
-    def close_mouth(self):
-        self.mouth_open = False
-
-    def draw(self):
-        for sprite in self._get_sprites():
-            sprite.draw()
-
-    def _get_sprites(self):
-        """ Return a list of all the snake Sprite objects """
-        head = self._get_head_sprite()
-        body = self._get_body_sprites()
-        tail = self._get_tail_sprite()
-        return head + body + tail
-
-    def _flip_sprite_if_left_or_down(self, sprite, direction):
-        """ Flips the sprite orientation to imitate the Nokia Snake II game """
-        if (direction == LEFT).all():
-            sprite.flip_v()
-        elif (direction == DOWN).all():
-            sprite.flip_h()
-
-    def _get_head_sprite(self):
-        """ Check the head direction and if the mouth is open,
-        return the adequate Sprite object (in a list of length 1)."""
-        head = self.sections[0]
-        sprite = sprites.snake_mouth if self.mouth_open else sprites.snake_head
-        head_sprite = Sprite(sprite, head["position"], head["direction"])
-        self._flip_sprite_if_left_or_down(head_sprite, head["direction"])
-        return [head_sprite,]
-
-    def _get_tail_sprite(self):
-        """ Check the tail direction and if it is full,
-        return the adequate Sprite object (in a list of length 1)."""
-        tail = self.sections[-1]
-        sprite = sprites.snake_full if tail["is_full"] else sprites.snake_tail
-        tail_sprite = Sprite(sprite, tail["position"], tail["direction"])
-        self._flip_sprite_if_left_or_down(tail_sprite, tail["direction"])
-        return [tail_sprite,]
-
-    def _get_body_sprites(self):
-        """ For every body section, check its direction, if it's turning and if it's full,
-        return a list with the adequate Sprite objects."""
-        body_sprites = []
-        for i, section in enumerate(self.sections[1:-1]):
-            section_dir  = section["direction"]
-            previous_dir = self.sections[i+2]["direction"]
-            if (section_dir == previous_dir).all() or section["is_full"]:
-                sprite = sprites.snake_full if section["is_full"] else sprites.snake_body
-                body_sprite = Sprite(sprite, section["position"], section_dir)
-                self._flip_sprite_if_left_or_down(body_sprite, section_dir)
-                body_sprites += [body_sprite,]
-            else:
-                rotate_left=np.array(((0, -1), (1, 0)))
-                if (previous_dir.dot(rotate_left) == section_dir).all():
-                    section_dir = section_dir.dot(rotate_left)
-                body_sprites += [Sprite(sprites.snake_turn, section["position"], section_dir),]
-        return body_sprites
-
-
-class Game:
-# pylint:disable=too-many-instance-attributes
-    def __init__(self):
-        self.pause = True
-        self.score = 0
-        self.hud   = Hud()
-        self.snake = Snake()
-        self.food  = Food()
-        self.bonus = Bonus()
-        self.direction_buffer = []
-        self.next_bonus_timer  = 0
-        self.game_over()
-
-    def handle_movement(self, direction):
-        """ Add last input to the direction buffer. Unpause the game."""
-        self.direction_buffer += [direction,]
-        if len(self.direction_buffer) > 0:
-            self.pause = False
-
-    def handle_input_key(self, key):
-        """ Change directions with arrow keys. Pause / unpause the game with space bar. """
+            origin = origin % board_size
+        else:
+            origin = np.clip(origin, 0, board_size - self.size)
+        self.origin = np.where(board_size > self.size, origin, 0)
+
+    def to_view(self, position, width = 1):
+        """ Return the view position of a sprite on the board (width sprites wide),
+        or None if it is out of the view. """
+        board_size = (self.board.width, self.board.height)
+        view_x, view_y = ((position[i] - self.origin[i]) % board_size[i] for i in (0, 1))
+        if view_x > board_size[0] - width:
+            view_x -= board_size[0]         # Partly visible on the left edge
+        if view_x >= self.size[0] or view_y >= self.size[1]:
+            return None
+        return (view_x, view_y)
+
+    def snake_sections(self, snake):
+        """ Return the sorted sections of the snake (0: head) that are in the view. """
+        window = self.window()
+        slots = snake.slot_at[window][(self.board.cells[window] & ~WALL) >= SNAKE]
+        return np.sort((snake.head_index - slots) % snake.capacity)
+
+    def wall_sprites(self):
+        """ Return the list of (sprite, view position, direction code, flip) of the walls
+        in the view. """
+        origin = tuple(self.origin.tolist())
+        if self.walls[0] != origin:
+            positions = np.argwhere(self.board.walls[self.window()]).tolist()
+            self.walls = (origin, [(sprites.wall, tuple(position), RIGHT_CODE, None)
+                                   for position in positions])
+        return self.walls[1]
+
+    def window(self):
+        """ Return the index of the board cells in the view, as [view x, view y]. """
+        xs = (self.origin[0] + np.arange(self.size[0])) % self.board.width
+        ys = (self.origin[1] + np.arange(self.size[1])) % self.board.height
+        return np.ix_(xs, ys)
+
+
+def get_level_sprites(game):
+    """ Return a list of (sprite, view position, direction code, flip) for all the sprites
+    in the view, in drawing order. """
+    camera = game.camera
+    camera.follow(game.snake.position())
+    level_sprites = list(camera.wall_sprites())
+    if game.food.position is not None:
+        position = camera.to_view(game.food.position)
+        if position is not None:
+            level_sprites += [(sprites.food, position, RIGHT_CODE, None),]
+    if game.bonus is not None:
+        position = camera.to_view(game.bonus.position, width = 2)
+        if position is not None:
+            level_sprites += [(game.bonus.sprite, position, RIGHT_CODE, None),]
+    for section in camera.snake_sections(game.snake).tolist():
+        sprite, position, direction, flip = game.snake.get_sprite(section)
+        level_sprites += [(sprite, camera.to_view(position), direction_code(direction), flip),]
+    return level_sprites
+
+
+def get_level_blits(game):
+    """ Return a list of (tile, pixel position) for all the sprites in the view. """
+    return [(ATLAS.tile(sprite, direction, flip), sprite_to_pixels(position))
+            for sprite, position, direction, flip in get_level_sprites(game)]
+
+
+def level_rect():
+    """ Return the rect of the screen (in pixels) where the level is drawn. """
+    return pygame.Rect(sprite_to_pixels((0, 0)),
+                       (LEVEL_WIDTH * CELL_WIDTH, LEVEL_HEIGHT * CELL_HEIGHT))
+
+class Game(core.Game):
+    """ The game rules from core.Game, plus Pygame input, sound and drawing. """
+    def __init__(self, seed = None, width = GRID_WIDTH, height = GRID_HEIGHT):
+        self.hud = Hud()
+        super().__init__(seed, width, height)
+        self.camera = Camera(self.board)
+        self.last_tick = 0          # time.perf_counter() of the last tick
+        self.advance   = False      # Tick right away (see ADVANCE_ON_TURN)
+        self.unsaved_ticks = 0      # Ticks played since the last save
+
+    def on_eat(self):
+        play_beep()
+
+    def handle_input_key(self, key, stamp = None):
+        """ Change directions with arrow keys. Pause / unpause the game with space bar.
+        Turn the autopilot on / off with A. Rewind the game with backspace (and pause it).
+        Select the speed level with the number keys. stamp: the time.perf_counter() of the
+        input. """
         match key:
-            case pygame.K_UP   : self.handle_movement(UP)
-            case pygame.K_DOWN : self.handle_movement(DOWN)
-            case pygame.K_LEFT : self.handle_movement(LEFT)
-            case pygame.K_RIGHT: self.handle_movement(RIGHT)
+            case pygame.K_UP   : self.turn(UP, stamp)
+            case pygame.K_DOWN : self.turn(DOWN, stamp)
+            case pygame.K_LEFT : self.turn(LEFT, stamp)
+            case pygame.K_RIGHT: self.turn(RIGHT, stamp)
             case pygame.K_SPACE: self.pause = not self.pause
-
-    def handle_input_mouse_button(self, button):
-        """ Change directions by clicking / tapping on the edge of the screen. """
-        if button == pygame.BUTTON_LEFT:
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            if mouse_x < SCREEN_WIDTH / 3:
-                self.handle_movement(LEFT)
-            elif mouse_x > SCREEN_WIDTH * 3 / 4:
-                self.handle_movement(RIGHT)
-            elif mouse_y < SCREEN_HEIGHT / 3:
-                self.handle_movement(UP)
-            elif mouse_y > SCREEN_HEIGHT * 2 / 3:
-                self.handle_movement(DOWN)
-
-    def place_food(self):
-        """ Place food on the screen. Make sure it doesn't overlap any existing sprite. """
-        self.food.place()
-        if self.bonus is not None and self.bonus.overlaps(self.food.position):
-            self.place_food()
-        if self.snake.overlaps(self.food.position):
-            self.place_food()
-
-    def place_bonus(self):
-        """ Place bonus on the screen. Make sure it doesn't overlap any existing sprite. """
-        self.bonus.place()
-        if self.bonus.overlaps(self.food.position) \
-        or self.snake.overlaps(self.bonus.position) \
-        or self.snake.overlaps(self.bonus.position + RIGHT):
-            self.place_bonus()
-
-    def reset_next_bonus_timer(self):
-        # TODO: study actual frequency
-        self.next_bonus_timer = int(np.random.normal(5.5, 0.5))
-
-    def handle_bonus_timers(self):
-        """ Handle bonus timers and create / remove instances. """
-        if self.bonus is None:
-            if self.next_bonus_timer == 0 and self.score > 0:
-                self.bonus = Bonus()
-                self.place_bonus()
+            case pygame.K_a    : self.toggle_autopilot()
+            case pygame.K_BACKSPACE:
+                self.rewind(REWIND_STEP)
+                self.pause = True
+            case _ if 0 <= key - pygame.K_1 < len(SPEED_LEVELS):
+                core.set_speed(SPEED_LEVELS[key - pygame.K_1])
+
+    def save(self):
+        """ Save the game to SNAPSHOT_FILE (if any), to resume it on the next start. """
+        if SNAPSHOT_FILE:
+            core.save_atomically(SNAPSHOT_FILE, self.snapshot())
+        self.unsaved_ticks = 0
+
+    def toggle_autopilot(self):
+        if self.autopilot is None:
+            self.autopilot = Autopilot(self)
+            self.pause = False
         else:
-            if self.bonus.timer == 0:
-                self.bonus = None
-                self.reset_next_bonus_timer()
-            else:
-                self.bonus.timer -= 1
+            print(self.autopilot.report())
+            self.autopilot = None
 
-    def change_direction(self):
-        """ Change snake direction using the two last inputs on the direction buffer. """
-        if len(self.direction_buffer) == 0:
-            return
-        if len(self.direction_buffer) > 2:
-            self.direction_buffer = self.direction_buffer[-2:]
-        direction = self.direction_buffer.pop(0)
-        # This does'n work because you could change directions two times before it moves:
-        # if (self.snake.direction + direction == 0).all():
-        if (self.snake.sections[0]["position"] + direction
-                == self.snake.sections[1]["position"]).all():
-            return
-        self.snake.direction = direction
-
-    def check_collisions(self):
-        """ Check collisions with wall / body / food / bonus. """
-        head_position = self.snake.sections[0]["position"]
-        # Collision with wall:
-        if not 0 <= head_position[0] < GRID_WIDTH or not 0 <= head_position[1] < GRID_HEIGHT:
-            self.game_over()
-        # Collision with body:
-        if self.snake.overlaps(head_position, check_itself=True):
-            self.game_over()
-        # Collision with food:
-        if self.food.overlaps(head_position):
-            self.snake.eat()
-            BEEP.play(maxtime=10)
-            self.score += POINTS
-            self.place_food()
-            self.next_bonus_timer -= 1
-        # Collision with bonus:
-        if self.bonus is not None and self.bonus.overlaps(head_position):
-            self.snake.eat()
-            BEEP.play(maxtime=10)
-            self.score += POINTS * self.bonus.timer
-            self.bonus = None
-            self.reset_next_bonus_timer()
-        # Food or bonus in front:
-        front_position = head_position + self.snake.direction
-        if self.food.overlaps(front_position):
-            self.snake.open_mouth()
-        if self.bonus is not None and self.bonus.overlaps(front_position):
-            self.snake.open_mouth()
-
-    def update(self):
-        if self.pause:
-            return
-        self.snake.close_mouth()
-        self.change_direction()
-        self.snake.move()
-        self.check_collisions()
-        self.handle_bonus_timers()
-
-    def game_over(self):
-        """ Reset game to initial state. """
-        self.pause = True
-        self.score = 0
-        self.bonus = None
-        self.reset_next_bonus_timer()
-        self.snake = Snake()
-        self.place_food()
+    def handle_input_mouse_button(self, button, position, stamp = None):
+        """ Change directions by clicking / tapping on the edges of the screen (TAP_EDGE
+        of its width or height, the left and right edges first). """
+        if button == pygame.BUTTON_LEFT:
+            x, y = position[0] / SCREEN_WIDTH, position[1] / SCREEN_HEIGHT
+            if x < TAP_EDGE:
+                self.turn(LEFT, stamp)
+            elif x > 1 - TAP_EDGE:
+                self.turn(RIGHT, stamp)
+            elif y < TAP_EDGE:
+                self.turn(UP, stamp)
+            elif y > 1 - TAP_EDGE:
+                self.turn(DOWN, stamp)
+
+    def turn(self, direction, stamp):
+        """ Queue a player input. With ADVANCE_ON_TURN, a turn moves the snake right away
+        (see tick), unless the last tick was less than half a GAME_SPEED ago. """
+        if self.handle_movement(direction, stamp) and ADVANCE_ON_TURN:
+            self.advance = time.perf_counter() - self.last_tick >= core.GAME_SPEED / 2000
 
     def draw(self):
         """ Draw the HUD and all the game sprites. """
         self.hud.draw_borders()
         self.hud.draw_score(self.score)
-        self.food.draw()
-        self.snake.draw()
+        blits = get_level_blits(self)
+        SCREEN.set_clip(level_rect())
+        SCREEN.blits(blits, doreturn=False)
+        SCREEN.set_clip(None)
+        PROFILER.count("draws", len(blits))
         if self.bonus is not None:
-            self.bonus.draw()
             self.hud.draw_bonus(self.bonus)
 
 
 class Hud:
     def draw_borders(self):
-    # pylint:disable=invalid-name  # doesn't like lower case variables
-        for x in np.arange(SCREEN_BORDER - 2, LEVEL_WIDTH + SCREEN_BORDER + 2):
-            Cell(x, SCREEN_BORDER + HUD_BAR - 4).draw()
-            Cell(x, SCREEN_BORDER + HUD_BAR - 2).draw()
-            Cell(x, SCREEN_BORDER + HUD_BAR + LEVEL_HEIGHT + 1).draw()
-        for y in np.arange(SCREEN_BORDER + HUD_BAR - 1, SCREEN_BORDER + HUD_BAR + LEVEL_HEIGHT + 1):
-            Cell(SCREEN_BORDER - 2, y).draw()
-            Cell(LEVEL_WIDTH + SCREEN_BORDER + 1, y).draw()
+        for x, y in self.get_border_cells():
+            Cell(x, y).draw()
 
     def draw_score(self, score):
-        score_sprites = self._get_number_sprites(score, 4)
-        for i, sprite in enumerate(score_sprites):
-            Sprite(sprite, (i, 0)).draw(hud = True)
+        for sprite, position, offset in self.get_score_sprites(score):
+            Sprite(sprite, position).draw(hud = True, offset = offset)
 
     def draw_bonus(self, bonus):
-        Sprite(bonus.sprite, (GRID_WIDTH - 4, 0)).draw(hud = True, offset = (2, 1))
-        score_sprites = self._get_number_sprites(bonus.timer, 2)
-        for i, sprite in enumerate(score_sprites):
-            Sprite(sprite, (GRID_WIDTH - 2 + i, 0)).draw(hud = True, offset = (2, 0))
+        for sprite, position, offset in self.get_bonus_sprites(bonus):
+            Sprite(sprite, position).draw(hud = True, offset = offset)
+
+    def get_border_cells(self):
+        """ Return a list of the (x, y) cells of the borders around the HUD and the level """
+    # pylint:disable=invalid-name  # doesn't like lower case variables
+        cells = []
+        for x in np.arange(SCREEN_BORDER - 2, LEVEL_WIDTH + SCREEN_BORDER + 2):
+            cells += [(x, SCREEN_BORDER + HUD_BAR - 4),
+                      (x, SCREEN_BORDER + HUD_BAR - 2),
+                      (x, SCREEN_BORDER + HUD_BAR + LEVEL_HEIGHT + 1)]
+        for y in np.arange(SCREEN_BORDER + HUD_BAR - 1, SCREEN_BORDER + HUD_BAR + LEVEL_HEIGHT + 1):
+            cells += [(SCREEN_BORDER - 2, y),
+                      (LEVEL_WIDTH + SCREEN_BORDER + 1, y)]
+        return cells
+
+    def get_score_sprites(self, score):
+        """ Return a list of (sprite, HUD position, offset) for the score """
+        return [(sprite, (i, 0), (0, 0))
+                for i, sprite in enumerate(self._get_number_sprites(score, 4))]
+
+    def get_bonus_sprites(self, bonus):
+        """ Return a list of (sprite, HUD position, offset) for the bonus and its timer """
+        right = LEVEL_WIDTH // SPRITE_SIZE
+        return [(bonus.sprite, (right - 4, 0), (2, 1)),] + \
+               [(sprite, (right - 2 + i, 0), (2, 0))
+                for i, sprite in enumerate(self._get_number_sprites(bonus.timer, 2))]
 
     def _get_number_sprites(self, number, digits):
         """ Return a list of number Sprite objects for the last n digits of number"""
@@ -435,11 +436,220 @@ class Hud:
         return numbers_sprites
 
 
-def _check_sprites_size(sprites_list, width, height):
-    """ Check that all the sprites conform to their expected size. """
-    for sprite in sprites_list:
-        assert np.array(sprite).shape[0] == height
-        assert np.array(sprite).shape[1] == width
+class Renderer:
+    """ Compose the screen from layers and only update the parts that changed:
+    - the background and borders are baked once into a Surface,
+    - the HUD is redrawn only when the score or the bonus change,
+    - the level sprites are compared with the last frame, sprite by sprite. """
+    def __init__(self, hud):
+        self.hud = hud
+        _draw_background()
+        hud.draw_borders()
+        self.background = SCREEN.copy()
+        self.hud_rect = pygame.Rect(0, 0, SCREEN.get_width(),
+                                    (SCREEN_BORDER + HUD_BAR - 4) * CELL_HEIGHT)
+        self.level_rect = level_rect()
+        self.overlay = None         # Lines of text to show on the top bar (or None)
+        self.font = None
+        self.hud_state = None
+        self.overlay_rect = None
+        self.level_tiles = {}       # {pixel position: tile} drawn on the last frame
+        self.dirty_rects = []
+        self.invalidate()
+
+    def invalidate(self):
+        """ Redraw the whole screen on the next frame (first frame, window exposed...) """
+        self.hud_state = None
+        self.overlay_rect = None
+        self.level_tiles = {}
+        SCREEN.blit(self.background, (0, 0))
+        self.dirty_rects = [SCREEN.get_rect(),]
+
+    def draw(self, game):
+        """ Draw the game and return the list of rects of the screen that changed. """
+        self._draw_hud(game)
+        self._draw_level(game)
+        self._draw_overlay(self.overlay)
+        dirty_rects, self.dirty_rects = self.dirty_rects, []
+        return dirty_rects
+
+    def _draw_hud(self, game):
+        bonus_state = None if game.bonus is None else (game.bonus.sprite, game.bonus.timer)
+        if (game.score, bonus_state) == self.hud_state:
+            return
+        self.hud_state = (game.score, bonus_state)
+        SCREEN.blit(self.background, self.hud_rect, self.hud_rect)
+        PROFILER.count("draws")
+        self.overlay_rect = None
+        self.hud.draw_score(game.score)
+        if game.bonus is not None:
+            self.hud.draw_bonus(game.bonus)
+        self.dirty_rects += [self.hud_rect,]
+
+    def _draw_level(self, game):
+        tiles = dict((position, tile) for tile, position in get_level_blits(game))
+        SCREEN.set_clip(self.level_rect)   # The bonus can stick out of the view
+        for position, tile in self.level_tiles.items():
+            if tiles.get(position) is not tile:
+                rect = tile.get_rect(topleft = position).clip(self.level_rect)
+                SCREEN.blit(self.background, rect, rect)
+                PROFILER.count("draws")
+                self.dirty_rects += [rect,]
+        for position, tile in tiles.items():
+            if self.level_tiles.get(position) is not tile:
+                rect = SCREEN.blit(tile, position)
+                PROFILER.count("draws")
+                self.dirty_rects += [rect,]
+        SCREEN.set_clip(None)
+        self.level_tiles = tiles
+
+    def _draw_overlay(self, lines):
+        """ Draw some lines of text on the top bar, between the score and the bonus.
+        lines = None: erase the text. """
+        if self.overlay_rect is not None:
+            SCREEN.blit(self.background, self.overlay_rect, self.overlay_rect)
+            self.dirty_rects += [self.overlay_rect,]
+            self.overlay_rect = None
+        if lines is None:
+            return
+        left   = sprite_to_pixels((4, 0), hud = True)[0] + CELL_WIDTH
+        right  = sprite_to_pixels((LEVEL_WIDTH // SPRITE_SIZE - 4, 0), hud = True, offset = (2, 1))[0]
+        area   = pygame.Rect(left, CELL_HEIGHT, right - left - CELL_WIDTH,
+                             self.hud_rect.height - CELL_HEIGHT)
+        if self.font is None:
+            self.font = pygame.font.Font(None, area.height // len(lines) + 2)
+        for i, line in enumerate(lines):
+            text = self.font.render(line, False, CELL_COLOR)
+            SCREEN.blit(text, (area.x, area.y + i * self.font.get_linesize()),
+                        pygame.Rect(0, 0, area.width, text.get_height()))
+        self.overlay_rect = area
+        self.dirty_rects += [area,]
+
+
+class CellRenderer(Renderer):
+    """ Rasterize the whole frame in one pass: the borders, the HUD and the level sprites
+    are set in a boolean matrix of cells (one item per "fake pixel") with slice assignments.
+    The part of the matrix that changed since the last frame is expanded to pixels
+    (leaving the BORDER_WIDTH gaps) with NumPy and pushed with a single
+    pygame.surfarray.blit_array. The Python work per frame doesn't depend on the number
+    of lit cells. The profiler overlay is drawn on top, like in Renderer. """
+    def __init__(self, hud):
+        super().__init__(hud)
+        width, height = SCREEN.get_width() // CELL_WIDTH, SCREEN.get_height() // CELL_HEIGHT
+        self.borders = np.zeros((width, height), dtype=bool)
+        self.borders[tuple(np.array(hud.get_border_cells()).T)] = True
+        self.cells = np.zeros_like(self.borders)
+        self.last_cells = None
+        x, y = sprite_to_cells((0, 0))
+        self.view_size = (LEVEL_WIDTH // SPRITE_SIZE, LEVEL_HEIGHT // SPRITE_SIZE)
+        # View of the level cells as [sprite x, sprite y, cell x, cell y] blocks
+        self.blocks = self.cells[x : x + LEVEL_WIDTH, y : y + LEVEL_HEIGHT].reshape(
+            self.view_size[0], SPRITE_SIZE, self.view_size[1], SPRITE_SIZE).transpose(0, 2, 1, 3)
+        # Pixels that a lit cell colors: all of them but the gaps between cells
+        self.cell_pixels = (np.arange(SCREEN.get_width())[:, None] % CELL_WIDTH >= BORDER_WIDTH) \
+                         & (np.arange(SCREEN.get_height()) % CELL_HEIGHT >= BORDER_WIDTH)
+        self.pixels = np.empty_like(self.cell_pixels)
+        _draw_background()
+        self.background_pixels = pygame.surfarray.array2d(SCREEN)
+        self.frame = np.empty_like(self.background_pixels)
+        self.cell_color = SCREEN.map_rgb(CELL_COLOR)
+        # The bitmaps of every level sprite, stacked in the order of their codes (0: none):
+        # the snake body (core.BODY_SPRITES codes + 1), heads, tails, food, wall, bonus halves
+        level_sprites = [(sprite, direction_code(direction), flip)
+                         for sprite, direction, flip in core.BODY_SPRITES]
+        self.head_code = 1 + len(level_sprites)     # + 4 if the mouth is open, + direction
+        self.tail_code = self.head_code + 8         # + 4 if it is full, + direction
+        level_sprites += [(sprite, code, core.FLIPS[code]) for sprite in
+                          (sprites.snake_head, sprites.snake_mouth,
+                           sprites.snake_tail, sprites.snake_full) for code in range(4)]
+        self.food_code = 1 + len(level_sprites)
+        self.wall_code = self.food_code + 1
+        self.bonus_code = self.wall_code + 1        # + 2 * bonus sprite index (+ 1: right half)
+        level_sprites += [(sprites.food, RIGHT_CODE, None), (sprites.wall, RIGHT_CODE, None)]
+        bitmaps = [np.zeros((SPRITE_SIZE, SPRITE_SIZE), dtype=bool),]
+        bitmaps += [ATLAS.bitmap(*sprite) for sprite in level_sprites]
+        for sprite in sprites.bonus_sprites:
+            bitmap = ATLAS.bitmap(sprite)
+            bitmaps += [bitmap[:SPRITE_SIZE], bitmap[SPRITE_SIZE:]]
+        self.stack = np.array(bitmaps)
+
+    def invalidate(self):
+        super().invalidate()
+        self.last_cells = None
+
+    def draw(self, game):
+        """ Draw the game and return the list of rects of the screen that changed. """
+        self.cells[...] = self.borders
+        hud_sprites = self.hud.get_score_sprites(game.score)
+        if game.bonus is not None:
+            hud_sprites += self.hud.get_bonus_sprites(game.bonus)
+        for sprite, position, offset in hud_sprites:
+            self._place(self.cells, ATLAS.bitmap(sprite), sprite_to_cells(position, True, offset))
+        self._place_level(game)
+
+        changed = self.cells if self.last_cells is None else self.cells != self.last_cells
+        columns, rows = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+        if len(columns):
+            self.last_cells = self.cells.copy()
+            self._draw_cells(slice(columns[0], columns[-1] + 1), slice(rows[0], rows[-1] + 1))
+        self._draw_overlay(self.overlay)
+        dirty_rects, self.dirty_rects = self.dirty_rects, []
+        return dirty_rects
+
+    def _draw_cells(self, columns, rows):
+        """ Expand the cells in columns x rows (slices) to pixels and blit them. """
+        rect = pygame.Rect(columns.start * CELL_WIDTH, rows.start * CELL_HEIGHT,
+                           (columns.stop - columns.start) * CELL_WIDTH,
+                           (rows.stop - rows.start) * CELL_HEIGHT)
+        area = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+        expanded = np.repeat(np.repeat(self.cells[columns, rows], CELL_WIDTH, axis=0),
+                             CELL_HEIGHT, axis=1)
+        pixels = np.logical_and(expanded, self.cell_pixels[area], out=self.pixels[area])
+        frame = self.frame[area]
+        np.copyto(frame, self.background_pixels[area])
+        np.copyto(frame, self.cell_color, where=pixels)
+        pygame.surfarray.blit_array(SCREEN.subsurface(rect), frame)
+        PROFILER.count("draws")
+        self.dirty_rects += [rect,]
+
+    def _place_level(self, game):
+        """ Light the cells of all the level sprites with a single assignment: every sprite
+        of the view gets a code (see self.stack) from the board cells and the snake sprite
+        codes, and the blocks of the view are filled with the stacked bitmaps of the codes. """
+        camera, snake = game.camera, game.snake
+        camera.follow(snake.position())
+        window = camera.window()
+        cells = game.board.cells[window]
+        codes = np.where(cells & WALL, self.wall_code, np.where(cells & FOOD, self.food_code, 0))
+        on_snake = (cells & ~WALL) >= SNAKE
+        slots = snake.slot_at[window][on_snake]
+        directions = snake.directions[slots]
+        codes[on_snake] = np.where(slots == snake.head_index,
+                                   self.head_code + 4 * snake.mouth_open + directions,
+                          np.where(slots == snake.slot(-1),
+                                   self.tail_code + 4 * snake.are_full[slots] + directions,
+                                   snake.sprite_codes[slots] + 1))
+        if game.bonus is not None:
+            position = camera.to_view(game.bonus.position, width = 2)
+            if position is not None:
+                x, y = position
+                code = self.bonus_code + 2 * sprites.bonus_sprites.index(game.bonus.sprite)
+                for i in (0, 1):
+                    if 0 <= x + i < self.view_size[0]:
+                        codes[x + i, y] = code + i
+        self.blocks |= self.stack[codes]
+
+    @staticmethod
+    def _place(cells, bitmap, position):
+        """ Light the cells of bitmap with its top left corner on position (clipped to cells) """
+        x, y = position
+        width, height = bitmap.shape
+        left, top = max(0, -x), max(0, -y)
+        right  = min(width,  cells.shape[0] - x)
+        bottom = min(height, cells.shape[1] - y)
+        if left < right and top < bottom:
+            cells[x + left : x + right, y + top : y + bottom] |= bitmap[left:right, top:bottom]
+
 
 def _draw_background():
     """ Draw a rectangle the size of the screen with a gradient at the edges. """
@@ -450,46 +660,142 @@ def _draw_background():
     surface = pygame.transform.smoothscale(surface, (SCREEN.get_width(), SCREEN.get_height()))
     SCREEN.blit(surface, pygame.Rect(0, 0, SCREEN.get_width(), SCREEN.get_height()))
 
+def tick():
+    """ Play one game tick. """
+    with PROFILER.phase("update"):
+        game.update()
+    game.last_tick = time.perf_counter()
+    game.unsaved_ticks += 1
+
 async def main():
     """ Handle the game loop. """
+    # pylint:disable=too-many-branches
+    pacer = FramePacer(MAX_FPS, FRAME_PACING)
+    scheduler = TickScheduler(core.GAME_SPEED / 1000, MAX_CATCH_UP)
+    show_profiler = SHOW_PROFILER
+    paused, snake = game.pause, game.snake
     while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-            if event.type == pygame.KEYDOWN:
-                game.handle_input_key(event.key)
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                game.handle_input_mouse_button(event.button)
-            if event.type == TIMER:
-                game.update()
-
-        _draw_background()
-        game.draw()
-        pygame.display.update()
-        await asyncio.sleep(0)
-
-if __name__=="__main__":
-    _check_sprites_size(sprites.main_sprites, SPRITE_SIZE, SPRITE_SIZE)
-    _check_sprites_size(sprites.bonus_sprites, 2*SPRITE_SIZE, SPRITE_SIZE)
-    _check_sprites_size(sprites.number_sprites, HUD_SPRITE_W, HUD_SPRITE_H)
-
-    pygame.init()
-    pygame.mixer.init()
-
+        events = await pacer.get_events(None if game.pause else scheduler.time_to_tick())
+        if game.pause or scheduler.period != core.GAME_SPEED / 1000:
+            # No ticks are due while paused: an input may unpause it, a full period before
+            # the next tick. The same after a speed change
+            scheduler.reset(core.GAME_SPEED / 1000)
+        with PROFILER.phase("events"):
+            for event in events:
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    print(pacer.report())
+                    print(scheduler.report())
+                    print(f"{PROFILER.latency_report()}, {game.inputs.dropped} dropped")
+                    if game.autopilot is not None:
+                        print(game.autopilot.report())
+                    if RECORD_FILE and game.recorder is not None and not WEB:
+                        game.recorder.save(RECORD_FILE)
+                    game.save()
+                    if PROFILE_FILE and not WEB:
+                        PROFILER.dump(PROFILE_FILE)
+                    return
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    show_profiler = not show_profiler
+                    pacer.invalidate()
+                elif event.type == pygame.KEYDOWN:
+                    game.handle_input_key(event.key, time.perf_counter())
+                    pacer.invalidate()
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    game.handle_input_mouse_button(event.button, event.pos, time.perf_counter())
+                    pacer.invalidate()
+                if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    renderer.invalidate()
+                    pacer.invalidate()
+            if game.advance:
+                game.advance = False
+                tick()
+                scheduler.reset()       # The next tick is a full period away
+                pacer.invalidate()
+            for _ in range(0 if game.pause else scheduler.due_ticks()):
+                tick()
+                pacer.invalidate()
+        # The browser can close the page without a QUIT event: the game is saved on pause,
+        # on game over (a new snake) and every SNAPSHOT_TICKS ticks too
+        if (game.pause and not paused) or game.snake is not snake \
+                or game.unsaved_ticks >= SNAPSHOT_TICKS:
+            with PROFILER.phase("save"):
+                game.save()
+        paused, snake = game.pause, game.snake
+
+        if pacer.should_draw():
+            with PROFILER.phase("draw"):
+                renderer.overlay = PROFILER.overlay_lines() if show_profiler else None
+                dirty_rects = renderer.draw(game)
+            with PROFILER.phase("display"):
+                if dirty_rects:
+                    pygame.display.update(dirty_rects)
+                    PROFILER.count("rects", len(dirty_rects))
+            now = time.perf_counter()
+            for stamp in game.applied_inputs:
+                PROFILER.input_shown(now - stamp)
+            game.applied_inputs.clear()
+            PROFILER.end_frame()
+            if PROFILER.frames == 1:
+                PROFILER.startup["first_frame"] = 1000 * (time.perf_counter() - START_TIME)
+                print(PROFILER.startup_report())
+
+def init_display(board_width = GRID_WIDTH, board_height = GRID_HEIGHT):
+    """ Open the window (VIEW_WIDTH x VIEW_HEIGHT sprites, or the board size if it is smaller)
+    and pre-render the sprites. """
+    # pylint:disable=global-variable-undefined,global-statement
+    global SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN, ATLAS, LEVEL_WIDTH, LEVEL_HEIGHT, ASSETS
     pygame.display.set_caption("Snake")
-    pygame.display.set_icon(pygame.image.load("icon.png"))
+    if not WEB:                 # The browser shows the page icon
+        pygame.display.set_icon(pygame.image.load("icon.png"))
 
+    LEVEL_WIDTH  = min(VIEW_WIDTH,  board_width)  * SPRITE_SIZE
+    LEVEL_HEIGHT = min(VIEW_HEIGHT, board_height) * SPRITE_SIZE
     SCREEN_WIDTH  = CELL_WIDTH  * (LEVEL_WIDTH  + 2*SCREEN_BORDER)
     SCREEN_HEIGHT = CELL_HEIGHT * (LEVEL_HEIGHT + 2*SCREEN_BORDER + HUD_BAR)
     SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    start  = time.perf_counter()
+    ASSETS = assets.load(ASSET_SETTINGS)
+    ATLAS  = Atlas(ASSETS)
+    PROFILER.startup["assets"] = 1000 * (time.perf_counter() - start)
+
+def play_beep():
+    """ Play the beep. The mixer is only initialized on the first one: it is slow to start,
+    and browsers don't play sounds before an input anyway. """
+    # pylint:disable=global-statement
+    global BEEP
+    if BEEP is None:
+        try:
+            pygame.mixer.init()
+            BEEP = pygame.mixer.Sound(ASSETS.beep)
+        except pygame.error:
+            BEEP = False        # No audio device: no sound
+    if BEEP:
+        BEEP.play(maxtime=10)
 
-    buffer = np.sin(2 * np.pi * np.arange(44100) * 1760 / 44100).astype(np.float32)
-    BEEP = pygame.mixer.Sound(buffer)
-
-    TIMER = pygame.USEREVENT
-    pygame.time.set_timer(TIMER, GAME_SPEED)
+if __name__=="__main__":
+    # python main.py [WIDTH HEIGHT [MAZE]]: board size, in sprites, and maze (see mazes.py)
+    board_size = [int(n) for n in sys.argv[1:3]] if len(sys.argv) > 2 else (GRID_WIDTH, GRID_HEIGHT)
+    if len(sys.argv) > 3:
+        core.MAZE = sys.argv[3]
 
-    game = Game()
+    pygame.init()
+    init_display(*board_size)
+
+    game = Game(None, *board_size)
+    game.recorder = Recorder(game)
+    if SNAPSHOT_FILE and os.path.exists(SNAPSHOT_FILE):
+        with open(SNAPSHOT_FILE, "rb") as snapshot:
+            data = snapshot.read()
+            try:
+                game.restore(data)
+                game.pause = True
+            except (ValueError, struct.error):
+                pass                    # Another board size, or an old format: start anew
+    if REWIND_TICKS:
+        game.history = History(game, REWIND_TICKS)
+    if AUTOPILOT:
+        game.toggle_autopilot()
+    renderer = CellRenderer(game.hud) if RENDERER == "cells" else Renderer(game.hud)
 
     asyncio.run(main())
-    
\ No newline at end of file
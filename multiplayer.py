@@ -0,0 +1,601 @@
+""" Local / LAN multiplayer: an asyncio server plays one shared board with a core.Snake per
+player, and the clients only send direction inputs.
+
+Every tick, the server broadcasts what changed as 4-byte events (a head added, a tail
+removed, food and bonus placed or taken, points scored, a snake dying...), encoded once
+for all the clients. A client that connects, or that falls behind (its unsent data goes
+over MAX_BACKLOG), gets a keyframe instead: the whole state, in the same events.
+Clients mirror the board from the events (see Mirror).
+
+Messages (little endian). The server sends HELLO when a client connects (player
+NO_PLAYER: the board is full), then a frame per tick: FRAME (kind, tick, number of events)
+followed by the events (EVENT: kind, player, cell or points). The clients send one byte
+per turn: the direction code (see core.DIRECTIONS).
+
+    python multiplayer.py --port 8765                    # serve a board
+    python multiplayer.py --clients 40 --seconds 10      # with 40 simulated players on localhost
+"""
+import argparse
+import asyncio
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+import core
+from core import DIRECTIONS, DIRECTIONS_X, DIRECTIONS_Y, FOOD, BONUS, OPPOSITE
+
+MAGIC     = b"SNKM"
+VERSION   = 1
+HELLO     = struct.Struct("<4sBBHHH?")  # magic, version, player, width, height, tick ms, wrap
+FRAME     = struct.Struct("<BII")       # kind, tick, number of events
+EVENT     = np.dtype([("kind", "u1"), ("player", "u1"), ("value", "<u2")])
+DELTA, KEYFRAME = 0, 1                  # Frame kinds
+# Event kinds. value is a cell (x * height + y) unless told otherwise
+SPAWN, HEAD, TAIL, DIE, LEAVE, FOOD_ON, FOOD_OFF, BONUS_ON, BONUS_OFF, SCORE = range(10)
+# SPAWN: a snake of one section (its tail), that HEAD events extend. TAIL: the tail section
+# leaves its cell. DIE, LEAVE: the snake leaves the board (and the player the game, for
+# LEAVE), value unused. BONUS_ON: player is the bonus sprite index. SCORE: value is points won.
+
+# BEGIN Customize the multiplayer game:
+MAX_PLAYERS     = 250       # Players per board (ids 0 to MAX_PLAYERS - 1)
+NO_PLAYER       = 255       # Player id of HELLO when the board is full
+TICK_SPEED      = 50        # Milliseconds between ticks (20 ticks per second)
+RESPAWN_TICKS   = 10        # Ticks a dead snake waits before it spawns again
+SPAWN_ROOM      = 5         # Free cells needed in front of a spawning snake
+SPAWN_TRIES     = 20        # Random places tried per tick to spawn a snake
+FOOD_PER_PLAYER = 0.5       # Food items on the board per player (at least 1)
+MAX_BACKLOG     = 64 * 1024 # Bytes queued to a client before it skips deltas (and resyncs)
+# END Customize
+
+
+class Player:
+    """ A player of an Arena: its snake stays allocated while it is dead. """
+    __slots__ = ("id", "snake", "inputs", "alive", "score", "respawn_timer")
+
+    def __init__(self, player_id, snake):
+        self.id     = player_id
+        self.snake  = snake
+        self.inputs = core.InputQueue(core.INPUT_BUFFER)
+        self.alive  = False
+        self.score  = 0
+        self.respawn_timer = 0
+
+
+class Arena:
+    """ The authoritative game: one core.Board shared by the snakes of all the players, with
+    the rules of core.Game (food, bonus, collisions), except that a dead snake leaves the
+    board and spawns again somewhere free. tick returns the events of the tick. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, width = 64, height = 36, seed = None):
+        if width * height > 1 << 16:
+            raise ValueError("Boards of more than 65536 cells don't fit in the events")
+        self.rng    = np.random.default_rng(seed)
+        self.board  = core.Board(width, height)
+        self.players = {}           # {player id: Player}
+        self.foods  = set()         # Cells with food
+        self.bonus  = None
+        self.next_bonus_timer = 0
+        self.ticks  = 0
+        self.events = []            # (kind, player, value) since the last tick
+        self._reset_next_bonus_timer()
+
+    def join(self):
+        """ Add a player, who spawns on the next tick. Return its id, or None if the
+        board is full. """
+        free_ids = set(range(MAX_PLAYERS)) - self.players.keys()
+        if not free_ids:
+            return None
+        player = Player(min(free_ids), core.Snake(self.board))
+        self._remove(player.snake)      # It starts in the middle of the board: not yet
+        self.players[player.id] = player
+        return player.id
+
+    def leave(self, player_id):
+        player = self.players.pop(player_id)
+        if player.alive:
+            self._remove(player.snake)
+        self.events += [(LEAVE, player_id, 0),]
+
+    def turn(self, player_id, code):
+        """ Queue a direction code input of a player (ignored while it is dead). """
+        player = self.players.get(player_id)
+        if player is not None and player.alive:
+            player.inputs.push(code, player.snake.direction_code)
+
+    def tick(self):
+        """ Play one tick. Return the events since the last tick, as an EVENT array. """
+        board = self.board
+        alive = [player for player in self.players.values() if player.alive]
+        for player in alive:
+            snake = player.snake
+            snake.close_mouth()
+            self._change_direction(player)
+            tail = snake.slot(-1)
+            if not snake.are_full[tail]:
+                self.events += [(TAIL, player.id, self._cell(snake.x[tail], snake.y[tail])),]
+            snake.move()
+            head = snake.head_index
+            if board.contains((snake.x[head], snake.y[head])):
+                self.events += [(HEAD, player.id, self._cell(snake.x[head], snake.y[head])),]
+        # Collisions are checked once every snake has moved, and before any snake leaves the
+        # board: two heads on a cell both die
+        heads  = [(player, player.snake.position(0)) for player in alive]
+        losers = [player for player, head in heads
+                  if not board.contains(head) or board.sections(head) > 1]
+        for player in losers:
+            self._kill(player)
+        for player in alive:
+            if player.alive:
+                self._eat(player)
+        self._handle_bonus_timers()
+        self._place_foods()
+        self._spawn_players()
+        self.ticks += 1
+        return self.take_events()
+
+    def take_events(self):
+        """ Return the events since the last call, as an EVENT array, and forget them. """
+        events = np.array(self.events, dtype=EVENT)
+        self.events = []
+        return events
+
+    def keyframe(self):
+        """ Return the events that build the current state from an empty board. """
+        events  = [(FOOD_ON, 0, cell) for cell in self.foods]
+        if self.bonus is not None:
+            events += [(BONUS_ON, core.sprites.bonus_sprites.index(self.bonus.sprite),
+                        self._cell(*self.bonus.position)),]
+        for player in self.players.values():
+            if player.alive:
+                events += self._body_events(player)
+            score = player.score
+            while score > 0:
+                events += [(SCORE, player.id, min(score, 0xFFFF)),]
+                score -= 0xFFFF
+        return np.array(events, dtype=EVENT)
+
+    def state(self):
+        """ Return the state the clients mirror (see Mirror.state). """
+        bodies = {}
+        for player in self.players.values():
+            if player.alive:
+                slots = player.snake.slots()[::-1]
+                bodies[player.id] = (player.snake.x[slots].astype(int) * self.board.height
+                                     + player.snake.y[slots]).tolist()
+        bonus = None if self.bonus is None else self._cell(*self.bonus.position)
+        scores = {player.id: player.score for player in self.players.values() if player.score}
+        return bodies, set(self.foods), bonus, scores
+
+    def _change_direction(self, player):
+        """ Turn the snake of player with its oldest input (see core.Game.change_direction). """
+        entry = player.inputs.pop()
+        if entry is None:
+            return
+        snake = player.snake
+        new_position = self.board.wrap(snake.position(0) + DIRECTIONS[entry[0]])
+        if not (new_position == snake.position(1)).all():
+            snake.direction_code = entry[0]
+
+    def _eat(self, player):
+        """ Check the food and bonus under the head of a (living) snake. """
+        board, snake = self.board, player.snake
+        head = snake.position(0)
+        if board.has(head, FOOD):
+            board.take(head, FOOD)
+            self.foods.discard(self._cell(*head))
+            snake.eat()
+            player.score += core.POINTS
+            self.next_bonus_timer -= 1
+            self.events += [(FOOD_OFF, 0, self._cell(*head)), (SCORE, player.id, core.POINTS)]
+        if board.has(head, BONUS):
+            snake.eat()
+            player.score += core.POINTS * self.bonus.timer
+            self.events += [(SCORE, player.id, core.POINTS * self.bonus.timer),]
+            self._remove_bonus()
+            self._reset_next_bonus_timer()
+        if board.has(board.wrap(head + snake.direction), FOOD | BONUS):
+            snake.open_mouth()
+
+    def _kill(self, player):
+        self._remove(player.snake)
+        player.alive = False
+        player.score = 0
+        player.respawn_timer = RESPAWN_TICKS
+        self.events += [(DIE, player.id, 0),]
+
+    def _remove(self, snake):
+        """ Take the sections of a snake off the board. """
+        for slot in snake.slots():
+            self.board.remove_section((snake.x[slot], snake.y[slot]))
+
+    def _spawn_players(self):
+        for player in self.players.values():
+            if player.alive:
+                continue
+            if player.respawn_timer > 0:
+                player.respawn_timer -= 1
+                continue
+            for _ in range(SPAWN_TRIES):
+                if self._spawn(player):
+                    break
+
+    def _spawn(self, player):
+        """ Put the snake of player on a random free straight line of cells, facing a random
+        direction with SPAWN_ROOM free cells in front of it. Return False if it doesn't fit. """
+        board = self.board
+        tail = board.random_free_cell(self.rng)
+        if tail is None:
+            return False
+        code = int(self.rng.integers(len(DIRECTIONS)))
+        line = tail + DIRECTIONS[code] * np.arange(core.START_LENGTH + SPAWN_ROOM)[:, None]
+        if core.WRAP_AROUND:
+            line %= (board.width, board.height)
+        elif not ((line >= 0) & (line < (board.width, board.height))).all():
+            return False
+        if board.cells[line[:, 0], line[:, 1]].any():
+            return False
+        snake = player.snake
+        length = core.START_LENGTH
+        snake.load(line[length - 1], np.full(length, code, dtype=np.int8),
+                   np.zeros(length, dtype=np.int8), False)
+        for x, y in line[:length]:      # pylint:disable=invalid-name
+            board.add_section((x, y))
+        player.inputs.load(())
+        player.alive = True
+        self.events += self._body_events(player)
+        return True
+
+    def _body_events(self, player):
+        """ Return the events that build the snake of player, from its tail. """
+        snake = player.snake
+        slots = snake.slots()[::-1]
+        cells = (snake.x[slots].astype(int) * self.board.height + snake.y[slots]).tolist()
+        return [(SPAWN, player.id, cells[0]),] + [(HEAD, player.id, cell) for cell in cells[1:]]
+
+    def _place_foods(self):
+        """ Place food until there is FOOD_PER_PLAYER per player (or no room left). """
+        target = max(1, round(FOOD_PER_PLAYER * len(self.players)))
+        while len(self.foods) < target:
+            position = self.board.random_free_cell(self.rng)
+            if position is None:
+                return
+            self.board.put(position, FOOD)
+            self.foods.add(self._cell(*position))
+            self.events += [(FOOD_ON, 0, self._cell(*position)),]
+
+    def _handle_bonus_timers(self):
+        """ Handle the bonus timers (see core.Game.handle_bonus_timers). """
+        if self.bonus is None:
+            if self.next_bonus_timer <= 0 and any(p.score for p in self.players.values()):
+                self.bonus = core.Bonus(self.rng)
+                self.bonus.place(self.board.random_free_pair(self.rng))
+                if self.bonus.position is None:
+                    self.bonus = None
+                    return
+                self.board.put(self.bonus.position, BONUS)
+                self.board.put(self.bonus.position + core.RIGHT, BONUS)
+                self.events += [(BONUS_ON, core.sprites.bonus_sprites.index(self.bonus.sprite),
+                                 self._cell(*self.bonus.position)),]
+        elif self.bonus.timer == 0:
+            self._remove_bonus()
+            self._reset_next_bonus_timer()
+        else:
+            self.bonus.timer -= 1
+
+    def _remove_bonus(self):
+        self.events += [(BONUS_OFF, 0, self._cell(*self.bonus.position)),]
+        self.board.take(self.bonus.position, BONUS)
+        self.board.take(self.bonus.position + core.RIGHT, BONUS)
+        self.bonus = None
+
+    def _reset_next_bonus_timer(self):
+        self.next_bonus_timer = int(self.rng.normal(5.5, 0.5))
+
+    def _cell(self, x, y):
+        return int(x) * self.board.height + int(y)
+
+
+class Server:
+    """ Serve an Arena to TCP clients: one player per connection. run plays the ticks. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, arena, tick_speed = TICK_SPEED):
+        self.arena   = arena
+        self.period  = tick_speed / 1000
+        self.writers = {}           # {player id: asyncio.StreamWriter}
+        self.stale   = set()        # Players whose client needs a keyframe
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.keyframes = 0
+        self.late_ticks = 0         # Ticks more than a period late (the missed ones are skipped)
+        self.tick_time = 0          # Seconds spent playing and sending the ticks
+
+    async def start(self, host = "127.0.0.1", port = 8765):
+        """ Start accepting clients. Return the asyncio.Server (port 0: any free port). """
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    async def handle_client(self, reader, writer):
+        board = self.arena.board
+        player = self.arena.join()
+        writer.write(HELLO.pack(MAGIC, VERSION, NO_PLAYER if player is None else player,
+                                board.width, board.height, round(1000 * self.period),
+                                core.WRAP_AROUND))
+        if player is None:
+            writer.close()
+            return
+        self.writers[player] = writer
+        self.stale.add(player)      # The next tick sends it a keyframe
+        try:
+            while data := await reader.read(256):
+                for code in data:
+                    if code < len(DIRECTIONS):
+                        self.arena.turn(player, code)
+        except ConnectionError:
+            pass
+        finally:
+            del self.writers[player]
+            self.stale.discard(player)
+            self.arena.leave(player)
+            writer.close()
+
+    async def run(self, seconds = None):
+        """ Play a tick every period (for seconds, or forever), on a fixed schedule. """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        end = None if seconds is None else next_tick + seconds
+        while end is None or next_tick < end:
+            next_tick += self.period
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            if loop.time() - next_tick > self.period:
+                self.late_ticks += 1
+                next_tick = loop.time()
+            self.step()
+
+    def step(self):
+        """ Play one tick and send it to every client. """
+        start = time.perf_counter()
+        events = self.arena.tick()
+        delta = FRAME.pack(DELTA, self.arena.ticks, len(events)) + events.tobytes()
+        keyframe = None
+        for player, writer in self.writers.items():
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self.stale.add(player)      # Slow client: it will catch up with a keyframe
+                continue
+            if player in self.stale:
+                if keyframe is None:
+                    events = self.arena.keyframe()
+                    keyframe = FRAME.pack(KEYFRAME, self.arena.ticks, len(events)) \
+                             + events.tobytes()
+                data = keyframe
+                self.stale.discard(player)
+                self.keyframes += 1
+            else:
+                data = delta
+            writer.write(data)
+            self.bytes_sent += len(data)
+            self.frames_sent += 1
+        self.tick_time += time.perf_counter() - start
+
+    def report(self):
+        """ Return a summary of the ticks and bandwidth. """
+        ticks = max(1, self.arena.ticks)
+        frame_bytes = self.bytes_sent / max(1, self.frames_sent)
+        return (f"{self.arena.ticks} ticks ({1e6 * self.tick_time / ticks:.0f} us each), "
+                f"{len(self.arena.players)} players, {frame_bytes:.0f} bytes per client per tick "
+                f"({frame_bytes / self.period / 1000:.1f} kB/s), {self.keyframes} keyframes, "
+                f"{self.late_ticks} late ticks")
+
+
+class Mirror:
+    """ The state of an Arena as a client sees it, rebuilt from the frames of the server. """
+    def __init__(self, width, height, wrap_around = True):
+        self.width  = width
+        self.height = height
+        self.wrap_around = wrap_around
+        self.tick   = 0
+        self.clear()
+
+    def clear(self):
+        """ Empty the board (before a keyframe). """
+        self.bodies = {}            # {player id: deque of cells, from tail to head}
+        self.scores = {}            # {player id: score}
+        self.foods  = set()
+        self.bonus  = None          # Left cell
+        self.bonus_sprite = None
+        self.sections = np.zeros(self.width * self.height, dtype=np.int16)  # Sections per cell
+
+    def apply(self, kind, tick, events):
+        """ Apply a frame: kind, tick and its EVENT array. """
+        if kind == KEYFRAME:
+            self.clear()
+        self.tick = tick
+        sections, bodies = self.sections, self.bodies
+        for event, player, value in events.tolist():
+            if event == HEAD:
+                bodies[player].append(value)
+                sections[value] += 1
+            elif event == TAIL:
+                sections[bodies[player].popleft()] -= 1
+            elif event == SPAWN:
+                bodies[player] = deque((value,))
+                sections[value] += 1
+                self.scores.setdefault(player, 0)
+            elif event in (DIE, LEAVE):
+                for cell in bodies.pop(player, ()):
+                    sections[cell] -= 1
+                if event == DIE:
+                    self.scores[player] = 0
+                else:
+                    self.scores.pop(player, None)
+            elif event == FOOD_ON:
+                self.foods.add(value)
+            elif event == FOOD_OFF:
+                self.foods.discard(value)
+            elif event == BONUS_ON:
+                self.bonus, self.bonus_sprite = value, player
+            elif event == BONUS_OFF:
+                self.bonus = self.bonus_sprite = None
+            elif event == SCORE:
+                self.scores[player] = self.scores.get(player, 0) + value
+
+    def state(self):
+        """ Return what Arena.state returns: the bodies, foods, bonus and non-zero scores. """
+        bodies = {player: list(body) for player, body in self.bodies.items()}
+        scores = {player: score for player, score in self.scores.items() if score}
+        return bodies, set(self.foods), self.bonus, scores
+
+    def step(self, cell, code):
+        """ Return the cell next to cell in the direction of code (None: off the board). """
+        x, y = divmod(cell, self.height)
+        x, y = x + DIRECTIONS_X[code], y + DIRECTIONS_Y[code]
+        if self.wrap_around:
+            x, y = x % self.width, y % self.height
+        elif not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        return x * self.height + y
+
+    def direction(self, player):
+        """ Return the direction code of the snake of player (None if it has no neck). """
+        body = self.bodies.get(player)
+        if body is None or len(body) < 2:
+            return None
+        for code in range(len(DIRECTIONS)):
+            if self.step(body[-2], code) == body[-1]:
+                return code
+        return None
+
+
+class Client:
+    """ A connection to a Server: mirrors its board and sends the turns of one player. """
+    def __init__(self):
+        self.player = None
+        self.mirror = None
+        self.reader = self.writer = None
+        self.bytes_received = 0
+
+    async def connect(self, host = "127.0.0.1", port = 8765):
+        """ Join the game. Raise ConnectionError if the board is full. """
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        magic, version, player, width, height, _, wrap_around = \
+            HELLO.unpack(await self.reader.readexactly(HELLO.size))
+        if magic != MAGIC or version != VERSION:
+            raise ConnectionError("Not a Snake server (or an unsupported version)")
+        if player == NO_PLAYER:
+            raise ConnectionError("The board is full")
+        self.player = player
+        self.mirror = Mirror(width, height, wrap_around)
+
+    async def receive(self):
+        """ Wait for the next frame and apply it to the mirror. Return False once the
+        server has closed the connection. """
+        try:
+            kind, tick, n_events = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+            data = await self.reader.readexactly(n_events * EVENT.itemsize)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return False
+        self.bytes_received += FRAME.size + len(data)
+        self.mirror.apply(kind, tick, np.frombuffer(data, dtype=EVENT))
+        return True
+
+    def turn(self, code):
+        self.writer.write(bytes((code,)))
+
+    def close(self):
+        self.writer.close()
+
+
+def choose_direction(mirror, player, rng):
+    """ Return the direction code a simulated player turns to (None: keep going): a free cell
+    next to its head, closest to some food, or a random one. """
+    code = mirror.direction(player)
+    if code is None:
+        return None
+    head = mirror.bodies[player][-1]
+    best, best_distance = None, None
+    for new_code in rng.permutation(len(DIRECTIONS)).tolist():
+        cell = mirror.step(head, new_code)
+        if new_code == OPPOSITE[code] or cell is None or mirror.sections[cell]:
+            continue
+        x, y = divmod(cell, mirror.height)
+        distance = min((abs(x - food // mirror.height) + abs(y - food % mirror.height)
+                        for food in mirror.foods), default=0)
+        if best is None or distance < best_distance:
+            best, best_distance = new_code, distance
+    return None if best == code else best
+
+
+async def simulate_client(host, port, seed):
+    """ Play as a simulated player until the server closes. Return the Client. """
+    rng = np.random.default_rng(seed)
+    client = Client()
+    await client.connect(host, port)
+    while await client.receive():
+        code = choose_direction(client.mirror, client.player, rng)
+        if code is not None:
+            client.turn(code)
+    client.close()
+    return client
+
+
+async def simulate(n_clients, seconds, width, height, tick_speed, seed = 0):
+    """ Run a server on localhost with n_clients simulated players for seconds, then check
+    that every client mirrors the final state of the server. """
+    server = Server(Arena(width, height, seed), tick_speed)
+    listener = await server.start("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    clients = [asyncio.create_task(simulate_client("127.0.0.1", port, seed + i))
+               for i in range(n_clients)]
+    await server.run(seconds)
+    await asyncio.sleep(0.2)        # Let the clients read the last frames
+    state = server.arena.state()
+    print(server.report())
+    listener.close()
+    for writer in list(server.writers.values()):
+        writer.close()
+    clients = await asyncio.gather(*clients)
+    in_sync = sum(client.mirror.tick == server.arena.ticks and client.mirror.state() == state
+                  for client in clients)
+    print(f"{in_sync} of {len(clients)} clients in sync with the server, best score "
+          f"{max(state[3].values(), default=0)}")
+    return in_sync == len(clients)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a multiplayer Snake board.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to serve on "
+                        "(0.0.0.0: the whole LAN, default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8765, help="default: %(default)s")
+    parser.add_argument("--size", default="64x36", help="board size (default: %(default)s)")
+    parser.add_argument("--speed", type=int, default=TICK_SPEED,
+                        help="milliseconds between ticks (default: %(default)s)")
+    parser.add_argument("--seed", type=int, help="random seed of the board")
+    parser.add_argument("--clients", type=int, default=0,
+                        help="run this many simulated players on localhost instead, and check "
+                             "that they stay in sync")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="how long the simulation runs (default: %(default)s)")
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split("x"))
+
+    if args.clients:
+        in_sync = asyncio.run(simulate(args.clients, args.seconds, width, height, args.speed,
+                                       args.seed or 0))
+        raise SystemExit(0 if in_sync else 1)
+
+    async def serve():
+        server = Server(Arena(width, height, args.seed), args.speed)
+        await server.start(args.host, args.port)
+        print(f"Serving a {width}x{height} board on {args.host}:{args.port}")
+        try:
+            await server.run()
+        finally:
+            print(server.report())
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,220 @@
+""" NumPy observations of a core.Game for agents and analytics, updated in place every tick.
+
+An Observation holds planes indexed [plane, x, y] (see PLANES): at cell resolution, one
+item per board cell, and optionally at sprite pixel resolution (SPRITE_SIZE x SPRITE_SIZE
+"fake pixels" per cell, the sprites as Sprite.draw draws them, without the camera).
+A tick only changes a few cells (the head, the neck, the tail, the food and the bonus),
+so only those are written again. A FrameStack keeps the last observations in a
+preallocated ring buffer and returns them as a view.
+
+    game.observation = Observation(game, pixels = True, stack = 4)
+    game.update()
+    game.observation.cells              # (len(PLANES), width, height) uint8
+    game.observation.cell_stack.frames()    # (4, len(PLANES), width, height), oldest first
+"""
+import numpy as np
+
+import assets
+import core
+import sprites
+
+PLANES = ("head", "body", "tail", "food", "bonus", "up", "down", "left", "right", "wall")
+HEAD_PLANE, BODY_PLANE, TAIL_PLANE, FOOD_PLANE, BONUS_PLANE, DIRECTION_PLANES = range(6)
+WALL_PLANE = PLANES.index("wall")   # The walls of the maze (see core.MAZE)
+# The direction planes (one per direction code) are set on every snake section.
+# The pixel planes are the first ones only, up to BONUS_PLANE: the sprites show directions
+SPRITE_SIZE = len(sprites.snake_head)     # Sprite height and width, in "fake pixels"
+
+
+class FrameStack:
+    """ The last size frames (arrays of one shape), oldest first, in a preallocated ring
+    buffer. Every frame is stored twice, size frames apart, so that the last size frames
+    are always one slice of the buffer: frames returns a view, valid until the next push. """
+    def __init__(self, size, frame):
+        self.size = size
+        self.buffer = np.zeros((2 * size, *frame.shape), dtype=frame.dtype)
+        self.next = 0
+        self.clear(frame)
+
+    def clear(self, frame):
+        """ Fill the stack with frame (at the start of an episode). """
+        self.buffer[...] = frame
+
+    def push(self, frame):
+        """ Copy frame in, over the oldest one. """
+        self.buffer[self.next] = frame
+        self.buffer[self.next + self.size] = frame
+        self.next = (self.next + 1) % self.size
+
+    def frames(self):
+        return self.buffer[self.next : self.next + self.size]
+
+
+class Observation:
+    """ The planes of a core.Game (set it as game.observation, it is then updated after every
+    tick). pixels: also keep the planes at sprite pixel resolution. stack: the number of
+    observations kept in cell_stack (and pixel_stack), 0: none. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, game, pixels = False, stack = 0, dtype = np.uint8):
+        self.game = game
+        width, height = game.board.width, game.board.height
+        self.cells  = np.zeros((len(PLANES), width, height), dtype=dtype)
+        self.pixels = np.zeros((BONUS_PLANE + 1, width * SPRITE_SIZE, height * SPRITE_SIZE),
+                               dtype=dtype) if pixels else None
+        self.bitmaps = {}           # {(sprite id, direction code, flip): bitmap}
+        self.snake = self.head = self.tail = self.length = self.mouth_open = None
+        self.head_code = self.tail_code = None
+        self.food = self.bonus = None           # Cells of the items drawn
+        self.food_position = self.bonus_object = self.bonus_position = None
+        self.cell_stack = self.pixel_stack = None
+        self.reset()
+        if stack:
+            self.cell_stack = FrameStack(stack, self.cells)
+            if pixels:
+                self.pixel_stack = FrameStack(stack, self.pixels)
+
+    def reset(self):
+        """ Write all the planes again (after a restore, a rewind...) and fill the stacks. """
+        game, snake = self.game, self.game.snake
+        self.cells.fill(0)
+        self.cells[WALL_PLANE] = game.board.walls
+        slots = snake.slots()
+        xs, ys = snake.x[slots].astype(int), snake.y[slots].astype(int)
+        planes = np.full(len(slots), BODY_PLANE)
+        planes[-1], planes[0] = TAIL_PLANE, HEAD_PLANE
+        inside = (xs >= 0) & (xs < game.board.width) & (ys >= 0) & (ys < game.board.height)
+        xs, ys, planes = xs[inside], ys[inside], planes[inside]
+        self.cells[planes, xs, ys] = 1
+        self.cells[DIRECTION_PLANES + snake.directions[slots][inside], xs, ys] = 1
+        if self.pixels is not None:
+            self.pixels.fill(0)
+            for section in np.flatnonzero(inside).tolist():
+                self._draw_section(snake, section)
+        self.food = self.bonus = None
+        self.food_position = self.bonus_object = self.bonus_position = None
+        self._update_items()
+        self._keep(snake)
+        for frame_stack, frame in ((self.cell_stack, self.cells),
+                                   (self.pixel_stack, self.pixels)):
+            if frame_stack is not None:
+                frame_stack.clear(frame)
+
+    def update(self):
+        """ Write the cells that the last tick changed (called by core.Game.update).
+        Anything else than a tick since the last update (a new game...) writes them all. """
+        # pylint:disable=invalid-name
+        snake = self.game.snake
+        head = self._position(snake, 0)
+        if head != self.head:
+            if snake is not self.snake or snake.length - self.length not in (0, 1) \
+               or snake.length < 3 or self._position(snake, 1) != self.head:
+                self.reset()
+                return
+            cells, contains = self.cells, self.game.board.contains
+            tail = self._position(snake, -1)
+            head_code = int(snake.directions[snake.head_index])
+            neck_code = int(snake.directions[snake.slot(1)])
+            if tail != self.tail:       # The tail moved on (first: the head may take its cell)
+                if contains(self.tail):
+                    x, y = self.tail
+                    cells[TAIL_PLANE, x, y] = cells[DIRECTION_PLANES + self.tail_code, x, y] = 0
+                if contains(tail):
+                    x, y = tail
+                    cells[BODY_PLANE, x, y], cells[TAIL_PLANE, x, y] = 0, 1
+            x, y = self.head            # The neck now, facing the direction of the head
+            cells[HEAD_PLANE, x, y], cells[BODY_PLANE, x, y] = 0, 1
+            cells[DIRECTION_PLANES + self.head_code, x, y] = 0
+            cells[DIRECTION_PLANES + neck_code, x, y] = 1
+            x, y = head
+            cells[HEAD_PLANE, x, y] = cells[DIRECTION_PLANES + head_code, x, y] = 1
+            if self.pixels is not None:
+                for x, y in {self.tail, tail, self.head, head}:
+                    if contains((x, y)):
+                        self._update_pixels(snake, x, y)
+            self.head, self.tail, self.length = head, tail, snake.length
+            self.head_code = head_code
+            self.tail_code = int(snake.directions[snake.slot(-1)])
+        elif snake.mouth_open != self.mouth_open and self.pixels is not None:
+            self._update_pixels(snake, *head)
+        self.mouth_open = snake.mouth_open
+        self._update_items()
+        for frame_stack, frame in ((self.cell_stack, self.cells),
+                                   (self.pixel_stack, self.pixels)):
+            if frame_stack is not None:
+                frame_stack.push(frame)
+
+    def _update_pixels(self, snake, x, y):
+        """ Draw the snake section on the cell (x, y) again on the pixel planes. """
+        # pylint:disable=invalid-name
+        self.pixels[HEAD_PLANE:TAIL_PLANE + 1, x * SPRITE_SIZE:(x + 1) * SPRITE_SIZE,
+                    y * SPRITE_SIZE:(y + 1) * SPRITE_SIZE] = 0
+        if self.game.board.sections((x, y)):
+            self._draw_section(snake, (snake.head_index - int(snake.slot_at[x, y]))
+                                      % snake.capacity)
+
+    def _update_items(self):
+        """ Write the food and bonus planes, if they moved (their positions are new arrays
+        when they do). """
+        game = self.game
+        if game.food.position is not self.food_position:
+            self.food_position = game.food.position
+            food = None if game.food.position is None else \
+                tuple(int(n) for n in game.food.position)
+            if food != self.food:
+                self._draw_item(FOOD_PLANE, self.food, None, 0)
+                self._draw_item(FOOD_PLANE, food, sprites.food, 1)
+                self.food = food
+        position = None if game.bonus is None else game.bonus.position
+        if game.bonus is not self.bonus_object or position is not self.bonus_position:
+            self.bonus_object, self.bonus_position = game.bonus, position
+            bonus = None if game.bonus is None else \
+                (*(int(n) for n in position), id(game.bonus.sprite))
+            if bonus != self.bonus:
+                if self.bonus is not None:
+                    self._draw_item(BONUS_PLANE, self.bonus[:2], None, 0, width = 2)
+                if bonus is not None:
+                    self._draw_item(BONUS_PLANE, bonus[:2], game.bonus.sprite, 1, width = 2)
+                self.bonus = bonus
+
+    def _draw_item(self, plane, position, sprite, value, width = 1):
+        """ Set (value 1) or clear (value 0) an item of width cells on position. """
+        if position is None:
+            return
+        x, y = position     # pylint:disable=invalid-name
+        self.cells[plane, x:x + width, y] = value
+        if self.pixels is not None:
+            block = self.pixels[plane, x * SPRITE_SIZE:(x + width) * SPRITE_SIZE,
+                                y * SPRITE_SIZE:(y + 1) * SPRITE_SIZE]
+            block[...] = 0 if sprite is None else self._bitmap(sprite, core.RIGHT, None)
+
+    def _draw_section(self, snake, section):
+        """ Draw the sprite of a snake section on the pixel planes. """
+        sprite, position, direction, flip = snake.get_sprite(section)
+        plane = HEAD_PLANE if section == 0 else TAIL_PLANE if section == snake.length - 1 \
+           else BODY_PLANE
+        x, y = position * SPRITE_SIZE   # pylint:disable=invalid-name
+        self.pixels[plane, x:x + SPRITE_SIZE, y:y + SPRITE_SIZE] = \
+            self._bitmap(sprite, direction, flip)
+
+    def _bitmap(self, sprite, direction, flip):
+        code = core.direction_code(direction)
+        key = (id(sprite), code, flip)
+        bitmap = self.bitmaps.get(key)
+        if bitmap is None:
+            bitmap = self.bitmaps[key] = assets.transform(sprite, code, flip)
+        return bitmap
+
+    def _keep(self, snake):
+        """ Keep what update compares the next tick with. """
+        self.snake = snake
+        self.head = self._position(snake, 0)
+        self.tail = self._position(snake, -1)
+        self.head_code = int(snake.directions[snake.head_index])
+        self.tail_code = int(snake.directions[snake.slot(-1)])
+        self.length = snake.length
+        self.mouth_open = snake.mouth_open
+
+    @staticmethod
+    def _position(snake, section):
+        slot = snake.slot(section)
+        return (int(snake.x[slot]), int(snake.y[slot]))
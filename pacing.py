@@ -0,0 +1,124 @@
+""" Frame pacing for the game loop: only redraw when needed and sleep in between """
+import asyncio
+import sys
+import time
+
+import numpy as np
+import pygame
+
+WEB = sys.platform == "emscripten"   # pygbag build: the browser can't block on events
+
+
+class FramePacer:
+    """ The screen is redrawn only after something invalidated it (an input, a game tick...),
+    and at most max_fps times per second. In between, the loop sleeps until the next event
+    or until the next frame is due. It also measures the actual frame rate and CPU time. """
+    def __init__(self, max_fps = 60, enabled = True):
+        self.frame_time = 1 / max_fps if max_fps else 0
+        self.enabled = enabled
+        self.pending = True         # Something changed since the last frame
+        self.last_frame = 0
+        self.frames = 0
+        self.start_time = time.perf_counter()
+        self.start_cpu  = time.process_time()
+
+    def invalidate(self):
+        """ Ask for a redraw on the next due frame. """
+        self.pending = True
+
+    def time_to_frame(self):
+        """ Return the seconds until a pending frame is due, or None if there is none. """
+        if not self.pending:
+            return None
+        return max(0, self.last_frame + self.frame_time - time.perf_counter())
+
+    def should_draw(self):
+        """ Return True (and count the frame) if the screen has to be redrawn now. """
+        if self.enabled and self.time_to_frame() != 0:
+            return False
+        self.pending = False
+        self.last_frame = time.perf_counter()
+        self.frames += 1
+        return True
+
+    async def get_events(self, wake_in = None):
+        """ Return the pending events. If there are none and no frame is due yet,
+        sleep until there are or one is, or at most wake_in seconds (None: no limit).
+        Always yields to the asyncio loop. """
+        events = pygame.event.get()
+        if not self.enabled:
+            await asyncio.sleep(0)
+            return events
+        wake_time = None if wake_in is None else time.perf_counter() + wake_in
+        while not events and self.time_to_frame() != 0:
+            timeout = self.time_to_frame()
+            if wake_time is not None:
+                wake_in = wake_time - time.perf_counter()
+                if wake_in <= 0:
+                    break
+                timeout = wake_in if timeout is None else min(timeout, wake_in)
+            if WEB:
+                await asyncio.sleep(self.frame_time if timeout is None else timeout)
+                events = pygame.event.get()
+            else:
+                # pygame.event.wait(0) waits forever (until the next event)
+                event = pygame.event.wait(0 if timeout is None else max(1, int(timeout * 1000)))
+                events = [] if event.type == pygame.NOEVENT else [event,] + pygame.event.get()
+        await asyncio.sleep(0)
+        return events
+
+    def report(self):
+        """ Return a summary of the frame rate and CPU time used since the start. """
+        wall = time.perf_counter() - self.start_time
+        cpu  = time.process_time() - self.start_cpu
+        return (f"{self.frames} frames in {wall:.1f} s ({self.frames / wall:.1f} FPS), "
+                f"CPU time {cpu:.1f} s ({100 * cpu / wall:.0f}% of one core, "
+                f"{max(0, wall - cpu):.1f} s saved over a busy loop)")
+
+
+class TickScheduler:
+    """ Game ticks at a fixed period on a monotonic clock: tick n is due at start + n periods,
+    whatever the time the ticks and frames before it took, so the game speed doesn't drift.
+    Ticks missed during a long frame are played at once (catch-up), at most max_catch_up
+    of them: the ones beyond are skipped, and the schedule moves on from there.
+    It also measures the jitter: how late every tick is played, after it was due. """
+    def __init__(self, period, max_catch_up = 5, window = 600):
+        self.period = period            # Seconds
+        self.max_catch_up = max_catch_up
+        self.next_tick = time.perf_counter() + period
+        self.window = window
+        self.lateness = np.zeros(window)    # Ring buffer, in seconds
+        self.ticks   = 0
+        self.skipped = 0
+
+    def reset(self, period = None):
+        """ Start the schedule again from now (after a pause...), with a new period
+        (in seconds) or the same one: the next tick is a full period away. """
+        if period is not None:
+            self.period = period
+        self.next_tick = time.perf_counter() + self.period
+
+    def time_to_tick(self):
+        """ Return the seconds until the next tick is due (0 if it is already). """
+        return max(0, self.next_tick - time.perf_counter())
+
+    def due_ticks(self):
+        """ Return the number of ticks to play now (and count them as played). """
+        now = time.perf_counter()
+        due = int((now - self.next_tick) // self.period) + 1
+        if due <= 0:
+            return 0
+        played = min(due, self.max_catch_up)
+        for i in range(played):
+            self.lateness[self.ticks % self.window] = now - (self.next_tick + i * self.period)
+            self.ticks += 1
+        self.skipped  += due - played
+        self.next_tick += due * self.period
+        return played
+
+    def report(self):
+        """ Return a summary of the tick lateness (jitter). """
+        lateness = self.lateness[:min(self.ticks, self.window)]
+        p50, p95, p99 = 1000 * np.percentile(lateness, (50, 95, 99)) if self.ticks else (0, 0, 0)
+        return (f"{self.ticks} ticks every {1000 * self.period:.0f} ms, late by p50 {p50:.1f} / "
+                f"p95 {p95:.1f} / p99 {p99:.1f} ms, {self.skipped} skipped")
@@ -0,0 +1,113 @@
+""" Frame profiler: time the phases of the game loop and count things drawn per frame """
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FrameProfiler:
+    """ Time the phases of every frame ("events", "update", "draw"...) and count things
+    (draw calls, Cells...). The last `window` frame and tick times are kept to compute
+    percentiles. Phases can be nested: the time of an inner phase is not counted again
+    in the outer one. Every "update" phase is one game tick. """
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, window = 600):
+        self.window = window
+        self.frame_times = np.zeros(window)    # Ring buffers, in seconds
+        self.tick_times  = np.zeros(window)
+        self.latencies   = np.zeros(window)    # From an input to the frame showing it
+        self.frames = 0
+        self.ticks  = 0
+        self.inputs = 0
+        self.total_latency = 0
+        self.phases   = {}      # Seconds spent in every phase during the current frame
+        self.counters = {}      # Counts during the current frame
+        self.last_counters = {}
+        self.total_phases  = {}
+        self.startup  = {}      # Startup times, in milliseconds ("first_frame"...)
+        self._nested = []       # Time spent in inner phases, for every open phase
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._nested.append(0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            if name == "update":
+                self.tick_times[self.ticks % self.window] = elapsed
+                self.ticks += 1
+
+    def input_shown(self, latency):
+        """ Record the seconds between an input and the first frame showing its effect. """
+        self.latencies[self.inputs % self.window] = latency
+        self.inputs += 1
+        self.total_latency += latency
+
+    def count(self, name, amount = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def end_frame(self):
+        """ Store the times and counters of the frame that has just been drawn. """
+        self.frame_times[self.frames % self.window] = sum(self.phases.values())
+        self.frames += 1
+        for name, seconds in self.phases.items():
+            self.total_phases[name] = self.total_phases.get(name, 0) + seconds
+        self.last_counters, self.counters = self.counters, {}
+        self.phases = {}
+
+    def percentiles(self, times, count):
+        """ Return the p50, p95 and p99 of the last recorded times, in milliseconds. """
+        if count == 0:
+            return (0.0, 0.0, 0.0)
+        return tuple(float(p) for p in 1000 * np.percentile(times[:min(count, self.window)],
+                                                            (50, 95, 99)))
+
+    def stats(self):
+        frames = max(1, self.frames)
+        return {
+            "frames": self.frames,
+            "ticks": self.ticks,
+            "frame_ms_p50_p95_p99": self.percentiles(self.frame_times, self.frames),
+            "tick_ms_p50_p95_p99": self.percentiles(self.tick_times, self.ticks),
+            "inputs": self.inputs,
+            "input_latency_ms_mean": 1000 * self.total_latency / max(1, self.inputs),
+            "input_latency_ms_p50_p95_p99": self.percentiles(self.latencies, self.inputs),
+            "phase_ms_per_frame": {name: 1000 * seconds / frames
+                                   for name, seconds in self.total_phases.items()},
+            "last_frame_counters": self.last_counters,
+            "startup_ms": self.startup,
+        }
+
+    def startup_report(self):
+        """ Return a line with the startup times. """
+        return "Startup: " + ", ".join(f"{name.replace('_', ' ')} {ms:.0f} ms"
+                                       for name, ms in self.startup.items())
+
+    def overlay_lines(self):
+        """ Return a few short lines of text summarizing the stats, for the overlay. """
+        frame = self.percentiles(self.frame_times, self.frames)
+        tick  = self.percentiles(self.tick_times, self.ticks)
+        latency = self.percentiles(self.latencies, self.inputs)
+        counters = " ".join(f"{name} {n}" for name, n in sorted(self.last_counters.items()))
+        return [
+            "frame ms " + "/".join(f"{ms:.2f}" for ms in frame),
+            "tick  ms " + "/".join(f"{ms:.2f}" for ms in tick),
+            "input ms " + "/".join(f"{ms:.0f}" for ms in latency),
+            counters,
+        ]
+
+    def latency_report(self):
+        """ Return a line summarizing the input to screen latency. """
+        p50, p95, p99 = self.percentiles(self.latencies, self.inputs)
+        return (f"Input to screen latency: mean {self.stats()['input_latency_ms_mean']:.1f} ms, "
+                f"p50 {p50:.1f} / p95 {p95:.1f} / p99 {p99:.1f} ms over {self.inputs} turns")
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.stats(), file, indent=2)
@@ -0,0 +1,98 @@
+""" Record the inputs of a game in a compact binary format and replay them without Pygame.
+
+A recording is a header (magic, version, seed, board size, wrap around, number of ticks,
+maze name, size of the start snapshot), the core.Game.snapshot the recording starts from
+(if any: a resumed game) and the direction code the snake moved to on every tick, packed
+4 per byte.
+Replaying it with the same seed (or from the same snapshot) rebuilds the exact same game. """
+import struct
+import sys
+import time
+
+import numpy as np
+
+import core
+
+MAGIC   = b"SNKR"
+VERSION = 3
+HEADER  = struct.Struct("<4sBQHH?I16sI")  # magic, version, seed, width, height, wrap, ticks,
+                                          # maze, start snapshot size
+
+
+class Recorder:
+    """ Collect the direction of every tick of a core.Game (set it as game.recorder).
+    start: the snapshot of the game the recording starts from (None: from its first tick). """
+    def __init__(self, game, start = None):
+        self.seed  = game.seed
+        self.board_size = (game.board.width, game.board.height)
+        self.start = start
+        self.ticks = 0
+        self.codes = bytearray()
+
+    def record(self, code):
+        """ Add the direction code (0 to 3) of one tick. """
+        shift = 2 * (self.ticks % 4)
+        if shift == 0:
+            self.codes.append(0)
+        self.codes[-1] |= code << shift
+        self.ticks += 1
+
+    def rewind(self, ticks):
+        """ Forget the directions of the last ticks (see core.Game.rewind). """
+        self.ticks = max(0, self.ticks - ticks)
+        del self.codes[(self.ticks + 3) // 4:]
+        if self.ticks % 4:
+            self.codes[-1] &= (1 << 2 * (self.ticks % 4)) - 1
+
+    def to_bytes(self):
+        header = HEADER.pack(MAGIC, VERSION, self.seed, *self.board_size,
+                             core.WRAP_AROUND, self.ticks, (core.MAZE or "").encode(),
+                             len(self.start or b""))
+        return header + (self.start or b"") + bytes(self.codes)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+
+def load(data):
+    """ Return the seed, the board (width, height), the maze (see core.MAZE), the array of
+    direction codes and the start snapshot (None: the game starts from its seed) of a
+    recording. """
+    if struct.unpack_from("<4sB", data) != (MAGIC, VERSION):
+        raise ValueError("Not a Snake recording (or an unsupported version)")
+    _, _, seed, width, height, wrap_around, ticks, maze, start_size = HEADER.unpack_from(data)
+    if wrap_around != core.WRAP_AROUND:
+        raise ValueError(f"Recorded with WRAP_AROUND={wrap_around}")
+    start = data[HEADER.size:HEADER.size + start_size] if start_size else None
+    packed = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size + start_size)
+    codes = (packed[:, None] >> np.arange(0, 8, 2, dtype=np.uint8)) & 3
+    maze = maze.rstrip(b"\0").decode() or None
+    return seed, (width, height), maze, codes.ravel()[:ticks], start
+
+
+def replay(data, ticks = None, game = None):
+    """ Rebuild the recorded game and return it, after the first ticks (None: all of them).
+    core.MAZE is set to the recorded maze. game: a core.Game (or subclass) instance created
+    with the recording seed, board size and maze. """
+    seed, board_size, core.MAZE, codes, start = load(data)
+    if game is None:
+        game = core.Game(seed, *board_size)
+    if start is not None:
+        game.restore(start)
+    for code in codes[:ticks].tolist():
+        game.inputs.load((code,))
+        game.pause = False
+        game.update()
+    return game
+
+
+if __name__=="__main__":
+    with open(sys.argv[1], "rb") as recording:
+        recorded = recording.read()
+    start = time.perf_counter()
+    replayed = replay(recorded)
+    seconds = time.perf_counter() - start
+    n_ticks = len(load(recorded)[3])
+    print(f"{n_ticks} ticks replayed in {seconds:.3f} s ({n_ticks / seconds:.0f} ticks/s), "
+          f"score {replayed.score}, length {len(replayed.snake)}")
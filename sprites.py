@@ -37,6 +37,11 @@ snake_tail =   ((0, 0, 0, 0),
                 (0, 1, 1, 1),
                 (0, 0, 0, 0))
 
+wall =         ((1, 1, 1, 1),      # Fills its cell: the walls of a maze join up (see mazes.py)
+                (1, 1, 1, 1),
+                (1, 1, 1, 1),
+                (1, 1, 1, 1))
+
 # Bonus sprites
 
 bird=  ((0, 0, 1, 1, 0, 0, 0, 0),
@@ -121,6 +126,7 @@ zero = ((0, 1, 1, 1),
         (0, 1, 0, 1),
         (0, 1, 1, 1))
 
-main_sprites = [food, snake_head, snake_mouth, snake_body, snake_full, snake_turn, snake_tail]
+main_sprites = [food, snake_head, snake_mouth, snake_body, snake_full, snake_turn, snake_tail,
+                wall]
 bonus_sprites = [bird, bug, mouse, rat]
 number_sprites = [one, two, three, four, five, six, seven, eight, nine, zero]
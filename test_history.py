@@ -0,0 +1,41 @@
+""" Rewinding with history.py must not change the game it keeps (run with pytest). """
+import core
+from core import UP, DOWN, RIGHT
+from history import History
+
+
+def play(game, moves):
+    """ Play a tick per direction of moves (None: no turn), unpaused. """
+    for direction in moves:
+        if direction is not None:
+            game.handle_movement(direction)
+        game.pause = False
+        game.update()
+
+
+def test_game_over_keeps_the_game(monkeypatch):
+    """ A game with a history goes on as a game without one after a game over, queued
+    inputs and random draws included. """
+    monkeypatch.setattr(core, "WRAP_AROUND", False)
+    kept, plain = core.Game(1), core.Game(1)
+    kept.history = History(kept, 100)
+    # From (10, 4) going right: up to the top edge, right, then up off the board
+    moves = [UP, None, None, None, RIGHT, UP] + [DOWN, None, RIGHT] * 10
+    for direction in moves:
+        play(kept, [direction])
+        play(plain, [direction])
+        assert kept.snapshot() == plain.snapshot()
+        assert kept.inputs.codes() == plain.inputs.codes()
+
+
+def test_restore_clears_the_history():
+    game = core.Game(2)
+    game.history = History(game, 100)
+    game.pause = False          # As a rewind leaves it
+    snapshot = game.snapshot()
+    play(game, [None] * 10)
+    game.restore(snapshot)
+    assert game.rewind(50) == 0
+    play(game, [None] * 5)
+    assert game.rewind(50) == 5
+    assert game.snapshot() == snapshot
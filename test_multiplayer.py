@@ -0,0 +1,31 @@
+""" Collisions of the multiplayer Arena (run with pytest). """
+import numpy as np
+
+from core import LEFT, RIGHT, SNAKE, direction_code
+from multiplayer import Arena, DIE
+
+
+def place(arena, tail, direction, length = 3):
+    """ Add a player with a living snake of length sections from tail, going direction.
+    Return its id. """
+    player = arena.players[arena.join()]
+    line = np.array(tail) + np.array(direction) * np.arange(length)[:, None]
+    code = direction_code(direction)
+    player.snake.load(line[-1], np.full(length, code, dtype=np.int8),
+                      np.zeros(length, dtype=np.int8), False)
+    for x, y in line:       # pylint:disable=invalid-name
+        arena.board.add_section((x, y))
+    player.alive = True
+    return player.id
+
+
+def test_head_on():
+    """ Two heads moving to the same cell both die, and leave the board. """
+    arena = Arena(20, 5, seed=0)
+    left  = place(arena, (0, 2), RIGHT)     # Head on (2, 2)
+    right = place(arena, (6, 2), LEFT)      # Head on (4, 2): both move to (3, 2)
+    events = arena.tick()
+    dead = {int(event["player"]) for event in events if event["kind"] == DIE}
+    assert dead == {left, right}
+    assert not any(player.alive for player in arena.players.values())
+    assert not (arena.board.cells & SNAKE).any()
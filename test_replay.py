@@ -0,0 +1,44 @@
+""" Replaying a recording with replay.py must rebuild the recorded game (run with pytest). """
+import numpy as np
+
+import core
+from bot import Autopilot
+from replay import Recorder, replay
+
+
+def play(game, ticks, seed):
+    """ Play ticks ticks, unpaused: the autopilot drives for a while, then random turns. """
+    rng = np.random.default_rng(seed)
+    for _ in range(ticks):
+        if rng.random() < 0.02:
+            game.autopilot = Autopilot(game) if game.autopilot is None else None
+        if game.autopilot is None and rng.random() < 0.3:
+            game.handle_movement(core.DIRECTIONS[rng.integers(len(core.DIRECTIONS))])
+        game.pause = False
+        game.update()
+
+
+def assert_same_game(replayed, game):
+    assert replayed.score == game.score
+    assert len(replayed.snake) == len(game.snake)
+    replayed.pause = game.pause     # The pause is not recorded
+    assert replayed.snapshot() == game.snapshot()
+
+
+def test_replay():
+    game = core.Game(7, 20, 9)
+    game.recorder = Recorder(game)
+    game.autopilot = Autopilot(game)
+    play(game, 2000, seed=1)
+    assert_same_game(replay(game.recorder.to_bytes()), game)
+
+
+def test_replay_from_a_snapshot():
+    """ A resumed game is recorded from the snapshot it was restored from. """
+    played = core.Game(3, 12, 6)
+    play(played, 500, seed=2)
+    game = core.Game(None, 12, 6)
+    game.recorder = Recorder(game)
+    game.restore(played.snapshot())
+    play(game, 1000, seed=3)
+    assert_same_game(replay(game.recorder.to_bytes()), game)
@@ -0,0 +1,223 @@
+""" Play many seeded headless games on every core and print statistics on their results.
+
+Game i uses the seed --seed + i, so any game of a tournament can be played again alone.
+Games end at the first game over, or after --ticks ticks. Workers send back one small
+tuple per game, as soon as it is over, and the parent aggregates them:
+
+    python tournament.py --games 2000                      # the autopilot plays (bot.py)
+    python tournament.py --games 5000 --player random --set BONUS_TIMER=30
+    python tournament.py --games 500 --player script --script RRRRDDLLLLUU --workers 4
+"""
+import argparse
+import ast
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import core
+from bot import Autopilot
+
+# Fields of the result of one game
+RESULT_FIELDS = ("seed", "score", "length", "ticks", "food", "bonuses", "bonuses_eaten", "lost")
+LETTER_CODES  = {"U": 0, "D": 1, "L": 2, "R": 3}    # --script letters, as direction codes
+TURN_CHANCE   = 0.2     # Chance that the random player turns on a tick
+
+CONFIG = None           # Config of the tournament played by this process (see _init_worker)
+
+
+class TournamentGame(core.Game):
+    """ A core.Game that counts what happens until its first game over. """
+    def __init__(self, seed = None, width = core.GRID_WIDTH, height = core.GRID_HEIGHT):
+        self.lost = None            # None while __init__ starts the first game
+        self.food_eaten = self.bonuses = self.bonuses_eaten = 0
+        self.final_score = self.final_length = 0
+        super().__init__(seed, width, height)
+        self.lost = False
+
+    def on_eat(self):
+        if self.board.has(self.snake.position(0), core.BONUS):
+            self.bonuses_eaten += 1
+        else:
+            self.food_eaten += 1
+
+    def place_bonus(self):
+        placed = super().place_bonus()
+        self.bonuses += placed
+        return placed
+
+    def game_over(self):
+        if self.lost is not None:
+            self.lost = True
+        self.final_score, self.final_length = self.score, len(self.snake)
+        super().game_over()
+
+
+def apply_settings(settings):
+    """ Set core.py parameters ({name: value}) in this process. POINTS follows GAME_SPEED
+    unless it is set too. """
+    for name, value in settings.items():
+        if not hasattr(core, name):
+            raise ValueError(f"core.py has no parameter {name}")
+        setattr(core, name, value)
+    if "GAME_SPEED" in settings and "POINTS" not in settings:
+        core.set_speed(core.GAME_SPEED)
+
+
+def _init_worker(config):
+    """ Pool initializer: keep the tournament config and apply its settings. """
+    # pylint:disable=global-statement
+    global CONFIG
+    CONFIG = config
+    apply_settings(config["settings"])
+
+
+def play(seed):
+    """ Play one game with the CONFIG player and return its result (see RESULT_FIELDS). """
+    width, height = CONFIG["size"]
+    game = TournamentGame(seed, width, height)
+    game.pause = False
+    player = CONFIG["player"]
+    if player == "bot":
+        game.autopilot = Autopilot(game)
+    rng = np.random.default_rng(seed)       # The player's own, the game has its own
+    turns = rng.random(CONFIG["ticks"]) < TURN_CHANCE
+    sides = rng.integers(0, 2, CONFIG["ticks"])
+    script = CONFIG["script"]
+    ticks = 0
+    while ticks < CONFIG["ticks"] and not game.lost:
+        if player == "random" and turns[ticks]:
+            # Turn left or right (left three times), never back
+            code = game.snake.direction_code
+            for _ in range(1 + 2 * sides[ticks]):
+                code = core.ROTATE_LEFT[code]
+            game.handle_movement(core.DIRECTIONS[code])
+        elif player == "script":
+            game.handle_movement(core.DIRECTIONS[script[ticks % len(script)]])
+        game.update()
+        ticks += 1
+    if not game.lost:
+        game.final_score, game.final_length = game.score, len(game.snake)
+    return (seed, game.final_score, game.final_length, ticks, game.food_eaten,
+            game.bonuses, game.bonuses_eaten, game.lost)
+
+
+def run(config, games, seed = 0, workers = None, chunksize = None):
+    """ Play games seeded seed, seed + 1... on a pool of workers processes (None: one per
+    core, 1: in this process). Yield the results in the order the games end. """
+    seeds = range(seed, seed + games)
+    if workers == 1:
+        _init_worker(config)
+        yield from map(play, seeds)
+        return
+    workers = workers or os.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, games // (8 * workers))      # Few messages, but balanced loads
+    with multiprocessing.Pool(workers, _init_worker, (config,)) as pool:
+        yield from pool.imap_unordered(play, seeds, chunksize)
+
+
+def summarize(results):
+    """ Return aggregate statistics of a list of results. """
+    table = np.array(results, dtype=np.int64).reshape(-1, len(RESULT_FIELDS))
+    column = dict(zip(RESULT_FIELDS, table.T))
+
+    def distribution(values):
+        p50, p90, p99 = np.percentile(values, (50, 90, 99)) if len(values) else (0, 0, 0)
+        return {"mean": round(float(values.mean()), 2) if len(values) else 0.0,
+                "std": round(float(values.std()), 2) if len(values) else 0.0,
+                "p50": round(float(p50), 2), "p90": round(float(p90), 2),
+                "p99": round(float(p99), 2),
+                "max": int(values.max()) if len(values) else 0}
+
+    ticks, food = int(column["ticks"].sum()), int(column["food"].sum())
+    bonuses = int(column["bonuses"].sum())
+    return {
+        "games": len(table),
+        "lost": int(column["lost"].sum()),
+        "ticks": ticks,
+        "score": distribution(column["score"]),
+        "length": distribution(column["length"]),
+        "game_ticks": distribution(column["ticks"]),
+        "food_per_1000_ticks": round(1000 * food / max(1, ticks), 3),
+        "bonuses_per_food": round(bonuses / max(1, food), 4),
+        "bonuses_eaten_rate": round(int(column["bonuses_eaten"].sum()) / max(1, bonuses), 4),
+    }
+
+
+def parse_settings(assignments):
+    """ Return {name: value} from a list of "NAME=VALUE" strings (Python literals). """
+    settings = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError) as error:
+            raise SystemExit(f"Bad --set value: {assignment}") from error
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many headless Snake games in parallel.")
+    parser.add_argument("--games", type=int, default=1000, help="(default: %(default)s)")
+    parser.add_argument("--ticks", type=int, default=5000,
+                        help="most ticks of one game (default: %(default)s)")
+    parser.add_argument("--size", default=f"{core.GRID_WIDTH}x{core.GRID_HEIGHT}",
+                        help="board size, in sprites (default: %(default)s)")
+    parser.add_argument("--player", choices=("bot", "random", "script"), default="bot",
+                        help="who plays: the autopilot, random turns, or --script "
+                             "(default: %(default)s)")
+    parser.add_argument("--script", default="RRRRDDLLLLUU",
+                        help="directions played in a loop by the script player, "
+                             "one letter (U, D, L, R) per tick (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, help="processes (default: one per core)")
+    parser.add_argument("--chunksize", type=int, help="games sent to a worker at once")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a core.py parameter, like BONUS_TIMER=30 or POINTS=3")
+    parser.add_argument("--output", help="file to write one JSON line per game to")
+    args = parser.parse_args()
+
+    try:
+        width, height = (int(n) for n in args.size.split("x"))
+    except ValueError:
+        parser.error(f"--size must be WIDTHxHEIGHT, like 20x9: {args.size}")
+    if width < 1 or height < 1:
+        parser.error(f"--size must be positive: {args.size}")
+    if not args.script or not set(args.script.upper()) <= LETTER_CODES.keys():
+        parser.error(f"--script must be letters U, D, L and R: {args.script!r}")
+    config = {
+        "size": (width, height),
+        "ticks": args.ticks,
+        "player": args.player,
+        "script": [LETTER_CODES[letter] for letter in args.script.upper()],
+        "settings": parse_settings(args.set),
+    }
+    try:
+        apply_settings(config["settings"])     # Fail early on unknown names
+    except ValueError as error:
+        parser.error(str(error))
+    results = []
+    start = time.perf_counter()
+    with open(args.output or os.devnull, "w", encoding="utf-8") as output:
+        for result in run(config, args.games, args.seed, args.workers, args.chunksize):
+            results += [result,]
+            output.write(json.dumps(dict(zip(RESULT_FIELDS, result))) + "\n")
+            if len(results) % max(1, args.games // 10) == 0:
+                print(f"{len(results)} / {args.games} games", file=sys.stderr)
+    seconds = time.perf_counter() - start
+
+    summary = summarize(results)
+    summary["seconds"] = round(seconds, 3)
+    summary["games_per_s"] = round(len(results) / seconds, 1)
+    summary["ticks_per_s"] = round(summary["ticks"] / seconds)
+    summary["workers"] = args.workers or os.cpu_count()
+    summary["settings"] = config["settings"]
+    print(json.dumps(summary, indent=2))
+
+
+if __name__=="__main__":
+    main()